@@ -0,0 +1,195 @@
+"""
+Benchmarks smc_gpu_cacher and smc_ref_wrapper on synthetic in-memory scenes, without Maya.
+
+    python benchmarks/bench_smc.py --refs 200 --caches 50 --latency 0.00005 --json bench.json
+
+Reports wall time and the number of maya commands issued per call. Latency injection adds a fixed
+cost to every maya command to approximate a heavy interactive session.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import shutil
+import string
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_maya
+import fake_qt
+
+PREFIXES = ["chr", "prp", "spr", "set"]
+
+
+def cache_name(index):
+    return "".join(string.ascii_letters[(index // 52 ** k) % 52] for k in range(6))
+
+
+def build_scene(root, refs, caches, refs_per_cache=2, latency=0.0):
+    """
+    Scene with refs references and caches gpuCache nodes of refs_per_cache references each,
+    every other cache enabled. Cache files are written to root/a_gpuCacherTemp like GpuCacherTool does.
+    """
+
+    scene = fake_maya.Scene(scene_name=os.path.join(root, "shots", "sh010", "anim", "sh010_anim_v001.ma"),
+                            latency=latency)
+    cache_dir = os.path.join(root, "a_gpuCacherTemp")
+    start_name = os.path.basename(scene.scene_name).split(".")[0]
+    start, end = scene.playback["ast"], scene.playback["aet"]
+
+    rfns = []
+    for i in range(refs):
+        prefix = PREFIXES[i % len(PREFIXES)]
+        namespace = "%s_asset%04i" % (prefix, i)
+        ref_file = "/proj/assets/%s/%s/rig/%s_rig_v%03i.ma" % (prefix, namespace, namespace, i % 7 + 1)
+        rfns.append(scene.add_reference(ref_file, namespace))
+
+    for j in range(caches):
+        group = rfns[j * refs_per_cache:(j + 1) * refs_per_cache]
+        if not group:
+            break
+
+        node_name = "gpuCache_" + cache_name(j)
+        refs_no_ns = [re.sub("RN$", "", rfn) for rfn in group]
+        path = os.path.join(cache_dir, "%s_%s_%s_%i_%i_.abc" % (start_name, node_name, "_".join(refs_no_ns),
+                                                                  start, end))
+        fake_maya.write_alembic(path, start - 5, end + 5)
+        scene.add_gpu_cache(node_name, group, path, active=j % 2 == 0)
+
+    return scene, rfns
+
+
+def measure(scene, label, func, repeat):
+
+    runs = []
+
+    for _ in range(repeat):
+        calls_before = scene.calls.copy()
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+
+        calls = scene.calls - calls_before
+        runs.append({"time": duration, "maya_calls": sum(calls.values()), "top_calls": calls.most_common(3)})
+
+    return {"name": label,
+            "first": runs[0]["time"],
+            "best": min(run["time"] for run in runs),
+            "mean": sum(run["time"] for run in runs) / len(runs),
+            "maya_calls": runs[-1]["maya_calls"],
+            "top_calls": runs[-1]["top_calls"]}
+
+
+def run(refs=100, caches=25, refs_per_cache=2, latency=0.0, repeat=3):
+
+    root = tempfile.mkdtemp(prefix="smc_bench_")
+
+    # Keep every temp/scratch folder of the tools inside the benchmark folder
+    tempfile.tempdir = root
+    os.environ["SMC_SCRATCH_DIR"] = os.path.join(root, "scratch")
+    os.environ["SMC_HISTORY_DB"] = os.path.join(root, "export_history.db")
+    os.environ["SMC_JOURNAL"] = os.path.join(root, "export_journal.jsonl")
+
+    try:
+        scene, rfns = build_scene(root, refs, caches, refs_per_cache=refs_per_cache, latency=latency)
+        scene.install()
+        fake_qt.install()
+
+        import smc_gpu_cache
+        import smc_gpu_cacher
+        import smc_ref_wrapper
+        import smc_namespaces
+
+        def startup():
+            tool = smc_gpu_cacher.GpuCacherTool()
+            tool.finish_loading()
+            return tool
+
+        results = [measure(scene, "GpuCacherTool.__init__", smc_gpu_cacher.GpuCacherTool, 1),
+                   measure(scene, "GpuCacherTool startup", startup, 1)]
+
+        tool = startup()
+        for phase, seconds in tool.startup_times.items():
+            results.append({"name": "startup " + phase, "first": seconds, "best": seconds, "mean": seconds,
+                            "maya_calls": None, "top_calls": []})
+
+        cached = rfns[:refs_per_cache]
+        not_cached = rfns[-1]
+        start, end = scene.playback["ast"], scene.playback["aet"]
+
+        def select_assets():
+            # A tenth of the assets
+            for row in range(0, tool.asset_table.rowCount(), 10):
+                tool.asset_table.item(row, 0).setSelected(True)
+            tool._selection_changed()
+
+        def select_cache():
+            if tool.cache_table.rowCount():
+                tool.cache_table.item(0, 0).setSelected(True)
+            tool._cache_selection_changed()
+
+        def visibility_update():
+            tool.visibility_enabler.update(tool._cache_refs, tool._selected_refs(), refresh=True)
+
+        results += [
+            measure(scene, "get_refs_in_scene_wrap", smc_gpu_cache.get_refs_in_scene_wrap, repeat),
+            measure(scene, "fill_table", tool._refresh_tables, repeat),
+            measure(scene, "_repair", tool._repair, repeat),
+            measure(scene, "_selection_changed", select_assets, repeat),
+            measure(scene, "_cache_selection_changed", select_cache, repeat),
+            measure(scene, "visibility update", visibility_update, repeat),
+            measure(scene, "plan_namespaces",
+                    lambda: smc_namespaces.plan_namespaces([smc_ref_wrapper.RefWrapper(rfn) for rfn in rfns]),
+                    repeat),
+            measure(scene, "_is_ref_in_cache", lambda: tool._is_ref_in_cache(not_cached), repeat),
+            measure(scene, "GpuCacheWrapper.__init__",
+                    lambda: smc_gpu_cache.GpuCacheWrapper(cached, start, end,
+                                                           dir=tool.local_path_led.text()), repeat),
+            measure(scene, "export_mats", smc_ref_wrapper.RefWrapper(rfns[0]).export_mats, repeat),
+        ]
+
+    finally:
+        tempfile.tempdir = None
+        shutil.rmtree(root, ignore_errors=True)
+
+    return results
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refs", type=int, default=100, help="references in the scene")
+    parser.add_argument("--caches", type=int, default=25, help="gpuCache nodes in the scene")
+    parser.add_argument("--refs-per-cache", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every maya command")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    results = run(args.refs, args.caches, refs_per_cache=args.refs_per_cache, latency=args.latency,
+                  repeat=args.repeat)
+
+    print("%-26s %10s %10s %10s %12s  %s" % ("benchmark", "first s", "best s", "mean s", "maya calls",
+                                            "top calls"))
+    for result in results:
+        maya_calls = "-" if result["maya_calls"] is None else result["maya_calls"]
+        print("%-26s %10.4f %10.4f %10.4f %12s  %s" % (result["name"], result["first"], result["best"],
+                                                      result["mean"], maya_calls,
+                                                      ", ".join("%s %i" % call for call in result["top_calls"])))
+
+    if args.json:
+        with open(args.json, "w") as outfile:
+            json.dump({"args": vars(args), "results": results}, outfile, indent=4)
+
+
+if __name__ == "__main__":
+    main()
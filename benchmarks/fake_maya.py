@@ -0,0 +1,628 @@
+"""
+In-memory stand-in for maya.cmds / maya.mel, enough of them to run smc_gpu_cacher and smc_ref_wrapper
+outside of Maya. Every command call is counted and can be slowed down with latency injection.
+"""
+
+import os
+import math
+import re
+import sys
+import time
+import types
+import threading
+import struct
+import functools
+from collections import Counter
+
+DATA_BIT = 0x8000000000000000
+
+
+def write_alembic(path, start, end, fps=24.0):
+    """Writes a minimal valid ogawa archive with uniform time sampling from start to end (frames)"""
+
+    body = bytearray(16)
+
+    def data(payload):
+        pos = len(body)
+        body.extend(struct.pack("<Q", len(payload)) + payload)
+        return pos | DATA_BIT
+
+    def group(children):
+        pos = len(body)
+        body.extend(struct.pack("<Q", len(children)) + struct.pack("<%iQ" % len(children), *children))
+        return pos
+
+    samples = int(end - start) + 1
+    time_samplings = struct.pack("<IdI", 1, 1.0, 1) + struct.pack("<d", 0.0)
+    time_samplings += struct.pack("<IdI", samples, 1.0 / fps, 1) + struct.pack("<d", start / fps)
+
+    root = group([data(struct.pack("<i", 1)),
+                  data(struct.pack("<i", 10709)),
+                  group([]),
+                  data(b"_ai_Application=fake_maya"),
+                  data(time_samplings),
+                  data(b"")])
+
+    body[0:8] = b"Ogawa" + bytes([0xff]) + b"\x00\x01"
+    body[8:16] = struct.pack("<Q", root)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(bytes(body))
+
+
+class Node():
+
+    def __init__(self, name, node_type, parent=None, reference=None):
+        self.name = name
+        self.type = node_type
+        self.parent = parent
+        self.reference = reference
+        self.locked = False
+        self.attrs = {}
+        self.members = []
+
+
+class Reference():
+
+    def __init__(self, rfn, file, namespace):
+        self.rfn = rfn
+        self.file = file
+        self.namespace = namespace
+        self.loaded = True
+        self.nodes = []
+
+
+class Scene():
+    """
+    In-memory maya scene: nodes with attribute storage, references with namespaces and load state,
+    gpuCache nodes, shading engines and their connections.
+    """
+
+    GPU_CACHE_ATTRS = {"cacheFileName": "", "cacheGeomPath": "|"}
+
+    def __init__(self, scene_name="/proj/shots/sh010/anim/sh010_anim_v001.ma", latency=0.0,
+                 start=101, end=200, batch=False):
+
+        self.scene_name = scene_name
+        self.latency = latency
+        # mayapy / maya -batch rather than an interactive session
+        self.batch = batch
+        self.playback = {"ast": start, "aet": end, "min": start, "max": end}
+        self.modified = False
+        self.current_time = start
+
+        self.nodes = {}
+        self.references = {}
+        self.connections = {}
+        self.selection = []
+        self.calls = Counter()
+
+        self.nodes["sharedReferenceNode"] = Node("sharedReferenceNode", "reference")
+        self.nodes["persp"] = Node("persp", "transform")
+        self.nodes["persp"].attrs["translate"] = [28.0, 21.0, 28.0]
+        self.nodes["persp"].attrs["rotate"] = [-27.938, 45.0, 0.0]
+
+    # SCENE BUILDING
+
+    def _unique_name(self, name):
+
+        if name not in self.nodes:
+            return name
+
+        base = re.sub(r"\d+$", "", name)
+        i = 1
+        while "%s%i" % (base, i) in self.nodes:
+            i += 1
+
+        return "%s%i" % (base, i)
+
+    def add_node(self, name, node_type, parent=None, reference=None):
+
+        node = Node(self._unique_name(name), node_type, parent=parent, reference=reference)
+        self.nodes[node.name] = node
+
+        if node_type == "gpuCache":
+            node.attrs.update(self.GPU_CACHE_ATTRS)
+
+        if reference:
+            reference.nodes.append(node.name)
+
+        return node.name
+
+    def add_reference(self, file, namespace, meshes=3, shading_engines=2, faces=2000, loaded=True):
+        """Adds a reference with a root transform, meshes and shading engines. Returns its reference node"""
+
+        rfn = self.add_node(namespace + "RN", "reference")
+        reference = Reference(rfn, file, namespace)
+        self.references[rfn] = reference
+        self.nodes[rfn].locked = True
+
+        root = self.add_node("%s:root" % namespace, "transform", reference=reference)
+
+        geos = []
+        for i in range(meshes):
+            geo = self.add_node("%s:geo%i" % (namespace, i), "transform", parent=root, reference=reference)
+            shape = self.add_node("%s:geo%iShape" % (namespace, i), "mesh", parent=geo, reference=reference)
+            self.nodes[shape].attrs["faces"] = faces
+            geos.append(geo)
+
+        for i in range(shading_engines):
+            material = self.add_node("%s:mat%i" % (namespace, i), "lambert", reference=reference)
+            se = self.add_node("%s:mat%iSG" % (namespace, i), "shadingEngine", reference=reference)
+            self.connections["%s.surfaceShader" % se] = [material]
+            self.nodes[se].members = geos[i::shading_engines]
+
+        reference.loaded = loaded
+        return rfn
+
+    def add_gpu_cache(self, name, rfns, stored_path, active=False):
+        """Adds a gpuCache node the way GpuCacheWrapper creates them"""
+
+        if "GPU_CACHES" not in self.nodes:
+            self.add_node("GPU_CACHES", "transform")
+
+        cache = self.add_node(name, "gpuCache", parent="GPU_CACHES")
+        self.nodes[cache].attrs["refNodes"] = list(rfns)
+        self.nodes[cache].attrs["storedPath"] = stored_path
+
+        if active:
+            self.nodes[cache].attrs["cacheFileName"] = stored_path
+            for rfn in rfns:
+                self.references[rfn].loaded = False
+
+        return cache
+
+    # HELPERS
+
+    def _visible(self, name):
+        node = self.nodes[name]
+        return node.reference is None or node.reference.loaded
+
+    def _reference(self, target):
+        """Reference for a reference node, a referenced file or a referenced node"""
+
+        if target in self.references:
+            return self.references[target]
+
+        for reference in self.references.values():
+            if reference.file == target or re.sub(r"\{\d+\}$", "", target) == reference.file:
+                return reference
+
+        if target in self.nodes and self.nodes[target].reference:
+            return self.nodes[target].reference
+
+        raise RuntimeError("referenceQuery: %s is not a reference" % target)
+
+    def _node(self, name):
+
+        name = name.lstrip("|").split("|")[-1]
+        if name not in self.nodes or not self._visible(name):
+            raise ValueError("No object matches name: %s" % name)
+
+        return self.nodes[name]
+
+    def _plug(self, plug):
+        node_name, attr = plug.split(".", 1)
+        return self._node(node_name), attr
+
+    # MAYA.CMDS
+
+    def ls(self, *args, **kwargs):
+
+        node_type = kwargs.get("type")
+        names = [name for name in self.nodes if self._visible(name)]
+
+        if args:
+            wanted = []
+            for arg in args:
+                wanted += arg if isinstance(arg, (list, tuple)) else [arg]
+            names = [name for name in wanted if name in self.nodes and self._visible(name)]
+
+        if node_type:
+            types_ = node_type if isinstance(node_type, (list, tuple)) else [node_type]
+            names = [name for name in names if self.nodes[name].type in types_]
+
+        if kwargs.get("assemblies"):
+            names = [name for name in names if self.nodes[name].parent is None
+                     and self.nodes[name].type in ("transform",)]
+            if kwargs.get("l") or kwargs.get("long"):
+                names = ["|" + name for name in names]
+
+        return names
+
+    def referenceQuery(self, target, **kwargs):
+
+        reference = self._reference(target)
+
+        if kwargs.get("filename") or kwargs.get("f"):
+            return reference.file
+
+        if kwargs.get("isLoaded") or kwargs.get("il"):
+            return reference.loaded
+
+        if kwargs.get("nodes") or kwargs.get("n"):
+            if not reference.loaded:
+                return []
+            return list(reference.nodes)
+
+        if kwargs.get("namespace") or kwargs.get("ns"):
+            if kwargs.get("shortName") or kwargs.get("shn"):
+                return reference.namespace
+            return ":" + reference.namespace
+
+        if kwargs.get("referenceNode") or kwargs.get("rfn"):
+            return reference.rfn
+
+        raise RuntimeError("referenceQuery: unsupported flags %s" % kwargs)
+
+    def file(self, *args, **kwargs):
+
+        if kwargs.get("q") or kwargs.get("query"):
+            if kwargs.get("sn") or kwargs.get("sceneName"):
+                return self.scene_name
+            if kwargs.get("modified"):
+                return self.modified
+            raise RuntimeError("file: unsupported query %s" % kwargs)
+
+        if kwargs.get("o") or kwargs.get("open"):
+            # The scene contents are whatever was built, only the name changes
+            self.scene_name = args[0]
+            self.modified = False
+            return args[0]
+
+        if kwargs.get("s") or kwargs.get("save"):
+            self.modified = False
+            return self.scene_name
+
+        for flag in ("loadReference", "lr"):
+            if flag in kwargs:
+                target = kwargs[flag] if kwargs[flag] is not True else args[0]
+                reference = self._reference(target)
+                reference.loaded = True
+                return reference.rfn
+
+        for flag in ("unloadReference", "ur"):
+            if flag in kwargs:
+                target = kwargs[flag] if kwargs[flag] is not True else args[0]
+                reference = self._reference(target)
+                reference.loaded = False
+                return reference.rfn
+
+        if (kwargs.get("e") or kwargs.get("edit")) and ("ns" in kwargs or "namespace" in kwargs):
+            reference = self._reference(args[0])
+            parent = ":".join(reference.namespace.split(":")[:-1])
+            new = kwargs.get("ns") or kwargs.get("namespace")
+            self._rename_namespace(reference, reference.namespace, "%s:%s" % (parent, new) if parent else new)
+            return
+
+        if kwargs.get("r") or kwargs.get("reference"):
+
+            if "sns" in kwargs:
+                old, new = kwargs["sns"]
+                reference = self._reference(args[0])
+                self._rename_namespace(reference, old, new)
+                return
+
+            namespace = kwargs.get("ns") or kwargs.get("namespace") or os.path.basename(args[0]).split(".")[0]
+            return self.add_reference(args[0], namespace, shading_engines=0)
+
+        if kwargs.get("es") or kwargs.get("exportSelected"):
+            os.makedirs(os.path.dirname(args[0]), exist_ok=True)
+            with open(args[0], "w") as f:
+                f.write("// fake_maya export of %s\n" % " ".join(self.selection))
+            return args[0]
+
+        if kwargs.get("i") or kwargs.get("import"):
+            return []
+
+        raise RuntimeError("file: unsupported flags %s" % kwargs)
+
+    def _rename_namespace(self, reference, old, new):
+
+        for name in list(reference.nodes):
+            node = self.nodes.pop(name)
+            node.name = re.sub("^%s:" % re.escape(old), new + ":", name)
+            self.nodes[node.name] = node
+
+            for other in self.nodes.values():
+                if other.parent == name:
+                    other.parent = node.name
+
+        reference.nodes = [re.sub("^%s:" % re.escape(old), new + ":", name) for name in reference.nodes]
+        reference.namespace = new
+
+    def getAttr(self, plug, **kwargs):
+        node, attr = self._plug(plug)
+
+        if attr not in node.attrs:
+            raise ValueError("No object matches name: %s" % plug)
+
+        value = node.attrs[attr]
+        return list(value) if isinstance(value, list) else value
+
+    def setAttr(self, plug, *values, **kwargs):
+
+        node, attr = self._plug(plug)
+
+        if kwargs.get("type") == "stringArray":
+            node.attrs[attr] = list(values[1:])
+        else:
+            node.attrs[attr] = values[0] if len(values) == 1 else list(values)
+
+    def addAttr(self, node_name, **kwargs):
+
+        node = self._node(node_name)
+        if node.locked:
+            raise RuntimeError("addAttr: %s is locked" % node_name)
+
+        attr = kwargs.get("longName") or kwargs.get("ln")
+        if attr in node.attrs:
+            raise RuntimeError("addAttr: %s already has %s" % (node_name, attr))
+
+        node.attrs[attr] = [] if kwargs.get("dataType") == "stringArray" else kwargs.get("defaultValue")
+
+    def createNode(self, node_type, name=None, parent=None, **kwargs):
+        return self.add_node(name or node_type + "1", node_type, parent=parent)
+
+    def delete(self, *names, **kwargs):
+
+        for name in names:
+            for name in (name if isinstance(name, (list, tuple)) else [name]):
+                node = self._node(name)
+                if node.locked:
+                    raise RuntimeError("delete: %s is locked" % name)
+
+                for child in [other for other in self.nodes.values() if other.parent == node.name]:
+                    self.delete(child.name)
+
+                del self.nodes[node.name]
+                self.references.pop(node.name, None)
+
+    def lockNode(self, node_name, l=True, **kwargs):
+        self._node(node_name).locked = l
+
+    def playbackOptions(self, q=False, **kwargs):
+
+        for flag, key in (("ast", "ast"), ("animationStartTime", "ast"), ("aet", "aet"),
+                          ("animationEndTime", "aet"), ("min", "min"), ("max", "max")):
+            if kwargs.get(flag) is True:
+                return float(self.playback[key])
+            if flag in kwargs and not q:
+                self.playback[key] = kwargs[flag]
+
+    def select(self, *args, **kwargs):
+
+        if kwargs.get("clear") or kwargs.get("cl"):
+            self.selection = []
+            return
+
+        items = []
+        for arg in args:
+            items += arg if isinstance(arg, (list, tuple)) else [arg]
+
+        for item in items:
+            self._node(item.split(".")[0])
+
+        if kwargs.get("add"):
+            self.selection += items
+        else:
+            self.selection = items
+
+    def sets(self, *args, **kwargs):
+
+        if kwargs.get("q") or kwargs.get("query"):
+            return list(self._node(args[0]).members)
+
+        if "fe" in kwargs or "forceElement" in kwargs:
+            se = self._node(kwargs.get("fe") or kwargs.get("forceElement"))
+            se.members += [item for item in self.selection if item not in se.members]
+
+    def listConnections(self, plug, **kwargs):
+        return list(self.connections[plug]) if self.connections.get(plug) else None
+
+    def listRelatives(self, node_name, type=None, **kwargs):
+
+        parents = set(node_name if isinstance(node_name, (list, tuple)) else [node_name])
+        children = []
+
+        while parents:
+            found = [node.name for node in self.nodes.values() if node.parent in parents and self._visible(node.name)]
+            children += found
+            parents = set(found) if kwargs.get("allDescendents") or kwargs.get("ad") else set()
+
+        if type:
+            children = [child for child in children if self.nodes[child].type == type]
+
+        return children or None
+
+    def attributeQuery(self, attr, node=None, exists=False, **kwargs):
+        return attr in self._node(node).attrs
+
+    def xform(self, node_name, q=False, ws=False, t=False, ro=False, matrix=False, **kwargs):
+
+        node = self._node(node_name)
+        translate = list(node.attrs.get("translate", [0.0, 0.0, 0.0]))
+        rotate = list(node.attrs.get("rotate", [0.0, 0.0, 0.0]))
+
+        if t:
+            return translate
+        if ro:
+            return rotate
+        if matrix:
+            # Row vectors, xyz rotate order: rotate x, then y, then z
+            x, y, z = [math.radians(angle) for angle in rotate]
+            rotation = [[1, 0, 0], [0, math.cos(x), math.sin(x)], [0, -math.sin(x), math.cos(x)]]
+            for axis in ([[math.cos(y), 0, -math.sin(y)], [0, 1, 0], [math.sin(y), 0, math.cos(y)]],
+                         [[math.cos(z), math.sin(z), 0], [-math.sin(z), math.cos(z), 0], [0, 0, 1]]):
+                rotation = [[sum(row[k] * axis[k][j] for k in range(3)) for j in range(3)] for row in rotation]
+
+            return rotation[0] + [0.0] + rotation[1] + [0.0] + rotation[2] + [0.0] + translate + [1.0]
+
+    CAMERA = {"orthographic": False, "startupCamera": False, "orthoWidth": 30.0, "verticalFieldOfView": 30.9,
+              "horizontalFieldOfView": 54.4, "nearClipPlane": 0.1, "farClipPlane": 10000.0}
+
+    def camera(self, node_name, q=False, **kwargs):
+
+        self._node(node_name)
+        for flag, value in self.CAMERA.items():
+            if kwargs.get(flag):
+                return value
+
+    def exactWorldBoundingBox(self, *node_names, **kwargs):
+
+        boxes = [self._node(name).attrs.get("boundingBox", [-1.0, -1.0, -1.0, 1.0, 1.0, 1.0])
+                 for name in node_names]
+
+        return [min(box[i] for box in boxes) for i in range(3)] + [max(box[i] for box in boxes) for i in range(3, 6)]
+
+    def undoInfo(self, *args, **kwargs):
+        return None
+
+    def about(self, *args, **kwargs):
+
+        if kwargs.get("batch") or kwargs.get("b"):
+            return self.batch
+
+        raise RuntimeError("about: unsupported flags %s" % kwargs)
+
+    def getPanel(self, *args, **kwargs):
+        # No UI, like mayapy
+        return [] if kwargs.get("visiblePanels") else None
+
+    def modelPanel(self, panel, q=False, camera=False, **kwargs):
+        return "persp"
+
+    def polyReduce(self, mesh, **kwargs):
+        return [self.add_node("polyReduce1", "polyReduce")]
+
+    def loadPlugin(self, *args, **kwargs):
+        return []
+
+    def namespace(self, *args, **kwargs):
+
+        if kwargs.get("exists") or kwargs.get("ex"):
+            name = (kwargs.get("exists") or kwargs.get("ex")).lstrip(":")
+            return name in self.namespaceInfo(":", listOnlyNamespaces=True, recurse=True)
+
+        return None
+
+    def namespaceInfo(self, *args, **kwargs):
+        namespaces = set()
+        for reference in self.references.values():
+            parts = reference.namespace.split(":")
+            namespaces.update(":".join(parts[:i + 1]) for i in range(len(parts)))
+        return sorted(namespaces)
+
+    def group(self, name=None, em=False, **kwargs):
+        return self.add_node((name or "group1").lstrip("|"), "transform")
+
+    def parent(self, node_name, parent_name, **kwargs):
+        self._node(node_name).parent = parent_name.lstrip("|")
+
+    def AbcExport(self, j=""):
+
+        frame_range = re.search(r"-frameRange (\S+) (\S+)", j)
+        path = re.search(r"-file (.+)$", j).group(1).strip()
+        write_alembic(path, float(frame_range.group(1)), float(frame_range.group(2)))
+
+    def hyperShade(self, *args, **kwargs):
+        return None
+
+    def polyEvaluate(self, *args, **kwargs):
+
+        meshes = []
+        for arg in args:
+            meshes += arg if isinstance(arg, (list, tuple)) else [arg]
+
+        return sum(self._node(mesh).attrs.get("faces", 0) for mesh in meshes)
+
+    def currentTime(self, *args, **kwargs):
+
+        if kwargs.get("q") or kwargs.get("query"):
+            return self.current_time
+        if args:
+            self.current_time = args[0]
+
+        return self.current_time
+
+    def refresh(self, *args, **kwargs):
+        return None
+
+    def error(self, message=""):
+        raise RuntimeError(message)
+
+    # MAYA.MEL
+
+    def eval(self, command):
+
+        if command.startswith("gpuCache"):
+            start = float(re.search(r"-startTime (\S+)", command).group(1))
+            end = float(re.search(r"-endTime (\S+)", command).group(1))
+            directory = re.search(r'-directory "([^"]*)"', command).group(1)
+            file_name = re.search(r'-fileName "([^"]*)"', command).group(1)
+            write_alembic(os.path.join(directory, file_name + ".abc"), start, end)
+            return [os.path.join(directory, file_name + ".abc")]
+
+        if command.startswith("currentTimeUnitToFPS"):
+            return 24.0
+
+        return None
+
+    # INSTALL
+
+    def _command(self, name):
+
+        func = getattr(self, name)
+
+        @functools.wraps(func)
+        def command(*args, **kwargs):
+            # maya.cmds is not thread safe, catch calls from transfer or prefetch threads
+            if threading.current_thread() is not threading.main_thread():
+                raise RuntimeError("maya.cmds.%s called from thread %s" % (name, threading.current_thread().name))
+
+            self.calls[name] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            return func(*args, **kwargs)
+
+        return command
+
+    def install(self):
+        """
+        Registers this scene as maya, maya.cmds and maya.mel in sys.modules.
+        Installing another scene later rebinds the same module objects, so already imported code follows.
+        """
+
+        maya = sys.modules.get("maya")
+        if not getattr(maya, "FAKE_MAYA", False):
+            maya = types.ModuleType("maya")
+            maya.FAKE_MAYA = True
+            maya.cmds = types.ModuleType("maya.cmds")
+            maya.mel = types.ModuleType("maya.mel")
+            maya.utils = types.ModuleType("maya.utils")
+            # Runs right away, like maya does in batch mode
+            maya.utils.executeDeferred = lambda function, *args, **kwargs: function(*args, **kwargs)
+
+            sys.modules["maya"] = maya
+            sys.modules["maya.cmds"] = maya.cmds
+            sys.modules["maya.mel"] = maya.mel
+            sys.modules["maya.utils"] = maya.utils
+
+        for name in self.CMDS:
+            setattr(maya.cmds, name, self._command(name))
+
+        maya.mel.eval = self._command("eval")
+        maya.scene = self
+
+        return maya
+
+    CMDS = ["ls", "referenceQuery", "file", "getAttr", "setAttr", "addAttr", "createNode", "delete", "lockNode",
+            "playbackOptions", "select", "sets", "listConnections", "listRelatives", "loadPlugin", "namespace",
+            "group", "parent", "AbcExport", "hyperShade", "error", "polyEvaluate", "currentTime", "refresh",
+            "attributeQuery", "polyReduce", "xform", "camera", "exactWorldBoundingBox", "getPanel", "modelPanel",
+            "undoInfo", "namespaceInfo", "about"]
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
@@ -0,0 +1,260 @@
+"""
+Headless stand-in for the parts of PySide2 the tools use. Tables keep their contents so table code can run,
+everything else is a no-op. Only Maya/python side costs are measured with it, not Qt painting.
+"""
+
+import sys
+import types
+
+
+class Stub():
+    """Accepts any attribute access, call or flag operation"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        # Stable, so enum like values (Qt.UserRole) can be compared and used as keys
+        value = Stub()
+        object.__setattr__(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        return Stub()
+
+    def __or__(self, other):
+        return self
+
+    __ror__ = __and__ = __rand__ = __or__
+
+    def __int__(self):
+        return 0
+
+    def __bool__(self):
+        return False
+
+
+class QWidget(Stub):
+
+    def __bool__(self):
+        return True
+
+    def setEnabled(self, enabled):
+        self.__dict__["_enabled"] = bool(enabled)
+
+    def isEnabled(self):
+        return self.__dict__.get("_enabled", True)
+
+
+class QLabel(QWidget):
+
+    def __init__(self, text="", *args):
+        self._text = text
+
+    def text(self):
+        return self._text
+
+    def setText(self, text):
+        self._text = text
+
+
+class QPushButton(QLabel):
+
+    def __init__(self, text="", *args):
+        super(QPushButton, self).__init__(text)
+        self._properties = {}
+        self._checked = False
+
+    def setProperty(self, name, value):
+        self._properties[name] = value
+
+    def property(self, name):
+        return self._properties.get(name)
+
+    def setChecked(self, checked):
+        self._checked = checked
+
+    def isChecked(self):
+        return self._checked
+
+
+class QCheckBox(QPushButton):
+    pass
+
+
+class QComboBox(QWidget):
+
+    def __init__(self, *args):
+        self._items = []
+        self._index = 0
+
+    def addItems(self, items):
+        self._items += list(items)
+
+    def currentText(self):
+        return self._items[self._index] if self._items else ""
+
+    def setCurrentText(self, text):
+        self._index = self._items.index(text)
+
+    def currentIndex(self):
+        return self._index
+
+    def setCurrentIndex(self, index):
+        self._index = index
+
+
+class QSpinBox(QWidget):
+
+    def __init__(self, *args):
+        self._value = 0
+
+    def value(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = value
+
+
+class QTableWidgetItem(Stub):
+
+    def __init__(self, text=""):
+        self._text = text
+        self._data = {}
+        self._selected = False
+        self.table = None
+
+    def __bool__(self):
+        return True
+
+    def text(self):
+        return self._text
+
+    def setText(self, text):
+        self._text = text
+
+    def data(self, role):
+        return self._data.get(role)
+
+    def setData(self, role, value):
+        self._data[role] = value
+
+    def setSelected(self, selected):
+        self._selected = selected
+
+    def row(self):
+        return self.table.row(self) if self.table else -1
+
+    def isSelected(self):
+        return self._selected
+
+
+class QTableWidget(QWidget):
+    """Keeps items per cell with QTableWidget's out of range semantics (ignored writes, None reads)"""
+
+    def __init__(self, rows=0, columns=0, *args):
+        self._columns = columns
+        self._rows = [[None] * columns for _ in range(rows)]
+        self._widgets = {}
+
+    def _in_range(self, row, column):
+        return 0 <= row < len(self._rows) and 0 <= column < self._columns
+
+    def clear(self):
+        self._rows = [[None] * self._columns for _ in self._rows]
+        self._widgets = {}
+
+    def rowCount(self):
+        return len(self._rows)
+
+    def columnCount(self):
+        return self._columns
+
+    def setRowCount(self, rows):
+        self._rows = (self._rows + [[None] * self._columns for _ in range(rows)])[:rows]
+
+    def setColumnCount(self, columns):
+        self._rows = [(row + [None] * columns)[:columns] for row in self._rows]
+        self._columns = columns
+
+    def insertRow(self, row):
+        self._rows.insert(row, [None] * self._columns)
+
+    def removeRow(self, row):
+        if 0 <= row < len(self._rows):
+            del self._rows[row]
+
+    def setItem(self, row, column, item):
+        if self._in_range(row, column):
+            item.table = self
+            self._rows[row][column] = item
+
+    def item(self, row, column):
+        if self._in_range(row, column):
+            return self._rows[row][column]
+        return None
+
+    def row(self, item):
+        for i, row in enumerate(self._rows):
+            if item in row:
+                return i
+        return -1
+
+    def setCellWidget(self, row, column, widget):
+        if self._in_range(row, column):
+            self._widgets[(row, column)] = widget
+
+    def cellWidget(self, row, column):
+        return self._widgets.get((row, column))
+
+    def items(self):
+        return [item for row in self._rows for item in row if item]
+
+    def selectedItems(self):
+        return [item for item in self.items() if item.isSelected()]
+
+    def findItems(self, text, flags=None):
+        return [item for item in self.items() if text in item.text()]
+
+    def sortItems(self, column, order=None):
+        self._rows.sort(key=lambda row: row[column].text() if row[column] else "")
+
+    def rowAt(self, y):
+        return -1
+
+
+def install():
+    """Registers the stand-in as PySide2, PySide2.QtCore, QtGui and QtWidgets in sys.modules"""
+
+    pyside = types.ModuleType("PySide2")
+    qt_core = types.ModuleType("PySide2.QtCore")
+    qt_gui = types.ModuleType("PySide2.QtGui")
+    qt_widgets = types.ModuleType("PySide2.QtWidgets")
+
+    # Anything not defined here is a Stub
+    for module in (qt_core, qt_gui, qt_widgets):
+        module.__getattr__ = lambda name: Stub()
+
+    qt_core.Qt = Stub()
+
+    for cls in (QWidget, QLabel, QPushButton, QCheckBox, QComboBox, QSpinBox, QTableWidgetItem, QTableWidget):
+        setattr(qt_widgets, cls.__name__, cls)
+
+    pyside.QtCore = qt_core
+    pyside.QtGui = qt_gui
+    pyside.QtWidgets = qt_widgets
+
+    sys.modules["PySide2"] = pyside
+    sys.modules["PySide2.QtCore"] = qt_core
+    sys.modules["PySide2.QtGui"] = qt_gui
+    sys.modules["PySide2.QtWidgets"] = qt_widgets
+
+    # Not shipped with this repo
+    alert_dialog = types.ModuleType("alert_dialog")
+    alert_dialog.AlertDialog = Stub
+    sys.modules.setdefault("alert_dialog", alert_dialog)
+
+    return pyside
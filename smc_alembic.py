@@ -0,0 +1,237 @@
+import os
+import mmap
+import struct
+import logging
+
+__all__ = ["AlembicError", "ArchiveInfo", "read_info", "is_valid"]
+
+log = logging.getLogger(__name__)
+
+OGAWA_MAGIC = b"Ogawa"
+OGAWA_FROZEN = 0xff
+OGAWA_VERSION = 1
+HEADER_SIZE = 16
+
+DATA_BIT = 0x8000000000000000
+ACYCLIC_TIME_PER_CYCLE = 1.7976931348623157e+308 / 32.0
+
+# Children of the archive root group
+ARCHIVE_VERSION_INDEX = 0
+LIBRARY_VERSION_INDEX = 1
+TOP_OBJECT_INDEX = 2
+METADATA_INDEX = 3
+TIME_SAMPLING_INDEX = 4
+INDEXED_METADATA_INDEX = 5
+
+
+class AlembicError(ValueError):
+    pass
+
+
+class TimeSampling():
+
+    def __init__(self, time_per_cycle, times, max_sample):
+        self.time_per_cycle = time_per_cycle
+        self.times = times
+        self.max_sample = max_sample
+
+    @property
+    def acyclic(self):
+        return self.time_per_cycle == ACYCLIC_TIME_PER_CYCLE
+
+    @property
+    def start_time(self):
+        return self.times[0] if self.times else 0.0
+
+    @property
+    def end_time(self):
+
+        if not self.times or self.max_sample < 1:
+            return self.start_time
+
+        last = self.max_sample - 1
+
+        if self.acyclic:
+            return self.times[min(last, len(self.times) - 1)]
+
+        cycle, index = divmod(last, len(self.times))
+        return cycle * self.time_per_cycle + self.times[index]
+
+    def __repr__(self):
+        return "<TimeSampling %.4f-%.4f, %i samples>" % (self.start_time, self.end_time, self.max_sample)
+
+
+class ArchiveInfo():
+    """
+    Header level information of an Ogawa alembic archive
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.valid = False
+        self.error = ""
+        self.archive_version = None
+        self.library_version = None
+        self.metadata = {}
+        self.time_samplings = []
+
+    def __repr__(self):
+        if not self.valid:
+            return "<ArchiveInfo %s INVALID: %s>" % (self.path, self.error)
+        return "<ArchiveInfo %s %.4f-%.4f>" % (self.path, self.start_time, self.end_time)
+
+    @property
+    def animated_time_samplings(self):
+        # Index 0 is the default identity sampling
+        return [sampling for sampling in self.time_samplings[1:] if sampling.max_sample > 0]
+
+    @property
+    def start_time(self):
+        samplings = self.animated_time_samplings or self.time_samplings
+        return min([sampling.start_time for sampling in samplings] or [0.0])
+
+    @property
+    def end_time(self):
+        samplings = self.animated_time_samplings or self.time_samplings
+        return max([sampling.end_time for sampling in samplings] or [0.0])
+
+    def frame_range(self, fps=24.0):
+        return round(self.start_time * fps, 3), round(self.end_time * fps, 3)
+
+
+class _OgawaReader():
+
+    def __init__(self, buffer, size):
+        self.buffer = buffer
+        self.size = size
+
+    def _u64(self, pos):
+        if pos + 8 > self.size:
+            raise AlembicError("Offset %i past end of file (%i bytes), truncated archive" % (pos, self.size))
+        return struct.unpack_from("<Q", self.buffer, pos)[0]
+
+    def group(self, pos):
+        """Child offsets of the group at pos"""
+
+        if pos == 0:
+            return []
+
+        count = self._u64(pos)
+        if count > (self.size - pos - 8) // 8:
+            raise AlembicError("Group at %i has %i children, truncated archive" % (pos, count))
+
+        children = list(struct.unpack_from("<%iQ" % count, self.buffer, pos + 8))
+
+        for child in children:
+            child_pos = child & ~DATA_BIT
+            if child_pos >= self.size:
+                raise AlembicError("Child at %i past end of file, truncated archive" % child_pos)
+
+        return children
+
+    def data(self, child):
+        """Bytes of a data child"""
+
+        pos = child & ~DATA_BIT
+        if pos == 0:
+            return b""
+
+        size = self._u64(pos)
+        if pos + 8 + size > self.size:
+            raise AlembicError("Data at %i past end of file, truncated archive" % pos)
+
+        return self.buffer[pos + 8:pos + 8 + size]
+
+
+def _read_time_samplings(data):
+
+    samplings = []
+    pos = 0
+
+    while pos < len(data):
+        max_sample, time_per_cycle, num_samples = struct.unpack_from("<IdI", data, pos)
+        pos += 16
+        times = list(struct.unpack_from("<%id" % num_samples, data, pos))
+        pos += 8 * num_samples
+        samplings.append(TimeSampling(time_per_cycle, times, max_sample))
+
+    return samplings
+
+
+def _read_metadata(data):
+
+    metadata = {}
+
+    for token in data.decode("utf-8", "replace").split(";"):
+        if "=" in token:
+            key, value = token.split("=", 1)
+            metadata[key] = value
+
+    return metadata
+
+
+def read_info(path):
+    """
+    Reads the Ogawa header and archive index of path without loading the rest of the file.
+    Returns an ArchiveInfo, valid is False (with the reason in error) for missing, truncated or
+    unfinished archives.
+    """
+
+    info = ArchiveInfo(path)
+
+    try:
+        size = os.path.getsize(path)
+        if size < HEADER_SIZE:
+            raise AlembicError("File too small to be an ogawa archive")
+
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if buffer[:5] != OGAWA_MAGIC:
+                raise AlembicError("Not an ogawa archive")
+
+            if buffer[5] != OGAWA_FROZEN:
+                raise AlembicError("Archive was never closed, the export did not finish")
+
+            if struct.unpack_from(">H", buffer, 6)[0] != OGAWA_VERSION:
+                raise AlembicError("Unsupported ogawa version")
+
+            reader = _OgawaReader(buffer, size)
+            root = reader.group(reader._u64(8))
+
+            if len(root) <= INDEXED_METADATA_INDEX:
+                raise AlembicError("Archive root has %i children" % len(root))
+
+            for index, child in enumerate(root[:INDEXED_METADATA_INDEX + 1]):
+                is_data = bool(child & DATA_BIT)
+                if is_data == (index == TOP_OBJECT_INDEX):
+                    raise AlembicError("Unexpected archive root layout")
+
+            archive_version = reader.data(root[ARCHIVE_VERSION_INDEX])
+            if len(archive_version) == 4:
+                info.archive_version = struct.unpack("<i", archive_version)[0]
+
+            library_version = reader.data(root[LIBRARY_VERSION_INDEX])
+            if len(library_version) == 4:
+                info.library_version = struct.unpack("<i", library_version)[0]
+
+            reader.group(root[TOP_OBJECT_INDEX])
+            info.metadata = _read_metadata(reader.data(root[METADATA_INDEX]))
+            info.time_samplings = _read_time_samplings(reader.data(root[TIME_SAMPLING_INDEX]))
+
+        finally:
+            buffer.close()
+
+        info.valid = True
+
+    except (OSError, ValueError, struct.error) as e:
+        info.error = str(e)
+        log.debug("Invalid alembic %s: %s", path, e)
+
+    return info
+
+
+def is_valid(path):
+    """True if path is a complete ogawa alembic archive"""
+    return read_info(path).valid
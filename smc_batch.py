@@ -0,0 +1,424 @@
+"""
+Headless batch caching of many scenes, one mayapy process per scene.
+
+    mayapy smc_batch.py shots/sh010/anim/*.ma --namespace "chr_*" --mode gpu --dir /proj/cache/gpu \\
+        --jobs 4 --report report.json
+
+The parent process only schedules, each scene is opened and cached by its own mayapy worker
+so a crashing scene never takes the others down. The report holds one entry per scene with the
+worker exit code and the caches it wrote.
+
+Running a batch again after a crash resumes it: caches the export journal has as done are validated
+against their checksums instead of exported again, and only the unfinished ones are exported.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import fnmatch
+import logging
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import smc_export_history
+import smc_quality
+
+__all__ = ["BatchOptions", "select_refs", "order_scenes", "cache_scene", "run_batch"]
+
+log = logging.getLogger(__name__)
+
+MAYAPY = os.environ.get("SMC_MAYAPY", "mayapy")
+
+GPU = "gpu"
+ABC = "abc"
+MODES = [GPU, ABC]
+
+# Worker exit codes
+EXIT_OK = 0
+EXIT_CACHE_FAILED = 1
+EXIT_SCENE_FAILED = 2
+EXIT_MAYA_FAILED = 3
+EXIT_TIMEOUT = 124
+
+STATUS = {EXIT_OK: "ok",
+          EXIT_CACHE_FAILED: "cache_failed",
+          EXIT_SCENE_FAILED: "scene_failed",
+          EXIT_MAYA_FAILED: "maya_failed",
+          EXIT_TIMEOUT: "timeout"}
+
+REF_TYPES = ["chr", "prp", "spr", "set"]
+
+
+class BatchOptions():
+    """What to cache in every scene of a batch, passed to the workers as json"""
+
+    def __init__(self, namespaces=None, ref_types=None, modes=(GPU,), dir="", store="", save=False, quality="final"):
+
+        self.namespaces = list(namespaces or [])
+        self.ref_types = list(ref_types or [])
+        self.modes = list(modes)
+        self.dir = dir
+        self.store = store
+        self.save = save
+        # smc_quality tag, a preset name or encoded custom profile
+        self.quality = quality
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def select_refs(refs, namespaces=None, ref_types=None):
+    """
+    (namespace, version, rfn) of refs matching any of the namespace glob patterns and ref types.
+    The ref type is the namespace prefix (chr, prp, spr, set). No patterns or types matches everything.
+    """
+
+    selected = []
+
+    for namespace, version, rfn in refs:
+
+        if namespaces and not any(fnmatch.fnmatch(namespace, pattern) for pattern in namespaces):
+            continue
+
+        if ref_types and re.sub("_.*$", "", namespace).lower() not in ref_types:
+            continue
+
+        selected.append((namespace, version, rfn))
+
+    return selected
+
+
+def order_scenes(scenes, history=None):
+    """
+    Scenes shortest first, by the durations of their last exports in the export history.
+    Scenes never exported are placed at the median.
+    """
+
+    history = history or smc_export_history.get_history()
+    durations = {}
+
+    for scene in set(scenes):
+        last = {}
+        for record in history.records(scene=scene):
+            if record["kind"] != smc_export_history.TOGGLE and record["duration"] is not None:
+                last[(record["kind"], record["asset"])] = record["duration"]
+
+        if last:
+            durations[scene] = sum(last.values())
+
+    median = smc_export_history.percentile(list(durations.values()), 50) or 0.0
+
+    return sorted(scenes, key=lambda scene: durations.get(scene, median))
+
+
+def cache_scene(scene, options):
+    """
+    Caches the matching refs of scene in the running maya session.
+    Returns (exit code, [cache result dicts])
+    """
+
+    import maya.cmds as cmds
+
+    try:
+        cmds.file(scene, open=True, force=True)
+    except RuntimeError as e:
+        log.error("Could not open %s: %s", scene, e)
+        return EXIT_SCENE_FAILED, [{"error": str(e)}]
+
+    # Imported once maya is up, they import maya.cmds
+    import smc_gpu_cache
+    import smc_ref_wrapper
+    import smc_transfer
+    import smc_shared_store
+    import smc_journal
+
+    refs = select_refs([ref for ref in smc_gpu_cache.get_refs_in_scene_wrap() if ref[2] != "sharedReferenceNode"],
+                       options.namespaces, options.ref_types)
+    log.info("%s: caching %i refs", scene, len(refs))
+
+    store = smc_shared_store.SharedStore(options.store) if options.store else None
+    quality = smc_quality.from_tag(options.quality) or smc_quality.FINAL
+    cache_dir = options.dir or os.path.join(tempfile.gettempdir(), "a_gpuCacherTemp")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    start = cmds.playbackOptions(q=True, ast=True)
+    end = cmds.playbackOptions(q=True, aet=True)
+
+    # Shortest job first, so quick caches are available early
+    jobs = []
+    for namespace, version, rfn in refs:
+        for mode in options.modes:
+            # Never exported, journaled they would stay queued
+            if mode != GPU and not smc_ref_wrapper.RefWrapper(rfn).cacheable:
+                log.info("%s: %s has no abc cache, skipping it", scene, rfn)
+                continue
+
+            try:
+                if mode == GPU:
+                    estimate = smc_gpu_cache.GpuCacheWrapper.estimate_export([rfn], quality)
+                else:
+                    estimate = smc_ref_wrapper.RefWrapper(rfn).estimate_cache(quality)
+                jobs.append((estimate.duration, namespace, rfn, mode))
+            except Exception as e:
+                log.warning("No estimate for %s %s cache of %s: %s", scene, mode, rfn, e)
+                jobs.append((float("inf"), namespace, rfn, mode))
+
+    jobs.sort(key=lambda job: job[0])
+
+    # Journal every job before starting, so a crash leaves the rest queued. Jobs of a previous run
+    # are validated or recovered from their scratch files, unfinished ones run again under the same job
+    journal = smc_journal.get_journal()
+    scene_name = cmds.file(q=True, sn=True)
+    abc_start = smc_ref_wrapper.RefWrapper.CACHE_START_FRAME
+    journaled = []
+
+    for estimated_duration, namespace, rfn, mode in jobs:
+
+        if mode == GPU:
+            previous = journal.find(smc_export_history.GPU_CACHE, scene_name, [rfn], start, end, quality.to_json())
+        else:
+            previous = journal.find(smc_export_history.ABC_CACHE, scene_name, [rfn], abc_start, end,
+                                    quality.to_json())
+
+        if previous and previous.state == smc_journal.DONE and journal.validate(previous):
+            resumed = "validated"
+        elif previous and journal.recover(previous, callback=smc_gpu_cache.repoint_callback()):
+            resumed = "recovered"
+        elif previous and not previous.finished:
+            resumed = "resumed"
+        else:
+            # Failed, or done but changed since: exported again to the same files
+            resumed = "redone" if previous else None
+            previous = journal.queue(smc_export_history.GPU_CACHE if mode == GPU else smc_export_history.ABC_CACHE,
+                                     scene_name, [rfn], start if mode == GPU else abc_start, end, quality.to_json(),
+                                     name=previous.name if previous else None,
+                                     dir=cache_dir if mode == GPU else None)
+
+        journaled.append((estimated_duration, namespace, rfn, mode, previous, resumed))
+
+    results = []
+    # Turned on once their transfers are done, so the saved scene points at the final files
+    caches = []
+
+    for estimated_duration, namespace, rfn, mode, job, resumed in journaled:
+
+        result = {"namespace": namespace, "rfn": rfn, "mode": mode, "path": None, "error": None,
+                  "estimated_duration": estimated_duration if estimated_duration != float("inf") else None,
+                  "resumed": resumed}
+        cache_start_time = time.perf_counter()
+
+        try:
+            if mode == GPU:
+                # Named like the journaled node so it points at the files of the previous run
+                cache = smc_gpu_cache.GpuCacheWrapper([rfn], start, end, dir=job.dir or cache_dir, store=store,
+                                                       quality=quality, name=job.name or "")
+                if resumed not in ("validated", "recovered"):
+                    if resumed or not cache.exported:
+                        cache.export_abc(force=bool(resumed), job=job)
+                    else:
+                        journal.adopt(job, cache.lod_paths() if cache.lods else [cache.filepath], name=cache.name)
+                caches.append((cache, result))
+                result["path"] = cache.filepath
+
+            else:
+                ref = smc_ref_wrapper.RefWrapper(rfn)
+                if resumed in ("validated", "recovered"):
+                    result["path"] = ref.cache_path(quality)
+                else:
+                    result["path"] = ref.export_cache(quality, job=job)
+
+        except Exception as e:
+            log.error("%s %s cache of %s failed: %s", scene, mode, rfn, e)
+            result["error"] = str(e)
+
+        result["duration"] = time.perf_counter() - cache_start_time
+        results.append(result)
+
+    transfer_queue = smc_transfer.get_queue()
+    transfer_queue.wait()
+    smc_gpu_cache.repoint_transferred()
+
+    for transfer in transfer_queue.failed:
+        for result in results:
+            if result["path"] == transfer.dst and not result["error"]:
+                result["error"] = "transfer failed: %s" % transfer.error
+
+    if options.save:
+        for cache, result in caches:
+            if not result["error"]:
+                cache.turn_on_cache()
+
+    if options.save and not any(result["error"] for result in results):
+        cmds.file(save=True, force=True)
+
+    return (EXIT_CACHE_FAILED if any(result["error"] for result in results) else EXIT_OK), results
+
+
+def _worker(scene, options_json, result_path):
+    """Entry point of the mayapy worker processes"""
+
+    try:
+        import maya.standalone
+        maya.standalone.initialize(name="python")
+    except Exception as e:
+        log.error("Could not start maya: %s", e)
+        return EXIT_MAYA_FAILED
+
+    try:
+        exit_code, results = cache_scene(scene, BatchOptions.from_dict(json.loads(options_json)))
+
+    except Exception as e:
+        log.exception("Caching %s failed", scene)
+        exit_code, results = EXIT_SCENE_FAILED, [{"error": str(e)}]
+
+    try:
+        with open(result_path, "w") as outfile:
+            json.dump(results, outfile, indent=4)
+
+    finally:
+        maya.standalone.uninitialize()
+
+    return exit_code
+
+
+def _run_scene(scene, options, mayapy=MAYAPY, timeout=None):
+
+    result_file = tempfile.NamedTemporaryFile(prefix="smc_batch_", suffix=".json", delete=False)
+    result_file.close()
+
+    command = [mayapy, os.path.abspath(__file__), "--worker", scene, "--options", json.dumps(options.to_dict()),
+               "--result", result_file.name]
+
+    log.info("Caching %s", scene)
+    scene_start_time = time.perf_counter()
+
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=timeout)
+        exit_code, output = process.returncode, process.stdout
+
+    except subprocess.TimeoutExpired as e:
+        output = e.output or ""
+        exit_code, output = EXIT_TIMEOUT, output.decode(errors="replace") if isinstance(output, bytes) else output
+
+    except OSError as e:
+        exit_code, output = EXIT_MAYA_FAILED, str(e)
+
+    try:
+        with open(result_file.name) as infile:
+            caches = json.load(infile)
+    except ValueError:
+        caches = []
+    finally:
+        os.remove(result_file.name)
+
+    log.log(logging.INFO if exit_code == EXIT_OK else logging.ERROR, "%s finished with exit code %i", scene,
+            exit_code)
+
+    return {"scene": scene,
+            "exit_code": exit_code,
+            "status": STATUS.get(exit_code, "crashed"),
+            "duration": time.perf_counter() - scene_start_time,
+            "caches": caches,
+            "log": output.splitlines()[-50:]}
+
+
+def run_batch(scenes, options, jobs=2, mayapy=MAYAPY, timeout=None):
+    """Caches scenes in at most jobs parallel mayapy processes, returns the report"""
+
+    batch_start_time = time.time()
+
+    scenes = list(dict.fromkeys(scenes))
+
+    # Submitted shortest first, reported in the given order
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {scene: executor.submit(_run_scene, scene, options, mayapy, timeout)
+                   for scene in order_scenes(scenes)}
+        scene_reports = [futures[scene].result() for scene in scenes]
+
+    return {"start_time": batch_start_time,
+            "duration": time.time() - batch_start_time,
+            "options": options.to_dict(),
+            "scenes": scene_reports,
+            "failed": [report["scene"] for report in scene_reports if report["exit_code"] != EXIT_OK]}
+
+
+def _read_scenes(args):
+    """Scene files from the command line, @file arguments are read as one scene per line"""
+
+    scenes = []
+
+    for arg in args:
+        if arg.startswith("@"):
+            with open(arg[1:]) as infile:
+                scenes += [line.strip() for line in infile if line.strip() and not line.startswith("#")]
+        else:
+            scenes.append(arg)
+
+    return scenes
+
+
+def _quality_tag(tag):
+
+    if smc_quality.from_tag(tag) is None:
+        raise argparse.ArgumentTypeError("unknown quality %r" % tag)
+
+    return tag
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenes", nargs="*", help="scene files, @file for a list of scenes")
+    parser.add_argument("--namespace", action="append", default=[], help="namespace glob pattern, repeatable")
+    parser.add_argument("--ref-type", action="append", default=[], choices=REF_TYPES, help="repeatable")
+    parser.add_argument("--mode", action="append", choices=MODES,
+                        help="gpu: GpuCacheWrapper caches, abc: RefWrapper alembic caches. Repeatable, default gpu")
+    parser.add_argument("--dir", default="", help="gpu cache folder")
+    parser.add_argument("--store", default=os.environ.get("SMC_SHARED_STORE", ""), help="shared store folder")
+    parser.add_argument("--save", action="store_true", help="save the scenes with the gpu caches turned on")
+    parser.add_argument("--quality", default="final", type=_quality_tag,
+                        help="%s, or a custom profile like s2d50m0t10000 (step 2, half the faces, no materials, "
+                             "optimization threshold 10000)" % ", ".join(smc_quality.PRESETS))
+    parser.add_argument("--jobs", type=int, default=2, help="parallel mayapy processes")
+    parser.add_argument("--timeout", type=float, help="seconds per scene")
+    parser.add_argument("--mayapy", default=MAYAPY)
+    parser.add_argument("--report", help="write the json report to this file instead of stdout")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--options", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.worker:
+        return _worker(args.worker, args.options, args.result)
+
+    scenes = _read_scenes(args.scenes)
+    if not scenes:
+        parser.error("no scenes given")
+
+    options = BatchOptions(namespaces=args.namespace, ref_types=args.ref_type, modes=args.mode or [GPU],
+                           dir=args.dir, store=args.store, save=args.save, quality=args.quality)
+
+    report = run_batch(scenes, options, jobs=args.jobs, mayapy=args.mayapy, timeout=args.timeout)
+
+    if args.report:
+        with open(args.report, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+
+    return EXIT_CACHE_FAILED if report["failed"] else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
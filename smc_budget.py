@@ -0,0 +1,340 @@
+import os
+import logging
+
+import maya.cmds as cmds
+
+import smc_ref_wrapper
+import smc_transfer
+import smc_export_history
+import smc_cost
+import smc_quality
+import smc_visibility
+import smc_gpu_cache
+
+__all__ = ["RefCost", "ref_cost", "Action", "BudgetPlan", "BudgetPlanner", "format_savings"]
+
+log = logging.getLogger(__name__)
+
+# Loaded rig model, per reference
+RIG_BYTES_PER_NODE = 16 * 1024
+RIG_BYTES_PER_POLYGON = 600
+RIG_MS_PER_KNODE = 0.3
+RIG_MS_PER_DEFORMER = 0.4
+RIG_MS_PER_KPOLYGON = 0.02
+
+# Drawing a gpuCache, which holds its whole file in memory
+CACHE_MS_PER_KPOLYGON = 0.002
+
+# Frame time outside the references (viewport, cameras, sets), for fps budgets
+BASE_FRAME_MS = 8.0
+
+MEMORY = "memory"
+FPS = "fps"
+
+ENABLE = "enable"
+CREATE = "create"
+
+
+def _measured_saved_ms(asset):
+    """Median frame time saved by turning on the caches of asset, from measured toggles. None without any"""
+
+    saved = [1000.0 / record["fps_before"] - 1000.0 / record["fps_after"]
+             for record in smc_export_history.get_history().records(asset=asset, kind=smc_export_history.TOGGLE)
+             if record["path"] and min(record["fps_before"] or 0, record["fps_after"] or 0) > 0]
+
+    return smc_export_history.percentile(saved, 50)
+
+
+class RefCost():
+    """
+    Memory (bytes) and frame time (ms) of a reference loaded as a rig and drawn from a gpu cache,
+    with the export time of a new cache
+    """
+
+    def __init__(self, rfn, nodes, deformers, polygons, rig_bytes, rig_ms, cache_bytes, cache_ms, export_seconds,
+                 measured=False):
+
+        self.rfn = rfn
+        self.nodes = nodes
+        self.deformers = deformers
+        self.polygons = polygons
+
+        self.rig_bytes = rig_bytes
+        self.rig_ms = rig_ms
+        self.cache_bytes = cache_bytes
+        self.cache_ms = cache_ms
+        self.export_seconds = export_seconds
+
+        # rig_ms comes from fps measured when its cache was turned on
+        self.measured = measured
+
+    @property
+    def saved_bytes(self):
+        return self.rig_bytes - self.cache_bytes
+
+    @property
+    def saved_ms(self):
+        return self.rig_ms - self.cache_ms
+
+    def __repr__(self):
+        return "RefCost(%s, saves %.1f MB, %.2f ms)" % (self.rfn, self.saved_bytes / 1024.0 ** 2, self.saved_ms)
+
+
+def ref_cost(rfn, cache_file=None, quality=smc_quality.FINAL):
+    """
+    RefCost of a reference, its gpu cache memory from cache_file when it has one, else from the export estimate.
+    Unloaded references are costed from the last export of their asset.
+    """
+
+    ref = smc_ref_wrapper.RefWrapper(rfn)
+    asset = smc_gpu_cache.cache_asset_name([rfn])
+
+    nodes = ref.node_count
+    deformers = ref.deformer_count
+    polygons = ref.polygon_count
+
+    if deformers is None:
+        last = smc_export_history.get_history().records(asset=asset, kind=smc_export_history.GPU_CACHE)[-1:]
+        polygons = (last[0]["polygons"] or 0) if last else 0
+        deformers = (last[0]["deformers"] or 0) if last else 0
+
+    start = cmds.playbackOptions(q=True, ast=True) - smc_gpu_cache.GpuCacheWrapper.BUFFER_AMOUNT
+    end = cmds.playbackOptions(q=True, aet=True) + smc_gpu_cache.GpuCacheWrapper.BUFFER_AMOUNT
+    estimate = smc_cost.get_model(smc_export_history.GPU_CACHE, quality.gpu_flags()).predict(
+        int(polygons * quality.decimation), deformers, quality.sample_count(start, end), asset=asset)
+
+    cache_bytes = estimate.output_bytes
+    if cache_file and os.path.exists(cache_file):
+        cache_bytes = os.path.getsize(cache_file)
+
+    cache_ms = polygons * quality.decimation / 1e3 * CACHE_MS_PER_KPOLYGON
+    rig_ms = nodes / 1e3 * RIG_MS_PER_KNODE + deformers * RIG_MS_PER_DEFORMER + polygons / 1e3 * RIG_MS_PER_KPOLYGON
+
+    measured_ms = _measured_saved_ms(asset)
+    if measured_ms is not None:
+        rig_ms = cache_ms + max(measured_ms, 0.0)
+
+    return RefCost(rfn, nodes, deformers, polygons,
+                   rig_bytes=nodes * RIG_BYTES_PER_NODE + polygons * RIG_BYTES_PER_POLYGON,
+                   rig_ms=rig_ms,
+                   cache_bytes=cache_bytes,
+                   cache_ms=cache_ms,
+                   export_seconds=estimate.duration,
+                   measured=measured_ms is not None)
+
+
+class Action():
+    """Enable an existing cache, or create one for a reference"""
+
+    def __init__(self, kind, rfns, saved_bytes, saved_ms, cache=None, export_seconds=0.0):
+
+        self.kind = kind
+        self.rfns = rfns
+        self.cache = cache
+        self.saved_bytes = saved_bytes
+        self.saved_ms = saved_ms
+        self.export_seconds = export_seconds
+
+    def saving(self, budget_kind):
+        return self.saved_bytes if budget_kind == MEMORY else self.saved_ms
+
+    def __repr__(self):
+        return "Action(%s %s, %.1f MB, %.2f ms)" % (self.kind, self.cache or ", ".join(self.rfns),
+                                                     self.saved_bytes / 1024.0 ** 2, self.saved_ms)
+
+
+class BudgetPlan():
+    """Actions bringing the scene from current to projected usage, within target if met"""
+
+    def __init__(self, kind, target, current, projected, actions):
+
+        self.kind = kind
+        self.target = target
+        self.current = current
+        self.projected = projected
+        self.actions = actions
+
+    @property
+    def met(self):
+        return self.projected <= self.target
+
+    def summary(self):
+
+        if self.kind == MEMORY:
+            usage = "%.0f MB -> %.0f MB (budget %.0f MB)" % (
+                self.current / 1024.0 ** 2, self.projected / 1024.0 ** 2, self.target / 1024.0 ** 2)
+        else:
+            usage = "%.1f fps -> %.1f fps (budget %.1f fps)" % (
+                1000.0 / self.current, 1000.0 / self.projected, 1000.0 / self.target)
+
+        enables = len([action for action in self.actions if action.kind == ENABLE])
+        return "%s: enable %i, create %i caches%s" % (usage, enables, len(self.actions) - enables,
+                                                      "" if self.met else ", budget not reachable")
+
+
+class BudgetPlanner():
+    """
+    Picks the fewest caches to enable or create to fit the scene in a memory or playback fps budget.
+    Usage is modelled as loaded rigs plus active caches, savings are rig minus cache cost per reference.
+    """
+
+    def __init__(self, cache_refs, rfns, quality=smc_quality.FINAL):
+        """
+        cache_refs: {gpuCache node: reference nodes}
+        rfns: every reference of the scene that can be cached
+        """
+
+        self.cache_refs = cache_refs
+        self.rfns = list(rfns)
+        self.quality = quality
+
+        self.ref_caches = {}
+        for cache, cache_rfns in cache_refs.items():
+            for rfn in cache_rfns:
+                self.ref_caches.setdefault(rfn, []).append(cache)
+
+        transfer_queue = smc_transfer.get_queue()
+        self.active = set(cache for cache in cache_refs if cmds.getAttr(cache + ".cacheFileName"))
+        self.costs = {}
+
+        for rfn in dict.fromkeys(self.rfns + [rfn for cache_rfns in cache_refs.values() for rfn in cache_rfns]):
+            caches = self.ref_caches.get(rfn, [])
+            cache_file = None
+            if caches:
+                # Shared by the references of the cache
+                cache_file = transfer_queue.resolve(cmds.getAttr(caches[0] + ".storedPath"))
+
+            try:
+                cost = ref_cost(rfn, cache_file, quality)
+            except RuntimeError as e:
+                log.debug("No cost for %s: %s", rfn, e)
+                continue
+
+            if caches:
+                cost.cache_bytes /= len(self.cache_refs[caches[0]])
+
+            self.costs[rfn] = cost
+
+    def _cached(self, rfn):
+        return any(cache in self.active for cache in self.ref_caches.get(rfn, []))
+
+    def usage(self, kind=MEMORY):
+        """Modelled memory (bytes) or frame time (ms) of the scene as it is"""
+
+        if kind == MEMORY:
+            return sum(cost.cache_bytes if self._cached(rfn) else cost.rig_bytes for rfn, cost in self.costs.items())
+
+        return BASE_FRAME_MS + sum(cost.cache_ms if self._cached(rfn) else cost.rig_ms
+                                   for rfn, cost in self.costs.items())
+
+    def candidates(self):
+        """Actions available: enabling each disabled cache, creating a cache for each uncached reference"""
+
+        actions = []
+
+        for cache, cache_rfns in self.cache_refs.items():
+            if cache in self.active:
+                continue
+
+            costs = [self.costs[rfn] for rfn in cache_rfns if rfn in self.costs and not self._cached(rfn)]
+            if costs:
+                actions.append(Action(ENABLE, list(cache_rfns), sum(cost.saved_bytes for cost in costs),
+                                      sum(cost.saved_ms for cost in costs), cache=cache))
+
+        for rfn in self.rfns:
+            if rfn in self.ref_caches or rfn not in self.costs:
+                continue
+
+            cost = self.costs[rfn]
+            actions.append(Action(CREATE, [rfn], cost.saved_bytes, cost.saved_ms,
+                                  export_seconds=cost.export_seconds))
+
+        return actions
+
+    def plan(self, budget, kind=MEMORY, current_fps=None):
+        """
+        BudgetPlan for a budget in MB (MEMORY) or fps (FPS). Taking the largest savings first gives the fewest
+        caches, enabling is preferred over creating on ties. A measured current_fps rescales the frame time model.
+        """
+
+        current = self.usage(kind)
+        scale = 1.0
+
+        if kind == MEMORY:
+            target = budget * 1024.0 ** 2
+        else:
+            target = 1000.0 / budget
+            if current_fps and current > BASE_FRAME_MS:
+                scale = max(1000.0 / current_fps - BASE_FRAME_MS, 0.0) / (current - BASE_FRAME_MS)
+                current = 1000.0 / current_fps
+
+        def order(action):
+            return -action.saving(kind), action.kind == CREATE, action.export_seconds
+
+        candidates = [action for action in self.candidates() if action.saving(kind) > 0]
+        candidates.sort(key=order)
+
+        actions = []
+        covered = set()
+        projected = current
+
+        while candidates and projected > target:
+            action = candidates.pop(0)
+
+            # Caches sharing references with a picked one only save the others. Savings only go down,
+            # a lowered one goes back in line
+            if covered.intersection(action.rfns):
+                costs = [self.costs[rfn] for rfn in action.rfns
+                         if rfn in self.costs and rfn not in covered and not self._cached(rfn)]
+                saved = (sum(cost.saved_bytes for cost in costs), sum(cost.saved_ms for cost in costs))
+
+                if saved != (action.saved_bytes, action.saved_ms):
+                    action.saved_bytes, action.saved_ms = saved
+                    if action.saving(kind) > 0:
+                        candidates.append(action)
+                        candidates.sort(key=order)
+                    continue
+
+            actions.append(action)
+            covered.update(action.rfns)
+            projected -= action.saving(kind) * scale
+
+        # Savings are estimates, they can't take the frame time under the base one or the memory under nothing
+        floor = 0.0 if kind == MEMORY else BASE_FRAME_MS
+        current = max(current, floor)
+        projected = max(projected, floor)
+
+        return BudgetPlan(kind, target, current, projected, actions)
+
+    def apply(self, plan, dir="", store=None, quality=None):
+        """
+        Enables the planned caches in one batch of reference state changes, then exports and turns on
+        the new ones. Returns the new GpuCacheWrappers
+        """
+
+        enable = [action.cache for action in plan.actions if action.kind == ENABLE]
+        if enable:
+            smc_visibility.apply_states(dict.fromkeys(enable, True), self.cache_refs)
+
+        start = cmds.playbackOptions(q=True, ast=True)
+        end = cmds.playbackOptions(q=True, aet=True)
+        created = []
+
+        for action in plan.actions:
+            if action.kind != CREATE:
+                continue
+
+            cache = smc_gpu_cache.GpuCacheWrapper(action.rfns, start, end, dir=dir, store=store,
+                                                   quality=quality or self.quality)
+            if not cache.exported:
+                cache.export_abc()
+            cache.turn_on_cache()
+            created.append(cache)
+
+        return created
+
+
+def format_savings(cost):
+    """Short table text, like "-120MB -3.2ms", measured frame times marked with a *"""
+
+    return "%+iMB %+.1fms%s" % (-round(cost.saved_bytes / 1024.0 ** 2), -cost.saved_ms, "*" if cost.measured else "")
@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["CacheCollector", "touch"]
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("SMC_CACHE_QUOTA_GB", 20)) * 1024 ** 3)
+DEFAULT_MAX_AGE = float(os.environ.get("SMC_CACHE_MAX_AGE_DAYS", 14)) * 24 * 60 * 60
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smc_cache_gc")
+
+
+def touch(path):
+    """Marks a cache file as used now, so it is the last one to be evicted"""
+
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class CacheEntry():
+
+    def __init__(self, path, size, last_used):
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+
+    def __repr__(self):
+        return "<CacheEntry %s %i bytes>" % (self.path, self.size)
+
+
+class CollectResult():
+
+    def __init__(self):
+        self.removed = []
+        self.reclaimed_bytes = 0
+        self.kept_bytes = 0
+        self.errors = []
+
+    def __repr__(self):
+        return "<CollectResult removed %i files, reclaimed %.1f MB, kept %.1f MB>" % (
+            len(self.removed), self.reclaimed_bytes / 1024.0 ** 2, self.kept_bytes / 1024.0 ** 2)
+
+
+class CacheCollector():
+    """
+    Size and age bounded LRU garbage collection of cache files in folders.
+
+    Files in use (pass the storedPath/cacheFileName of the scene gpuCache nodes) are never removed.
+    Anything older than max_age is removed, then least recently used files until the folders fit in max_bytes.
+    """
+
+    def __init__(self, folders, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, extensions=(".abc",)):
+
+        if isinstance(folders, str):
+            folders = [folders]
+
+        self.folders = folders
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.extensions = extensions
+
+    def scan(self):
+        """CacheEntries found in self.folders, least recently used first"""
+
+        entries = []
+
+        for folder in self.folders:
+            for root, dirs, files in os.walk(folder):
+                for file in files:
+                    if not file.endswith(self.extensions):
+                        continue
+
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+
+                    entries.append(CacheEntry(path, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+
+        entries.sort(key=lambda entry: entry.last_used)
+        return entries
+
+    def plan(self, in_use=()):
+        """Entries to evict, without removing anything"""
+
+        in_use = {_normalize(path) for path in in_use if path}
+        entries = self.scan()
+
+        total = sum(entry.size for entry in entries)
+        now = time.time()
+
+        to_remove = []
+
+        for entry in entries:
+
+            if _normalize(entry.path) in in_use:
+                continue
+
+            expired = self.max_age is not None and now - entry.last_used > self.max_age
+            over_quota = self.max_bytes is not None and total > self.max_bytes
+
+            if expired or over_quota:
+                to_remove.append(entry)
+                total -= entry.size
+
+        return to_remove
+
+    def collect(self, in_use=()):
+        """Removes the planned entries. Returns a CollectResult with the reclaimed space"""
+
+        result = CollectResult()
+        to_remove = self.plan(in_use)
+
+        for entry in to_remove:
+            try:
+                os.remove(entry.path)
+                result.removed.append(entry.path)
+                result.reclaimed_bytes += entry.size
+            except OSError as e:
+                result.errors.append(e)
+                log.warning("Could not remove %s: %s", entry.path, e)
+
+        result.kept_bytes = sum(entry.size for entry in self.scan())
+
+        log.info("Cache GC %s", result)
+        return result
+
+    def collect_async(self, in_use=()):
+        """Runs collect in a background thread. Returns a Future with the CollectResult"""
+
+        return _executor.submit(self.collect, list(in_use))
@@ -0,0 +1,206 @@
+import re
+import time
+import logging
+import threading
+
+import smc_export_history
+
+__all__ = ["Estimate", "CostModel", "get_model", "format_estimate"]
+
+log = logging.getLogger(__name__)
+
+# Used until the history has MIN_SAMPLES exports of a kind
+DEFAULT_BASE_SECONDS = 2.0
+DEFAULT_SECONDS_PER_MPOLY_FRAME = 0.4
+DEFAULT_SECONDS_PER_KDEFORMER_FRAME = 0.05
+DEFAULT_BYTES_PER_POLY_FRAME = 12.0
+
+MIN_SAMPLES = 5
+
+# Session models are refitted from the history after this many seconds
+MODEL_TTL = 60
+
+
+class Estimate():
+    """Predicted export duration (seconds) and output size (bytes)"""
+
+    def __init__(self, duration, output_bytes, samples=0, asset_samples=0):
+
+        self.duration = duration
+        self.output_bytes = output_bytes
+        # Past exports the model and the asset correction were fitted on
+        self.samples = samples
+        self.asset_samples = asset_samples
+
+    @property
+    def calibrated(self):
+        return self.samples >= MIN_SAMPLES
+
+    def __repr__(self):
+        return "Estimate(%.1fs, %i bytes, %i samples)" % (self.duration, self.output_bytes, self.samples)
+
+
+def _features(polygons, deformers, frames):
+    """Regressors of the linear model: constant, million polygon frames, thousand deformer frames"""
+    return [1.0, (polygons or 0) * frames / 1e6, (deformers or 0) * frames / 1e3]
+
+
+def _solve(rows, values, ridge=1e-6):
+    """Least squares coefficients of rows @ x = values, normal equations with a small ridge"""
+
+    size = len(rows[0])
+    matrix = [[sum(row[i] * row[j] for row in rows) + (ridge if i == j else 0.0) for j in range(size)]
+              for i in range(size)]
+    vector = [sum(row[i] * value for row, value in zip(rows, values)) for i in range(size)]
+
+    # Gaussian elimination with partial pivoting
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(matrix[row][column]))
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        vector[column], vector[pivot] = vector[pivot], vector[column]
+
+        if not matrix[column][column]:
+            continue
+
+        for row in range(column + 1, size):
+            factor = matrix[row][column] / matrix[column][column]
+            for k in range(column, size):
+                matrix[row][k] -= factor * matrix[column][k]
+            vector[row] -= factor * vector[column]
+
+    result = [0.0] * size
+    for row in reversed(range(size)):
+        if matrix[row][row]:
+            result[row] = (vector[row] - sum(matrix[row][k] * result[k] for k in range(row + 1, size))) / \
+                          matrix[row][row]
+
+    return result
+
+
+def _flags_key(flags):
+    """Export flags without the frame range, which the model covers already"""
+    return re.sub(r"-frameRange \S+ \S+ ?", "", flags or "").strip()
+
+
+def _median(values):
+    return smc_export_history.percentile(values, 50)
+
+
+class CostModel():
+    """
+    Linear export time and output size model of one export kind, calibrated on its past exports:
+
+        duration = base + a * polygons * frames + b * deformers * frames
+        output_bytes = c * polygons * frames
+
+    Predictions for assets with history are scaled by the median actual / predicted ratio of their exports.
+    """
+
+    def __init__(self, records=()):
+
+        self.duration_coefficients = [DEFAULT_BASE_SECONDS, DEFAULT_SECONDS_PER_MPOLY_FRAME,
+                                      DEFAULT_SECONDS_PER_KDEFORMER_FRAME]
+        self.bytes_per_poly_frame = DEFAULT_BYTES_PER_POLY_FRAME
+        self.samples = 0
+
+        self._asset_records = {}
+        self._asset_ratios = {}
+
+        self.calibrate(records)
+
+    def calibrate(self, records):
+
+        records = [record for record in records if record["frames"] and record["polygons"]]
+
+        self._asset_records = {}
+        for record in records:
+            self._asset_records.setdefault(record["asset"], []).append(record)
+
+        timed = [record for record in records if record["duration"] is not None]
+        self.samples = len(timed)
+
+        if len(timed) >= MIN_SAMPLES:
+            coefficients = _solve([_features(record["polygons"], record["deformers"], record["frames"])
+                                   for record in timed], [record["duration"] for record in timed])
+            # Negative rates come from noise on small samples, keep the defaults for those
+            self.duration_coefficients = [coefficient if coefficient >= 0 else default for coefficient, default in
+                                          zip(coefficients, self.duration_coefficients)]
+
+        sized = [record for record in records if record["output_bytes"]]
+        if len(sized) >= MIN_SAMPLES:
+            self.bytes_per_poly_frame = sum(record["output_bytes"] for record in sized) / \
+                                        sum(record["polygons"] * record["frames"] for record in sized)
+
+        self._asset_ratios = {}
+        for asset, asset_records in self._asset_records.items():
+            ratios = [record["duration"] / self._duration(record["polygons"], record["deformers"], record["frames"])
+                      for record in asset_records if record["duration"] is not None]
+            if ratios:
+                self._asset_ratios[asset] = (_median(ratios), len(ratios))
+
+        log.debug("Calibrated on %i exports: %s, %.1f bytes per polygon frame", self.samples,
+                  self.duration_coefficients, self.bytes_per_poly_frame)
+
+    def _duration(self, polygons, deformers, frames):
+        features = _features(polygons, deformers, frames)
+        return max(sum(c * f for c, f in zip(self.duration_coefficients, features)), 1e-3)
+
+    def predict(self, polygons, deformers, frames, asset=None):
+        """
+        Estimate of an export. Unknown (None or 0, unloaded refs) polygon and deformer counts
+        are taken from the last export of asset.
+        """
+
+        last = self._asset_records.get(asset, [])[-1:]
+        if not polygons and last:
+            polygons = last[0]["polygons"]
+        if deformers is None and last:
+            deformers = last[0]["deformers"]
+
+        duration = self._duration(polygons, deformers, frames)
+        ratio, asset_samples = self._asset_ratios.get(asset, (1.0, 0))
+
+        return Estimate(duration * ratio, int((polygons or 0) * frames * self.bytes_per_poly_frame),
+                        samples=self.samples, asset_samples=asset_samples)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(kind, flags=None, refresh=False):
+    """
+    Session CostModel of an export kind (smc_export_history.GPU_CACHE, ABC_CACHE), refitted every MODEL_TTL.
+    Fitted on the exports made with flags when there are enough of them, else on every export of the kind.
+    """
+
+    with _models_lock:
+        model, fitted_time = _models.get((kind, flags), (None, 0))
+
+        if model is None or refresh or time.time() - fitted_time > MODEL_TTL:
+            records = smc_export_history.get_history().records(kind=kind)
+
+            if flags is not None:
+                same_flags = [record for record in records if _flags_key(record["flags"]) == _flags_key(flags)]
+                if len(same_flags) >= MIN_SAMPLES:
+                    records = same_flags
+
+            model = CostModel(records)
+            _models[(kind, flags)] = (model, time.time())
+
+    return model
+
+
+def format_estimate(estimate):
+    """Short table text, like "~1m20s 45MB", with a ? while the model runs on defaults"""
+
+    seconds = int(round(estimate.duration))
+    if seconds >= 3600:
+        duration = "%ih%02im" % (seconds // 3600, seconds % 3600 // 60)
+    elif seconds >= 60:
+        duration = "%im%02is" % (seconds // 60, seconds % 60)
+    else:
+        duration = "%is" % seconds
+
+    return "~%s %iMB%s" % (duration, round(estimate.output_bytes / 1024.0 ** 2),
+                           "" if estimate.calibrated or estimate.asset_samples else "?")
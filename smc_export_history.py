@@ -0,0 +1,235 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+__all__ = ["ExportHistory", "get_history"]
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DB = os.environ.get("SMC_HISTORY_DB",
+                            os.path.join(os.path.expanduser("~"), ".smc_maya_utils", "export_history.db"))
+
+FIELDS = ["time", "kind", "asset", "scene", "path", "frames", "polygons", "deformers", "flags", "duration",
+          "output_bytes", "fps_before", "fps_after"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    kind TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    scene TEXT,
+    path TEXT,
+    frames INTEGER,
+    polygons INTEGER,
+    deformers INTEGER,
+    flags TEXT,
+    duration REAL,
+    output_bytes INTEGER,
+    fps_before REAL,
+    fps_after REAL
+);
+CREATE INDEX IF NOT EXISTS exports_asset ON exports (asset, kind, time);
+"""
+
+# Columns added after the first release, added to older databases on open
+MIGRATIONS = {"deformers": "INTEGER"}
+
+GPU_CACHE = "gpu_cache"
+ABC_CACHE = "abc_cache"
+TOGGLE = "toggle"
+
+
+def percentile(values, pct):
+    """Linear interpolated percentile of values (0-100)"""
+
+    values = sorted(values)
+    if not values:
+        return None
+
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class ExportHistory():
+    """
+    Local sqlite record of every export and cache toggle, with percentile and trend summaries per asset
+    """
+
+    def __init__(self, path=DEFAULT_DB):
+
+        self.path = path
+        self._lock = threading.Lock()
+
+        try:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._connection = self._open(path)
+
+        except (OSError, sqlite3.Error) as e:
+            # Locked, read only or corrupt
+            log.warning("Could not open export history %s, keeping it in memory: %s", path, e)
+            self._connection = self._open(":memory:")
+
+    @staticmethod
+    def _open(path):
+        """Connection to path with the schema created and migrated"""
+
+        connection = sqlite3.connect(path, check_same_thread=False)
+
+        try:
+            connection.row_factory = sqlite3.Row
+            connection.executescript(SCHEMA)
+
+            columns = [row["name"] for row in connection.execute("PRAGMA table_info(exports)")]
+            with connection:
+                for column, column_type in MIGRATIONS.items():
+                    if column not in columns:
+                        connection.execute("ALTER TABLE exports ADD COLUMN %s %s" % (column, column_type))
+
+        except sqlite3.Error:
+            connection.close()
+            raise
+
+        return connection
+
+    def record(self, kind, asset, **fields):
+        """Adds a record, returns its id. Never raises, history must not break exports"""
+
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise TypeError("Unknown history fields %s" % ", ".join(sorted(unknown)))
+
+        fields.setdefault("time", time.time())
+        fields["kind"] = kind
+        fields["asset"] = asset
+
+        columns = sorted(fields)
+
+        try:
+            with self._lock, self._connection:
+                cursor = self._connection.execute(
+                    "INSERT INTO exports (%s) VALUES (%s)" % (", ".join(columns), ", ".join("?" * len(columns))),
+                    [fields[column] for column in columns])
+                return cursor.lastrowid
+
+        except sqlite3.Error as e:
+            log.warning("Could not record export history: %s", e)
+            return None
+
+    def update(self, record_id, **fields):
+        """Fills in fields measured later, like fps_after"""
+
+        if record_id is None or not fields:
+            return
+
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise TypeError("Unknown history fields %s" % ", ".join(sorted(unknown)))
+
+        columns = sorted(fields)
+
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "UPDATE exports SET %s WHERE id = ?" % ", ".join("%s = ?" % column for column in columns),
+                    [fields[column] for column in columns] + [record_id])
+
+        except sqlite3.Error as e:
+            log.warning("Could not update export history: %s", e)
+
+    def records(self, asset=None, kind=None, since=None, scene=None):
+        """Records as dicts, oldest first"""
+
+        query = "SELECT * FROM exports WHERE 1"
+        args = []
+
+        if scene is not None:
+            query += " AND scene = ?"
+            args.append(scene)
+
+        if asset is not None:
+            query += " AND asset = ?"
+            args.append(asset)
+        if kind is not None:
+            query += " AND kind = ?"
+            args.append(kind)
+        if since is not None:
+            query += " AND time >= ?"
+            args.append(since)
+
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(query + " ORDER BY time", args)]
+
+    def assets(self, kind=None):
+
+        query = "SELECT DISTINCT asset FROM exports"
+        args = []
+        if kind is not None:
+            query += " WHERE kind = ?"
+            args.append(kind)
+
+        with self._lock:
+            return [row[0] for row in self._connection.execute(query + " ORDER BY asset", args)]
+
+    def percentiles(self, asset, field="duration", kind=None, pcts=(50, 90, 99)):
+        """{pct: value} of field over the records of asset"""
+
+        values = [record[field] for record in self.records(asset, kind) if record[field] is not None]
+        return {pct: percentile(values, pct) for pct in pcts}
+
+    def trend(self, asset, field="duration", kind=None, bucket_days=7):
+        """[(bucket start time, mean, count)] of field over time"""
+
+        bucket_seconds = bucket_days * 24 * 60 * 60
+        buckets = {}
+
+        for record in self.records(asset, kind):
+            if record[field] is None:
+                continue
+            bucket = int(record["time"] // bucket_seconds) * bucket_seconds
+            buckets.setdefault(bucket, []).append(record[field])
+
+        return [(bucket, sum(values) / len(values), len(values)) for bucket, values in sorted(buckets.items())]
+
+    def report(self, kind=None):
+        """Per asset summary: export count, duration and size percentiles and mean fps gain"""
+
+        summary = {}
+
+        for asset in self.assets(kind):
+            records = self.records(asset, kind)
+            durations = [record["duration"] for record in records if record["duration"] is not None]
+            sizes = [record["output_bytes"] for record in records if record["output_bytes"] is not None]
+            gains = [record["fps_after"] - record["fps_before"] for record in records
+                     if record["fps_after"] is not None and record["fps_before"] is not None]
+
+            summary[asset] = {"count": len(records),
+                              "duration_p50": percentile(durations, 50),
+                              "duration_p90": percentile(durations, 90),
+                              "bytes_p50": percentile(sizes, 50),
+                              "bytes_p90": percentile(sizes, 90),
+                              "fps_gain": sum(gains) / len(gains) if gains else None}
+
+        return summary
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Shared ExportHistory for the maya session"""
+
+    global _history
+
+    with _history_lock:
+        if _history is None:
+            _history = ExportHistory()
+
+    return _history
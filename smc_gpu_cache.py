@@ -0,0 +1,652 @@
+import os
+import re
+import time
+import logging
+import threading
+
+import maya.cmds as cmds
+
+import smc_ref_wrapper
+import smc_transfer
+import smc_cache_gc
+import smc_shared_store
+import smc_alembic
+import smc_trace
+import smc_export_history
+import smc_cost
+import smc_quality
+import smc_lod
+import smc_journal
+
+__all__ = ["GpuCacheWrapper", "get_refs", "get_refs_in_scene_wrap", "cache_asset_name", "ref_counts", "measure_fps",
+           "repoint_callback", "repoint_transferred"]
+
+log = logging.getLogger(__name__)
+
+
+def get_refs():
+    refs = {}
+    for rfn in cmds.ls(type="reference"):
+        try:
+            if cmds.referenceQuery(rfn, filename=True, un=True):
+                refs[rfn] = cmds.referenceQuery(rfn, filename=True, un=True)
+        except RuntimeError:
+            continue
+
+    return refs
+
+
+@smc_trace.traced("scene_scan")
+def get_refs_in_scene_wrap():
+    found = []
+    for ref, file in get_refs().items():
+
+        if "LAYOUTCACHE" in ref:
+            continue
+
+        if "cam_" in ref:
+            continue
+
+        w_ref = smc_ref_wrapper.RefWrapper(ref)
+        found.append((w_ref.namespace, w_ref.version, w_ref.reference_node))
+
+    return found
+
+
+def cache_asset_name(rfns):
+    """Asset name of a cache in the export history: its reference names without namespace and RN"""
+    return ",".join(sorted(re.sub("RN$", "", re.sub(".*:", "", ref)) for ref in rfns))
+
+
+# {reference node: ((file, file mtime, loaded), polygons, deformers)}
+_ref_counts = {}
+
+
+def ref_counts(rfn):
+    """
+    (polygons, deformers) of a reference for export estimates, deformers None while it is unloaded.
+    Kept until the reference is loaded, unloaded or its file changes, so table refreshes don't walk every rig again
+    """
+
+    ref_file = cmds.referenceQuery(rfn, filename=True, wcn=True)
+    try:
+        mtime = os.path.getmtime(ref_file)
+    except OSError:
+        mtime = None
+
+    key = (ref_file, mtime, cmds.referenceQuery(rfn, isLoaded=True))
+
+    cached = _ref_counts.get(rfn)
+    if cached and cached[0] == key:
+        return cached[1:]
+
+    ref = smc_ref_wrapper.RefWrapper(rfn)
+    counts = (ref.polygon_count, ref.deformer_count)
+    _ref_counts[rfn] = (key,) + counts
+
+    return counts
+
+
+def measure_fps(sample_frames=20):
+    """Playback fps of the current scene, timed stepping sample_frames frames with viewport refreshes"""
+
+    current = cmds.currentTime(q=True)
+    start = cmds.playbackOptions(q=True, min=True)
+
+    start_time = time.perf_counter()
+    for frame in range(sample_frames):
+        cmds.currentTime(start + frame, update=True)
+        cmds.refresh()
+    elapsed = time.perf_counter() - start_time
+
+    cmds.currentTime(current)
+
+    return sample_frames / elapsed if elapsed else 0.0
+
+
+# Transfers of cache exports done since the last repoint_transferred, appended by the transfer threads
+_transferred = []
+_transferred_lock = threading.Lock()
+
+
+def repoint_callback(callback=None):
+    """
+    Transfer callback of cache exports: calls callback, then records the transfer once done for
+    repoint_transferred. Maya commands are not thread safe, nothing is repointed from the transfer thread.
+    """
+
+    def transferred(transfer):
+
+        try:
+            if callback:
+                callback(transfer)
+        finally:
+            if transfer.state == smc_transfer.Transfer.DONE:
+                with _transferred_lock:
+                    _transferred.append(transfer)
+
+    return transferred
+
+
+def repoint_transferred():
+    """
+    In the main thread: points the gpuCache nodes reading the scratch copy of a finished transfer at its final
+    file and removes the scratch copy. A failed transfer leaves the nodes on the scratch copy.
+    Returns the transfers repointed
+    """
+
+    with _transferred_lock:
+        transfers = list(_transferred)
+        del _transferred[:]
+
+    if not transfers:
+        return []
+
+    final_paths = dict((transfer.src, transfer.dst) for transfer in transfers)
+    for cache in cmds.ls(type="gpuCache") or []:
+        final_path = final_paths.get(cmds.getAttr(cache + ".cacheFileName"))
+        if final_path:
+            cmds.setAttr(cache + ".cacheFileName", final_path, type="string")
+
+    # Exported again meanwhile, the new transfer reads it
+    pending = set(other.src for other in smc_transfer.get_queue().pending)
+
+    for transfer in transfers:
+        if transfer.src in pending:
+            continue
+
+        try:
+            os.remove(transfer.src)
+        except OSError as e:
+            log.debug(e)
+
+    return transfers
+
+
+class GpuCacheWrapper():
+    """
+    Wrapper for gpu cahe_node. Character(rfn) driven
+    """
+
+    BUFFER_AMOUNT = 5
+    EXPORT_FLAGS = smc_quality.FINAL.gpu_flags()
+
+    def __init__(self, rfns, start, end, dir="", name="", store=None, quality=None, lods=None):
+        """
+        quality: smc_quality.QualityProfile of the cache, by default the one stored on an existing node or FINAL
+        lods: also export coarser LOD variants for smc_lod switching, by default if an existing node has them
+        """
+
+        import tempfile
+
+        if not dir:
+            dir = tempfile.gettempdir()
+
+        self.dir = dir
+        self.store = store
+        self._rfns = rfns
+
+        self._start = start
+        self._end = end
+
+        self._active = False
+        self._exported = False
+        self._filepath = ""
+
+        # Export history record of the last export
+        self.history_id = None
+
+        start_name = os.path.basename(cmds.file(q=True, sn=True)).split(".")[0]
+        self._start_name = start_name
+
+        self._cache_node = ""
+        self._quality = quality or smc_quality.FINAL
+
+        if "GPU_CACHES" not in cmds.ls(assemblies=True):
+            cmds.createNode("transform", name="GPU_CACHES")
+
+        if name == "":
+            import random
+            import string
+            _random_string_shot = ''.join(random.choices(string.ascii_letters, k=6))
+            name = _random_string_shot
+
+        node_name = "gpuCache_" + name
+
+        for cache_node in cmds.ls(type="gpuCache"):
+
+            refs_list = []
+
+            try:
+                refs_list = cmds.getAttr("%s.refNodes" % cache_node)
+                log.debug("%s refNodes %s", cache_node, refs_list)
+            except ValueError:
+                continue
+
+            if not refs_list:
+                cmds.delete(cache_node)
+                continue
+
+            refs_list.sort()
+
+            if refs_list == sorted(self._rfns):
+
+                # Reject missing, truncated or half written caches
+                stored_path = smc_transfer.get_queue().resolve(cmds.getAttr(cache_node + ".storedPath"))
+                if not smc_alembic.is_valid(stored_path):
+                    cmds.delete(cache_node)
+                    continue
+
+                self._cache_node = cache_node
+
+                if quality is None:
+                    self._quality = self._stored_quality()
+                elif quality != self._stored_quality():
+                    self.quality = quality
+
+                self._filepath = self._make_filepath()
+
+                break
+
+        if self.cache_node == "":
+            self._cache_node = cmds.createNode("gpuCache", parent="GPU_CACHES", name=node_name)
+
+            cmds.addAttr(self.cache_node, longName="refNodes", dataType="stringArray")
+
+            # cmds.addAttr(self.cache_node, longName = "startFrame", attributeType = "float")
+            # cmds.addAttr(self.cache_node, longName = "endFrame", attributeType = "float")
+            # cmds.setAttr(self.cache_node + ".startFrame", float(start) ,type="float")
+            # cmds.setAttr(self.cache_node + ".endFrame", float(end) ,type="float")
+
+            # print(re.sub(":.*RN", "" , " ".join(self._rfns)))
+            cmds.setAttr(self.cache_node + ".refNodes", *([len(self._rfns)] + self._rfns), type="stringArray")
+
+            self._filepath = self._make_filepath()
+
+            cmds.addAttr(self.cache_node, longName="storedPath", dataType="string")
+            cmds.setAttr(self.cache_node + ".storedPath", self.filepath, type="string")
+
+            self.quality = self._quality
+
+        self.lods = bool(smc_lod.lod_paths(self.cache_node)) if lods is None else lods
+
+    def _make_filepath(self):
+
+        refs_no_ns = [re.sub("RN$", "", re.sub(".*:", "", ref)) for ref in self.rfns]
+        return os.path.join(self.dir, "%s_" % self._start_name + self.cache_node + "_%s_%i_%i_%s.abc" % (
+            "_".join(refs_no_ns), self.start, self.end, self.quality.file_suffix))
+
+    def _stored_quality(self):
+
+        try:
+            return smc_quality.QualityProfile.from_json(cmds.getAttr(self.cache_node + ".qualityProfile"))
+        except ValueError:
+            return smc_quality.FINAL
+
+    @property
+    def quality(self):
+        return self._quality
+
+    @quality.setter
+    def quality(self, quality):
+        """Stores the profile on the node, the cache has to be exported again to use it"""
+
+        if not cmds.attributeQuery("qualityProfile", node=self.cache_node, exists=True):
+            cmds.addAttr(self.cache_node, longName="qualityProfile", dataType="string")
+
+        cmds.setAttr(self.cache_node + ".qualityProfile", quality.to_json(), type="string")
+
+        self._quality = quality
+        if self._filepath:
+            self._filepath = self._make_filepath()
+
+    @property
+    def cache_node(self):
+        return self._cache_node
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def active(self):
+
+        self._active = cmds.getAttr(self.cache_node + ".cacheFileName")
+        return self._active
+
+    @property
+    def rfns(self):
+
+        # print(re.sub(":.*RN", "", " ".join(self._rfns)))
+        # cmds.setAttr(self.cache_node + ".refNodes",re.sub(":.*RN", "" , " ".join(self._rfns)), type="stringArray")
+        return self._rfns
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def asset_name(self):
+        return cache_asset_name(self.rfns)
+
+    @classmethod
+    def estimate_export(cls, rfns, quality=smc_quality.FINAL):
+        """smc_cost.Estimate of export_abc of rfns with the current playback range, without creating a node"""
+
+        start = cmds.playbackOptions(q=True, ast=True) - cls.BUFFER_AMOUNT
+        end = cmds.playbackOptions(q=True, aet=True) + cls.BUFFER_AMOUNT
+
+        polygons = 0
+        deformers = 0
+        for rfn in rfns:
+            ref_polygons, ref_deformers = ref_counts(rfn)
+
+            # Unloaded, the model falls back on the counts of the last export of the asset
+            if ref_deformers is None:
+                polygons, deformers = 0, None
+                break
+
+            polygons += ref_polygons
+            deformers += ref_deformers
+
+        return smc_cost.get_model(smc_export_history.GPU_CACHE, quality.gpu_flags()).predict(
+            int(polygons * quality.decimation), deformers, quality.sample_count(start, end),
+            asset=cache_asset_name(rfns))
+
+    def estimate(self):
+        return self.estimate_export(self.rfns, self.quality)
+
+    def lod_paths(self):
+        """Cache files of LOD 0 (filepath), 1, 2..."""
+        return [smc_lod.lod_path(self.filepath, level) for level in range(len(smc_lod.lod_profiles(self.quality)))]
+
+    def _variants(self):
+        """(quality, filepath) of every file export_abc writes"""
+
+        if not self.lods:
+            return [(self.quality, self.filepath)]
+
+        return list(zip(smc_lod.lod_profiles(self.quality), self.lod_paths()))
+
+    def _store_lod_paths(self, paths):
+
+        if not cmds.attributeQuery("lodPaths", node=self.cache_node, exists=True):
+            if not paths:
+                return
+            cmds.addAttr(self.cache_node, longName="lodPaths", dataType="stringArray")
+
+        cmds.setAttr(self.cache_node + ".lodPaths", *([len(paths)] + paths), type="stringArray")
+
+    def find_lods(self):
+        """Attaches LOD files found next to filepath to the node, for repaired nodes. Returns if there are any"""
+
+        paths = self.lod_paths()
+        if not os.path.exists(paths[1]):
+            return False
+
+        self.lods = True
+        self._store_lod_paths([path for path in paths if os.path.exists(path)])
+        return True
+
+    @property
+    def exported(self):
+        transfer_queue = smc_transfer.get_queue()
+        self._exported = all(smc_alembic.is_valid(path) or transfer_queue.is_pending(path)
+                             for quality, path in self._variants())
+        return self._exported
+
+    def store_key(self, start, end, flags, quality=None):
+        """Shared store key of this cache, None if the scene has unsaved changes"""
+
+        quality = quality or self.quality
+
+        if cmds.file(q=True, modified=True):
+            return None
+
+        scene = cmds.file(q=True, sn=True)
+
+        inputs = {"scene": scene,
+                  "scene_mtime": os.path.getmtime(scene) if os.path.exists(scene) else 0,
+                  "refs": [],
+                  "start": start,
+                  "end": end,
+                  "flags": flags}
+
+        # Final caches keep the keys they had before quality profiles
+        if not quality.is_final:
+            inputs["quality"] = quality.to_dict()
+
+        for rfn in sorted(self.rfns):
+            ref_file = cmds.referenceQuery(rfn, filename=True, wcn=True)
+            inputs["refs"].append((rfn, ref_file, os.path.getmtime(ref_file) if os.path.exists(ref_file) else 0))
+
+        return smc_shared_store.SharedStore.key(inputs)
+
+    @property
+    def name(self):
+        """Node name without gpuCache_, the name argument that gives the same filepath"""
+        return re.sub("^gpuCache_", "", self.cache_node)
+
+    @smc_trace.traced()
+    def export_abc(self, force=False, job=None):
+        """
+        Exports cache to self.dir of self.rfns, and its LOD variants if self.lods.
+        With a shared store, identical caches are linked from it instead (unless force) and new ones published.
+        Runs as job of the export journal (a new one by default), so a crash does not lose track of it.
+        """
+
+        journal = smc_journal.get_journal()
+        variants = self._variants()
+
+        if job is None:
+            job = journal.queue(smc_export_history.GPU_CACHE, cmds.file(q=True, sn=True), self.rfns, self.start,
+                                self.end, self.quality.to_json(), lods=self.lods, dir=self.dir)
+        journal.start(job, name=self.name, outputs=[filepath for quality, filepath in variants])
+
+        transfers = {}
+
+        try:
+            for level, (quality, filepath) in enumerate(variants):
+                # Decimated LODs in the history would cost the asset at a fraction of its size
+                record_id, transfers[filepath] = self._export_variant(
+                    quality, filepath, force, callback=repoint_callback(journal.transfer_callback(job)),
+                    record=not level)
+                if not level:
+                    self.history_id = record_id
+
+        except Exception as e:
+            journal.fail(job, e)
+            raise
+
+        self._store_lod_paths(self.lod_paths() if self.lods else [])
+        journal.exported(job, transfers)
+
+    def _export_variant(self, quality, filepath, force, callback=None, record=True):
+        """
+        Exports one file of the cache. Returns its export history id (None when taken from the store or
+        not recorded) and its smc_transfer.Transfer, None when written in place. callback is passed to the transfer
+        """
+
+        start_frame = cmds.playbackOptions(q=True, ast=True)
+        end_frame = cmds.playbackOptions(q=True, aet=True)
+
+        start = start_frame - self.BUFFER_AMOUNT
+        end = end_frame + self.BUFFER_AMOUNT
+
+        export_start_time = time.perf_counter()
+
+        flags = quality.gpu_flags()
+        key = self.store_key(start, end, flags, quality) if self.store else None
+
+        # Only the owner of the store lock publishes and releases it
+        owned = False
+
+        if key:
+            # Waiting on another writer would freeze an interactive session, it exports without publishing instead
+            timeout = smc_shared_store.SharedStore.LOCK_TIMEOUT_SECONDS if cmds.about(batch=True) else 0
+
+            try:
+                if not force and self.store.fetch(key, filepath):
+                    return None, None
+
+                owned = self.store.acquire(key, timeout=timeout)
+                if not owned and not force:
+                    # Published by someone else while waiting
+                    self.store.fetch(key, filepath)
+                    return None, None
+
+            except smc_shared_store.StoreLockTimeout as e:
+                log.warning("%s, exporting without publishing to the shared store", e)
+
+        roots = []
+
+        for rfn in self.rfns:
+
+            if not cmds.referenceQuery(rfn, isLoaded=True):
+                with smc_trace.span("load_reference", rfn=rfn):
+                    cmds.file(loadReference=rfn)
+
+            log.info("Loaded REF %s", rfn)
+            roots.append(cmds.referenceQuery(rfn, nodes=True)[0])
+
+        cache_roots = [roots[0]]
+
+        # Export to local scratch, the transfer queue moves it to self.dir
+        transfer_queue = smc_transfer.get_queue()
+        local_path = transfer_queue.scratch_path(filepath)
+
+        for path in {filepath, local_path}:
+            try:
+                os.remove(path)
+            except Exception as e:
+                log.debug(e)
+
+        command = "gpuCache -startTime {} -endTime {} {} -directory \"{}\" -fileName \"{}\" " \
+                  "-saveMultipleFiles false ".format(start,
+                                                     end,
+                                                     flags,
+                                                     os.path.dirname(local_path.replace('\\', '/')),
+                                                     os.path.basename(local_path.replace(".abc", "")))
+
+        command += " ".join(cache_roots) + ";"
+
+        import maya.mel
+        log.info("GPU CACHE EXPORT %s", command)
+
+        meshes = []
+        if quality.decimation < 1.0:
+            meshes = cmds.ls(cmds.listRelatives(cache_roots, allDescendents=True, fullPath=True) or [],
+                             type="mesh", noIntermediate=True)
+
+        try:
+            with smc_quality.decimated(meshes, quality.decimation):
+                maya.mel.eval(command)
+        except Exception:
+            if owned:
+                self.store.release(key)
+            raise
+
+        duration = time.perf_counter() - export_start_time
+
+        record_id = None
+        if record:
+            record_id = smc_export_history.get_history().record(
+                smc_export_history.GPU_CACHE, self.asset_name,
+                scene=cmds.file(q=True, sn=True),
+                path=filepath,
+                frames=quality.sample_count(start, end),
+                polygons=int(sum(smc_ref_wrapper.RefWrapper(rfn).polygon_count for rfn in self.rfns)
+                             * quality.decimation),
+                deformers=sum(smc_ref_wrapper.RefWrapper(rfn).deformer_count or 0 for rfn in self.rfns),
+                flags=flags,
+                duration=duration,
+                output_bytes=os.path.getsize(local_path) if os.path.exists(local_path) else None)
+
+        if owned:
+            callback = self._publish_callback(key, callback)
+
+        # Keep the scratch copy, the node reads it until the transfer callback points it at filepath
+        transfer = transfer_queue.submit(local_path, filepath, keep_source=True, callback=callback)
+
+        if owned and transfer is None:
+            # Written in place
+            self.store.publish(key, filepath, transfer_queue=transfer_queue)
+
+        return record_id, transfer
+
+    def _publish_callback(self, key, callback=None):
+        """
+        Transfer callback calling callback, then publishing the final file to the store once it is in place.
+        A failed transfer publishes nothing and releases the store lock
+        """
+
+        def transferred(transfer):
+
+            try:
+                if callback:
+                    callback(transfer)
+            finally:
+                if transfer.state == smc_transfer.Transfer.DONE:
+                    self.store.publish(key, transfer.dst, transfer_queue=smc_transfer.get_queue())
+                else:
+                    log.warning("Not publishing %s to the shared store: %s", transfer.dst, transfer.error)
+                    self.store.release(key)
+
+        return transferred
+
+    def turn_on_cache(self):
+
+        for rfn in self.rfns:
+            with smc_trace.span("unload_reference", rfn=rfn):
+                cmds.file(unloadReference=rfn)
+
+        try:
+            cmds.setAttr(self.cache_node + ".storedPath", self.filepath, type="string")
+            cmds.setAttr(self.cache_node + ".cacheFileName", "", type="string")
+            cmds.setAttr(self.cache_node + ".cacheFileName", smc_transfer.get_queue().resolve(self.filepath),
+                         type="string")
+            smc_cache_gc.touch(self.filepath)
+
+            self._active = True
+
+        except Exception as e:
+            log.warning(e)
+
+    def upgrade_to_final(self):
+        """Exports the cache again at final quality and switches the node to it"""
+
+        if self.quality.is_final and self.exported:
+            return
+
+        previous_paths = [path for quality, path in self._variants()]
+
+        self.quality = smc_quality.FINAL
+        self.export_abc(force=True)
+        self.turn_on_cache()
+
+        current_paths = [path for quality, path in self._variants()]
+        for path in previous_paths:
+            if path in current_paths or smc_transfer.get_queue().is_pending(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.debug(e)
+
+    def turn_off_cache(self):
+
+        for rfn in self.rfns:
+            with smc_trace.span("load_reference", rfn=rfn):
+                cmds.file(loadReference=rfn)
+
+        try:
+            cmds.setAttr(self.cache_node + ".cacheFileName", "", type="string")
+
+            self._active = False
+
+        except Exception as e:
+            log.warning(e)
@@ -1,5 +1,7 @@
 import os
 import re
+import time
+import logging
 import tempfile
 
 import maya.cmds as cmds
@@ -9,252 +11,64 @@ from PySide2 import QtGui
 from PySide2.QtCore import Qt
 import PySide2.QtWidgets as QtWidgets
 
+import smc_gpu_cache
 import smc_ref_wrapper
-import alert_dialog
+import smc_transfer
+import smc_cache_gc
+import smc_shared_store
+import smc_prefetch
+import smc_alembic
+import smc_trace
+import smc_export_history
+import smc_cost
+import smc_quality
+import smc_lod
+import smc_visibility
+import smc_budget
+import smc_journal
 
 __all__ = ["GpuCacherTool"]
 
-
-def get_refs():
-    refs = {}
-    for rfn in cmds.ls(type="reference"):
-        try:
-            if cmds.referenceQuery(rfn, filename=True, un=True):
-                refs[rfn] = cmds.referenceQuery(rfn, filename=True, un=True)
-        except RuntimeError:
-            continue
-
-    return refs
-
-
-def get_refs_in_scene_wrap():
-    found = []
-    for ref, file in get_refs().items():
-
-        if "LAYOUTCACHE" in ref:
-            continue
-
-        if "cam_" in ref:
-            continue
-
-        w_ref = smc_ref_wrapper.RefWrapper(ref)
-        found.append((w_ref.namespace, w_ref.version, w_ref.reference_node))
-
-    return found
-
-
-class GpuCacheWrapper():
-    """
-    Wrapper for gpu cahe_node. Character(rfn) driven
-    """
-
-    BUFFER_AMOUNT = 5
-
-    def __init__(self, rfns, start, end, dir="", name=""):
-
-        import tempfile
-
-        if not dir:
-            dir = tempfile.gettempdir()
-
-        self.dir = dir
-        self._rfns = rfns
-
-        self._start = start
-        self._end = end
-
-        self._active = False
-        self._exported = False
-        self._filepath = ""
-
-        start_name = os.path.basename(cmds.file(q=True, sn=True)).split(".")[0]
-
-        self._cache_node = ""
-
-        if "GPU_CACHES" not in cmds.ls(assemblies=True):
-            cmds.createNode("transform", name="GPU_CACHES")
-
-        if name == "":
-            import random
-            import string
-            _random_string_shot = ''.join(random.choices(string.ascii_letters, k=6))
-            name = _random_string_shot
-
-        node_name = "gpuCache_" + name
-
-        for cache_node in cmds.ls(type="gpuCache"):
-
-            refs_list = []
-
-            try:
-                refs_list = cmds.getAttr("%s.refNodes" % cache_node)
-                print(refs_list)
-            except ValueError:
-                continue
-
-            if not refs_list:
-                cmds.delete(cache_node)
-                continue
-
-            refs_list.sort()
-
-            if refs_list == sorted(self._rfns):
-
-                if not os.path.exists(cmds.getAttr(cache_node + ".storedPath")):
-                    cmds.delete(cache_node)
-                    continue
-
-                self._cache_node = cache_node
-                refs_no_ns = [re.sub("RN$", "", re.sub(".*:", "", ref)) for ref in self.rfns]
-                self._filepath = os.path.join(self.dir,
-                                              "%s_" % start_name + self.cache_node + "_%s_%i_%i_.abc" % (
-                                                  "_".join(refs_no_ns), start, end))
-
-                break
-
-        if self.cache_node == "":
-            self._cache_node = cmds.createNode("gpuCache", parent="GPU_CACHES", name=node_name)
-
-            cmds.addAttr(self.cache_node, longName="refNodes", dataType="stringArray")
-
-            # cmds.addAttr(self.cache_node, longName = "startFrame", attributeType = "float")
-            # cmds.addAttr(self.cache_node, longName = "endFrame", attributeType = "float")
-            # cmds.setAttr(self.cache_node + ".startFrame", float(start) ,type="float")
-            # cmds.setAttr(self.cache_node + ".endFrame", float(end) ,type="float")
-
-            # print(re.sub(":.*RN", "" , " ".join(self._rfns)))
-            cmds.setAttr(self.cache_node + ".refNodes", *([len(self._rfns)] + self._rfns), type="stringArray")
-
-            refs_no_ns = [re.sub("RN$", "", re.sub(".*:", "", ref)) for ref in self.rfns]
-            self._filepath = os.path.join(self.dir, "%s_" % start_name + self.cache_node + "_%s_%i_%i_.abc" % (
-                "_".join(refs_no_ns), start, end))
-
-            cmds.addAttr(self.cache_node, longName="storedPath", dataType="string")
-            cmds.setAttr(self.cache_node + ".storedPath", self.filepath, type="string")
-
-    @property
-    def cache_node(self):
-        return self._cache_node
-
-    @property
-    def start(self):
-        return self._start
-
-    @property
-    def end(self):
-        return self._end
-
-    @property
-    def active(self):
-
-        self._active = cmds.getAttr(self.cache_node + ".cacheFileName")
-        return self._active
-
-    @property
-    def rfns(self):
-
-        # print(re.sub(":.*RN", "", " ".join(self._rfns)))
-        # cmds.setAttr(self.cache_node + ".refNodes",re.sub(":.*RN", "" , " ".join(self._rfns)), type="stringArray")
-        return self._rfns
-
-    @property
-    def filepath(self):
-        return self._filepath
-
-    @property
-    def exported(self):
-        self._exported = os.path.exists(self.filepath)
-        return self._exported
-
-    def export_abc(self):
-        """Exports cache to self.dir of self.rfns"""
-
-        start_frame = cmds.playbackOptions(q=True, ast=True)
-        end_frame = cmds.playbackOptions(q=True, aet=True)
-
-        start = start_frame - self.BUFFER_AMOUNT
-        end = end_frame + self.BUFFER_AMOUNT
-
-        roots = []
-
-        for rfn in self.rfns:
-
-            if not cmds.referenceQuery(rfn, isLoaded=True):
-                cmds.file(loadReference=rfn)
-
-            print("Loaded REF %s" % rfn)
-            roots.append(cmds.referenceQuery(rfn, nodes=True)[0])
-
-        cache_roots = [roots[0]]
-
-        try:
-            os.remove(self.filepath)
-        except Exception as e:
-            print(e)
-
-        command = "gpuCache -startTime {} -endTime {} -optimize -optimizationThreshold 40000 " \
-                  "-writeMaterials -dataFormat ogawa -directory \"{}\" -fileName \"{}\" " \
-                  "-saveMultipleFiles false ".format(start,
-                                                     end,
-                                                     os.path.dirname(self.filepath.replace('\\', '/')),
-                                                     os.path.basename(self.filepath.replace(".abc", "")))
-
-        command += " ".join(cache_roots) + ";"
-
-        import maya.mel
-        print("GPU CACHE EXPORT")
-        print(command)
-        maya.mel.eval(command)
-
-    def turn_on_cache(self):
-
-        for rfn in self.rfns:
-            cmds.file(unloadReference=rfn)
-
-        try:
-            cmds.setAttr(self.cache_node + ".cacheFileName", "", type="string")
-            cmds.setAttr(self.cache_node + ".cacheFileName", self.filepath, type="string")
-
-            self._active = True
-
-        except Exception as e:
-            print(e)
-
-    def turn_off_cache(self):
-
-        for rfn in self.rfns:
-            cmds.file(loadReference=rfn)
-
-        try:
-            cmds.setAttr(self.cache_node + ".cacheFileName", "", type="string")
-
-            self._active = False
-
-        except Exception as e:
-            print(e)
+log = logging.getLogger(__name__)
 
 
 class GpuCacherTool(QtWidgets.QWidget):
     BUFFER_AMOUNT = 5
 
+    # Startup work runs in slices of at most this long between Qt events
+    LOAD_SLICE_SECONDS = 0.05
+    # Table rows added per loading step
+    LOAD_CHUNK_ROWS = 50
+    # Milliseconds between automatic LOD updates
+    LOD_UPDATE_INTERVAL = 500
+
     def __init__(self):
         super(GpuCacherTool, self).__init__()
 
-        cmds.loadPlugin("gpuCache.mll")
+        init_start_time = time.perf_counter()
+        self.startup_times = {}
+        self._loader = None
 
         self.CACHES_DIR = ""
 
         self.caches = []
         self._ref_lock = True
 
+        # Rebuilt with the tables: namespace / reference node -> asset item, cache -> cache item and refs,
+        # reference node -> caches. Items rather than rows, rows move when the tables are sorted
+        self._asset_items = {}
+        self._ref_items = {}
+        self._cache_items = {}
+        self._cache_refs = {}
+        self._ref_caches = {}
+        self._cache_switches = {}
+
         self.setWindowTitle("Gpu Cacher Tool")
         self.setWindowFlags(QtCore.Qt.WindowStaysOnTopHint)
 
         main_layout = QtWidgets.QVBoxLayout(self)
 
         self.local_path_led = QtWidgets.QLabel()
-        os.makedirs(os.path.join(tempfile.gettempdir(), "a_gpuCacherTemp"), exist_ok=True)
-
         self.local_path_led.setText(os.path.join(tempfile.gettempdir(), "a_gpuCacherTemp"))
 
         horizontal_layout_wdg = QtWidgets.QWidget()
@@ -266,12 +80,29 @@ class GpuCacherTool(QtWidgets.QWidget):
         horizontal_layout.addWidget(self.choose_dir_button)
         horizontal_layout.addWidget(self.local_path_led)
 
+        store_layout_wdg = QtWidgets.QWidget()
+        store_layout = QtWidgets.QHBoxLayout()
+        store_layout.setMargin(0)
+        store_layout_wdg.setLayout(store_layout)
+
+        self.shared_store = None
+        self.store_path_led = QtWidgets.QLabel()
+        if os.environ.get("SMC_SHARED_STORE"):
+            self._set_shared_store(os.environ["SMC_SHARED_STORE"])
+
+        self.choose_store_button = QtWidgets.QPushButton("Choose shared store")
+        self.choose_store_button.released.connect(self.choose_store)
+
+        store_layout.addWidget(self.choose_store_button)
+        store_layout.addWidget(self.store_path_led)
+
         tables_area = QtWidgets.QWidget()
         tables_area_lyt = QtWidgets.QHBoxLayout(tables_area)
         tables_area_lyt.setContentsMargins(0, 0, 0, 0)
 
         horizontal_layout.setMargin(0)
         main_layout.addWidget(horizontal_layout_wdg)
+        main_layout.addWidget(store_layout_wdg)
 
         ##TABLE LEFT
         self.asset_table = QtWidgets.QTableWidget(0, 1)
@@ -287,7 +118,7 @@ class GpuCacherTool(QtWidgets.QWidget):
         self.asset_table.setSizeAdjustPolicy(QtWidgets.QAbstractScrollArea.AdjustToContents)
         self.asset_table.resizeColumnsToContents()
 
-        self.table_header_names = ["Reference"]
+        self.table_header_names = ["Reference", "Estimate", "Savings"]
 
         header = self.asset_table.horizontalHeader()
         header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
@@ -308,7 +139,7 @@ class GpuCacherTool(QtWidgets.QWidget):
         self.cache_table.setSizeAdjustPolicy(QtWidgets.QAbstractScrollArea.AdjustToContents)
         self.cache_table.resizeColumnsToContents()
 
-        self.cache_table_header_names = ["Gpu Cache", "State", "Re-Export", "Delete"]
+        self.cache_table_header_names = ["Gpu Cache", "State", "Re-Export", "Delete", "Estimate", "Quality", "LOD"]
 
         header = self.cache_table.horizontalHeader()
         header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
@@ -316,11 +147,103 @@ class GpuCacherTool(QtWidgets.QWidget):
         self.cache_table.setHorizontalHeaderLabels(self.cache_table_header_names)
         self.cache_table.itemSelectionChanged.connect(self._cache_selection_changed)
 
+        self.prefetcher = smc_prefetch.Prefetcher()
+        self.prefetch_checkbox = QtWidgets.QCheckBox("Prefetch disabled caches")
+        self.prefetch_checkbox.setChecked(os.environ.get("SMC_PREFETCH", "0") == "1")
+        self.prefetch_checkbox.toggled.connect(self._prefetch_caches)
+        self.cache_table.verticalScrollBar().valueChanged.connect(self._prefetch_caches)
+
+        self.measure_fps_checkbox = QtWidgets.QCheckBox("Measure playback fps before/after caching")
+
+        self.lod_switcher = smc_lod.LodSwitcher()
+        self.export_lods_checkbox = QtWidgets.QCheckBox("Export LOD variants")
+        self.auto_lod_checkbox = QtWidgets.QCheckBox("Switch LODs by screen size")
+        self.auto_lod_checkbox.toggled.connect(self._auto_lod_toggled)
+
+        self.visibility_enabler = smc_visibility.AutoEnabler()
+        self.visibility_checkbox = QtWidgets.QCheckBox("Enable caches by render camera visibility")
+        self.visibility_checkbox.setToolTip("Off screen references stay unloaded behind their cache, "
+                                            "on screen references selected here are loaded")
+        self.visibility_checkbox.toggled.connect(self._visibility_toggled)
+
+        self.visibility_stride_spin = QtWidgets.QSpinBox()
+        self.visibility_stride_spin.setRange(1, 100)
+        self.visibility_stride_spin.setPrefix("Every ")
+        self.visibility_stride_spin.setSuffix(" frames")
+        self.visibility_stride_spin.setValue(smc_visibility.DEFAULT_STRIDE)
+        self.visibility_stride_spin.valueChanged.connect(self._visibility_stride_changed)
+
         tables_area_lyt.addWidget(self.asset_table)
         tables_area_lyt.addWidget(self.cache_table)
 
         main_layout.addWidget(tables_area)
 
+        quality_layout_wdg = QtWidgets.QWidget()
+        quality_layout = QtWidgets.QHBoxLayout()
+        quality_layout.setMargin(0)
+        quality_layout_wdg.setLayout(quality_layout)
+
+        self.quality_combo = QtWidgets.QComboBox()
+        self.quality_combo.addItems(list(smc_quality.PRESETS))
+
+        self.frame_step_spin = QtWidgets.QSpinBox()
+        self.frame_step_spin.setRange(1, 100)
+        self.frame_step_spin.setPrefix("Step ")
+
+        self.decimation_spin = QtWidgets.QSpinBox()
+        self.decimation_spin.setRange(1, 100)
+        self.decimation_spin.setPrefix("Faces ")
+        self.decimation_spin.setSuffix("%")
+
+        self.materials_checkbox = QtWidgets.QCheckBox("Materials")
+
+        self.threshold_spin = QtWidgets.QSpinBox()
+        self.threshold_spin.setRange(0, 10000000)
+        self.threshold_spin.setSingleStep(1000)
+        self.threshold_spin.setPrefix("Optimize ")
+
+        self.quality_combo.currentTextChanged.connect(self._quality_preset_changed)
+        self._quality_preset_changed(self.quality_combo.currentText())
+
+        quality_layout.addWidget(QtWidgets.QLabel("Quality"))
+        quality_layout.addWidget(self.quality_combo)
+        quality_layout.addWidget(self.frame_step_spin)
+        quality_layout.addWidget(self.decimation_spin)
+        quality_layout.addWidget(self.materials_checkbox)
+        quality_layout.addWidget(self.threshold_spin)
+        quality_layout.addWidget(self.export_lods_checkbox)
+
+        budget_layout_wdg = QtWidgets.QWidget()
+        budget_layout = QtWidgets.QHBoxLayout()
+        budget_layout.setMargin(0)
+        budget_layout_wdg.setLayout(budget_layout)
+
+        self.budget_kind_combo = QtWidgets.QComboBox()
+        self.budget_kind_combo.addItems([smc_budget.MEMORY, smc_budget.FPS])
+        self.budget_kind_combo.currentTextChanged.connect(self._budget_kind_changed)
+
+        self.budget_spin = QtWidgets.QSpinBox()
+        self.budget_spin.setRange(1, 1000000)
+        self._budget_kind_changed(self.budget_kind_combo.currentText())
+
+        propose_budget_button = QtWidgets.QPushButton("Propose caches")
+        propose_budget_button.setToolTip("Selects the fewest references to cache to fit the budget, "
+                                         "with the projected savings of every reference")
+        propose_budget_button.released.connect(self._propose_budget)
+
+        apply_budget_button = QtWidgets.QPushButton("Apply budget")
+        apply_budget_button.released.connect(self._apply_budget)
+
+        budget_layout.addWidget(QtWidgets.QLabel("Budget"))
+        budget_layout.addWidget(self.budget_kind_combo)
+        budget_layout.addWidget(self.budget_spin)
+        budget_layout.addWidget(propose_budget_button)
+        budget_layout.addWidget(apply_budget_button)
+
+        self.budget_label = QtWidgets.QLabel()
+        self._budget_plan = None
+        self._budget_planner = None
+
         do_cache_button = QtWidgets.QPushButton("Make GPU cache")
         do_cache_button.released.connect(self._do_cache)
 
@@ -330,17 +253,152 @@ class GpuCacherTool(QtWidgets.QWidget):
         repair_button = QtWidgets.QPushButton("Repair nodes from folder")
         repair_button.released.connect(self._repair)
 
+        # Enabled once the journal has unfinished exports of this scene
+        self.resume_button = QtWidgets.QPushButton("Resume unfinished exports")
+        self.resume_button.setEnabled(False)
+        self.resume_button.released.connect(self._resume_exports)
+
         delete_button = QtWidgets.QPushButton("Delete All GpuCahes")
         delete_button.released.connect(self._delete_all)
 
+        # Disabled while loading, they act on the tables. The checkboxes too, toggling them runs on every cache
+        self._action_widgets = [self.choose_dir_button, do_cache_button, repair_button, delete_button,
+                                clear_temp_button, propose_budget_button, apply_budget_button,
+                                self.prefetch_checkbox, self.auto_lod_checkbox, self.visibility_checkbox,
+                                self.visibility_stride_spin]
+
+        visibility_layout_wdg = QtWidgets.QWidget()
+        visibility_layout = QtWidgets.QHBoxLayout()
+        visibility_layout.setMargin(0)
+        visibility_layout_wdg.setLayout(visibility_layout)
+        visibility_layout.addWidget(self.visibility_checkbox)
+        visibility_layout.addWidget(self.visibility_stride_spin)
+
+        self.loading_label = QtWidgets.QLabel("Loading...")
+        self.visibility_label = QtWidgets.QLabel()
+        self.transfers_label = QtWidgets.QLabel()
+        self.gc_label = QtWidgets.QLabel()
+        self._gc_future = None
+
+        main_layout.addWidget(self.loading_label)
+        main_layout.addWidget(quality_layout_wdg)
         main_layout.addWidget(do_cache_button)
+        main_layout.addWidget(budget_layout_wdg)
+        main_layout.addWidget(self.budget_label)
         main_layout.addWidget(repair_button)
+        main_layout.addWidget(self.resume_button)
         main_layout.addWidget(delete_button)
         main_layout.addWidget(clear_temp_button)
+        main_layout.addWidget(self.prefetch_checkbox)
+        main_layout.addWidget(self.measure_fps_checkbox)
+        main_layout.addWidget(self.auto_lod_checkbox)
+        main_layout.addWidget(visibility_layout_wdg)
+        main_layout.addWidget(self.transfers_label)
+        main_layout.addWidget(self.gc_label)
+        main_layout.addWidget(self.visibility_label)
 
-        self._repair()
+        self.transfers_timer = QtCore.QTimer(self)
+        self.transfers_timer.timeout.connect(self._update_transfers)
+        self.transfers_timer.timeout.connect(self._update_gc)
+        self.transfers_timer.start(1000)
+
+        self.lod_timer = QtCore.QTimer(self)
+        self.lod_timer.timeout.connect(self._update_lods)
+
+        for widget in self._action_widgets:
+            widget.setEnabled(False)
 
         self.show()
+        self.startup_times["window"] = time.perf_counter() - init_start_time
+
+        # Plugin, repair and tables are loaded once the window is up
+        QtCore.QTimer.singleShot(0, self._start_loading)
+
+    ##LOADING
+
+    def _load(self):
+        """
+        Startup work after the window is shown, yields between small steps so Qt can process events.
+        Records the work time of each phase in startup_times
+        """
+
+        phases = [("plugin", self._iter_load_plugin),
+                  ("repair", self._iter_repair),
+                  ("tables", self._iter_refresh_tables),
+                  ("gc", self._iter_start_gc)]
+
+        try:
+            for phase, steps in phases:
+                self.loading_label.setText("Loading: %s..." % phase)
+                self.startup_times[phase] = 0.0
+                steps = steps()
+
+                while True:
+                    step_start_time = time.perf_counter()
+                    with smc_trace.span("startup_" + phase):
+                        done = next(steps, StopIteration) is StopIteration
+                    self.startup_times[phase] += time.perf_counter() - step_start_time
+
+                    if done:
+                        break
+                    yield phase
+
+                log.info("Startup %s took %.3fs", phase, self.startup_times[phase])
+
+        finally:
+            for widget in self._action_widgets:
+                widget.setEnabled(True)
+
+        self.loading_label.setText("Loaded in %.2fs (%s)" % (
+            sum(self.startup_times.values()),
+            ", ".join("%s %.2fs" % (phase, seconds) for phase, seconds in self.startup_times.items())))
+
+    def _start_loading(self):
+
+        if self._loader is not None:
+            return
+
+        self._loader = self._load()
+
+        self.loading_timer = QtCore.QTimer(self)
+        self.loading_timer.timeout.connect(self._load_step)
+        self.loading_timer.start(0)
+
+    def _load_step(self):
+
+        deadline = time.perf_counter() + self.LOAD_SLICE_SECONDS
+
+        for _ in self._loader:
+            if time.perf_counter() >= deadline:
+                return
+
+        self.loading_timer.stop()
+
+    def finish_loading(self):
+        """
+        Runs what is left of the startup work right away, for scripts driving the tool without an event loop
+        """
+
+        if self._loader is None:
+            self._loader = self._load()
+        elif getattr(self, "loading_timer", None):
+            self.loading_timer.stop()
+
+        for _ in self._loader:
+            pass
+
+    def _iter_load_plugin(self):
+
+        cmds.loadPlugin("gpuCache.mll", quiet=True)
+        yield
+
+        os.makedirs(self.local_path_led.text(), exist_ok=True)
+
+    def _iter_start_gc(self):
+
+        # Keep the temp folders within quota
+        self._gc_future = self._cache_collector().collect_async(self._cache_files_in_use())
+        yield
 
     ##UI
 
@@ -350,64 +408,92 @@ class GpuCacherTool(QtWidgets.QWidget):
         if gpucache_path != "":
             self.local_path_led.setText(gpucache_path)
 
-    def _cache_selection_changed(self):
+    def choose_store(self):
 
-        print(self.cache_table.selectedItems())
+        store_path = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Shared Store Directory",
+                                                                self.store_path_led.text())
+        if store_path != "":
+            self._set_shared_store(store_path)
 
-        if not self.cache_table.selectedItems():
-            cmds.select(clear=True)
-            return
+    def _set_shared_store(self, store_path):
 
-        items = []
+        self.shared_store = smc_shared_store.SharedStore(store_path)
+        self.store_path_led.setText(store_path)
 
-        for selection in self.cache_table.selectedItems():
+    def _selected_caches(self):
+        return [item.data(1) for item in self.cache_table.selectedItems() if item.data(1) in self._cache_items]
 
-            refNodes = cmds.getAttr("%s.refNodes" % selection.data(1))
-            for ref_node in refNodes:
-                print(ref_node)
-                [items.append(item) for item in
-                 self.asset_table.findItems(re.sub(":.*$", "", ref_node), Qt.MatchContains)]
+    def _selected_refs(self):
+        return [item.data(QtCore.Qt.UserRole) for item in self.asset_table.selectedItems()
+                if item.data(QtCore.Qt.UserRole) in self._ref_items]
 
-        for item in self.asset_table.selectedItems():
-            item.setSelected(False)
+    def _sync_selection(self, table, items):
+        """Selects exactly items in table, without emitting a selection change per item"""
 
-        for item in items:
-            item.setSelected(True)
+        table.blockSignals(True)
+
+        try:
+            for item in table.selectedItems():
+                if item not in items:
+                    item.setSelected(False)
+
+            for item in items:
+                item.setSelected(True)
+
+        finally:
+            table.blockSignals(False)
+
+    def _cache_selection_changed(self):
+
+        caches = self._selected_caches()
+        log.debug("Selected caches %s", caches)
+
+        rfns = [rfn for cache in caches for rfn in self._cache_refs[cache]]
+        self._sync_selection(self.asset_table, [self._ref_items[rfn] for rfn in rfns if rfn in self._ref_items])
+
+        self._select_refs(rfns)
 
     def _selection_changed(self, *args):
 
-        if not self.asset_table.selectedItems():
-            cmds.select(clear=True)
-            return
+        rfns = self._selected_refs()
 
-        to_select = []
+        caches = set(cache for rfn in rfns for cache in self._ref_caches.get(rfn, []))
+        self._sync_selection(self.cache_table, [self._cache_items[cache] for cache in caches])
 
-        for selection in self.asset_table.selectedItems():
+        # Before selecting, so the rigs it loads are selected too
+        if self.visibility_checkbox.isChecked():
+            self._update_visibility()
 
-            selected = selection.text()
+        self._select_refs(rfns)
 
-            for namespace, version, ref in get_refs_in_scene_wrap():
+    def _select_refs(self, rfns):
+        """Selects the top nodes of the loaded, non alembic references of rfns in one cmds.select"""
 
-                try:
-                    if ref == "sharedReferenceNode":
-                        continue
+        to_select = []
 
-                    file = cmds.referenceQuery(ref, filename=True)
-                    if file.endswith(".abc"):
-                        continue
+        for rfn in rfns:
+            try:
+                if cmds.referenceQuery(rfn, filename=True).endswith(".abc"):
+                    continue
 
-                    ns = cmds.referenceQuery(file, ns=True, shn=True)
-                    if ns == selected:
-                        to_select.append(cmds.referenceQuery(ref, nodes=True)[0])
+                if cmds.referenceQuery(rfn, isLoaded=True):
+                    to_select.append(cmds.referenceQuery(rfn, nodes=True)[0])
 
-                except Exception as e:
-                    print(e)
-                    pass
+            except (RuntimeError, IndexError, TypeError) as e:
+                log.debug("%s: %s", rfn, e)
 
-        cmds.select(to_select)
+        if to_select:
+            cmds.select(to_select, replace=True)
+        else:
+            cmds.select(clear=True)
 
     def _refresh_tables(self):
 
+        for _ in self._iter_refresh_tables():
+            pass
+
+    def _iter_refresh_tables(self):
+
         self.asset_table.clear()
         self.asset_table.setRowCount(0)
         self.asset_table.setColumnCount(len(self.table_header_names))
@@ -416,23 +502,83 @@ class GpuCacherTool(QtWidgets.QWidget):
         self.cache_table.setRowCount(0)
         self.cache_table.setColumnCount(len(self.cache_table_header_names))
 
-        self.fill_table()
+        self._asset_items = {}
+        self._ref_items = {}
+        self._cache_items = {}
+        self._cache_refs = {}
+        self._ref_caches = {}
+        self._cache_switches = {}
+
+        for _ in self._iter_fill_table():
+            yield
+
+        self._prefetch_caches()
+
+    def _prefetch_caches(self, *args):
+        """
+        Warms the page cache for disabled caches visible in the table, most recently used first
+        """
+
+        if not self.prefetch_checkbox.isChecked():
+            return
+
+        first_row = max(self.cache_table.rowAt(0), 0)
+        last_row = self.cache_table.rowAt(self.cache_table.viewport().height() - 1)
+        if last_row < 0:
+            last_row = self.cache_table.rowCount() - 1
+
+        paths = []
+
+        for row in range(first_row, last_row + 1):
+            item = self.cache_table.item(row, 0)
+            if not item:
+                continue
+
+            cache = item.data(1)
+            if self._query_cache_status(cache):
+                continue
+
+            path = smc_transfer.get_queue().resolve(cmds.getAttr(cache + ".storedPath"))
+            if os.path.exists(path):
+                paths.append(path)
+
+        paths.sort(key=os.path.getmtime, reverse=True)
+        self.prefetcher.prefetch(paths)
 
     @property
     def info_dict(self):
 
         info_dict = {}
 
-        for namespace, version, rfnnode in get_refs_in_scene_wrap():
+        for namespace, version, rfnnode in smc_gpu_cache.get_refs_in_scene_wrap():
             info_dict[namespace] = {"ref": rfnnode}
 
         return info_dict
 
+    @smc_trace.traced()
     def fill_table(self):
 
+        for _ in self._iter_fill_table():
+            pass
+
+    def _iter_fill_table(self):
+        """
+        Fills both tables, yielding every LOAD_CHUNK_ROWS rows
+        """
+
         self.asset_table.setHorizontalHeaderLabels(self.table_header_names)
         self.asset_table.setSortingEnabled(0)
 
+        # Calibrated on the exports made since the last refresh
+        smc_cost.get_model(smc_export_history.GPU_CACHE, smc_gpu_cache.GpuCacheWrapper.EXPORT_FLAGS, refresh=True)
+
+        # One pass over the caches instead of one per reference
+        caches = self._ls_gpuCaches()
+        for cache in caches:
+            self._cache_refs[cache] = cmds.getAttr("%s.refNodes" % cache) or []
+            for rfn in self._cache_refs[cache]:
+                self._ref_caches.setdefault(rfn, []).append(cache)
+
         i = 0
         for key, values in self.info_dict.items():
 
@@ -446,28 +592,33 @@ class GpuCacherTool(QtWidgets.QWidget):
             item.setText(key)
 
             try:
+                item.setData(QtCore.Qt.UserRole, values["ref"])
                 self.asset_table.insertRow(i)
-                self.asset_table.setItem(0, i, item)
-                print(item.text())
-                self.asset_table.item(0, i).setFont(
-                    font)
+                self.asset_table.setItem(i, 0, item)
+                log.debug(item.text())
+                item.setFont(font)
 
-                if self._is_ref_in_cache(values["ref"]):
+                if values["ref"] in self._ref_caches:
                     item.setForeground(Qt.blue)
 
+                self._asset_items[key] = item
+                self._ref_items[values["ref"]] = item
+
                 i += 1
+                if not i % self.LOAD_CHUNK_ROWS:
+                    yield
 
             except KeyError:
                 continue
 
             except Exception as e:
-                print(e)
+                log.warning(e)
                 continue
 
         self.cache_table.setHorizontalHeaderLabels(self.cache_table_header_names)
         self.cache_table.setSortingEnabled(0)
 
-        for j, cache in enumerate(self._ls_gpuCaches()):
+        for j, cache in enumerate(caches):
 
             self.cache_table.insertRow(j)
 
@@ -481,7 +632,8 @@ class GpuCacherTool(QtWidgets.QWidget):
             _item.setData(1, cache)
 
             _item.setText(re.sub("_\w{6}$", "", cache) + ": %s" % ", ".join(
-                [re.sub(":.*", "", ref) for ref in (cmds.getAttr(cache + ".refNodes"))]))
+                [re.sub(":.*", "", ref) for ref in self._cache_refs[cache]]))
+            self._cache_items[cache] = _item
 
             # _item.setText(cache)
 
@@ -498,6 +650,7 @@ class GpuCacherTool(QtWidgets.QWidget):
 
             switch_button.setChecked(not self._query_cache_status(cache))
             self.cache_table.setCellWidget(j, 1, switch_button)
+            self._cache_switches[cache] = switch_button
 
             re_export_button = QtWidgets.QPushButton("Re-Export")
             re_export_button.setProperty("cache_node", cache)
@@ -511,9 +664,33 @@ class GpuCacherTool(QtWidgets.QWidget):
 
             self.cache_table.setCellWidget(j, 3, delete_and_load_button)
 
+            quality = self._cache_quality(cache)
+
+            upgrade_button = QtWidgets.QPushButton("Final" if quality.is_final else "Upgrade %s" % quality.tag)
+            upgrade_button.setToolTip("Re-exports the cache at final quality")
+            upgrade_button.setEnabled(not quality.is_final)
+            upgrade_button.setProperty("cache_node", cache)
+            upgrade_button.released.connect(self._upgrade_to_final)
+
+            self.cache_table.setCellWidget(j, 5, upgrade_button)
+
+            lod_paths = smc_lod.lod_paths(cache)
+            if lod_paths:
+                lod_combo = QtWidgets.QComboBox()
+                lod_combo.addItems(["Auto"] + ["LOD%i" % level for level in range(len(lod_paths))])
+                pinned = smc_lod.pinned(cache)
+                lod_combo.setCurrentIndex(0 if pinned is None else pinned + 1)
+                lod_combo.setProperty("cache_node", cache)
+                lod_combo.currentIndexChanged.connect(self._lod_pinned)
+
+                self.cache_table.setCellWidget(j, 6, lod_combo)
+
             if self.cache_table.item(j, 0):
                 self.cache_table.item(j, 0).setFont(font)
 
+            if not (j + 1) % self.LOAD_CHUNK_ROWS:
+                yield
+
         self.asset_table.sortItems(0, QtCore.Qt.AscendingOrder)
         self.asset_table.setSortingEnabled(0)
 
@@ -528,13 +705,257 @@ class GpuCacherTool(QtWidgets.QWidget):
 
         self.cache_table.setSortingEnabled(1)
 
+        for _ in self._iter_fill_estimates():
+            yield
+
+    def _iter_fill_estimates(self):
+        """
+        Fills the estimate columns once the rows are in, yielding every LOAD_CHUNK_ROWS rows.
+        Reference counts are kept by smc_gpu_cache.ref_counts, so refreshes only walk the rigs loaded or changed since
+        """
+
+        quality = self._quality_profile()
+
+        for i, (rfn, item) in enumerate(list(self._ref_items.items())):
+            self.asset_table.setItem(item.row(), 1, self._estimate_item([rfn], quality))
+
+            if not (i + 1) % self.LOAD_CHUNK_ROWS:
+                yield
+
+        for j, (cache, item) in enumerate(list(self._cache_items.items())):
+            self.cache_table.setItem(item.row(), 4,
+                                     self._estimate_item(self._cache_refs[cache], self._cache_quality(cache)))
+
+            if not (j + 1) % self.LOAD_CHUNK_ROWS:
+                yield
+
+    def _estimate_item(self, rfns, quality=smc_quality.FINAL):
+        """Read only table item with the export time and size estimate of a gpu cache of rfns"""
+
+        item = QtWidgets.QTableWidgetItem()
+        item.setFlags(QtCore.Qt.ItemIsEnabled)
+        item.setTextAlignment(QtCore.Qt.AlignCenter | QtCore.Qt.AlignVCenter)
+
+        try:
+            estimate = smc_gpu_cache.GpuCacheWrapper.estimate_export(rfns, quality)
+        except Exception as e:
+            log.debug("No estimate for %s: %s", rfns, e)
+            return item
+
+        item.setText(smc_cost.format_estimate(estimate))
+        item.setData(QtCore.Qt.UserRole, estimate.duration)
+        item.setToolTip("%.1fs, %.1f MB, calibrated on %i exports (%i of this asset)" % (
+            estimate.duration, estimate.output_bytes / 1024.0 ** 2, estimate.samples, estimate.asset_samples))
+
+        return item
+
+    def _update_transfers(self):
+        """
+        Shows the pending transfer queue and points caches at their final files once transferred
+        """
+
+        transfer_queue = smc_transfer.get_queue()
+        pending = transfer_queue.pending
+        failed = transfer_queue.failed
+
+        text = "Pending transfers: %i" % len(pending)
+        if failed:
+            text += "  Failed: %i" % len(failed)
+
+        self.transfers_label.setText(text)
+        self.transfers_label.setToolTip("\n".join(
+            ["%s: %s" % (transfer.state, transfer.dst) for transfer in pending + failed]))
+
+        smc_gpu_cache.repoint_transferred()
+        transfer_queue.clear_finished()
+
+    def _update_gc(self):
+        """
+        Reports the space reclaimed by the last background cache collection
+        """
+
+        if not self._gc_future or not self._gc_future.done():
+            return
+
+        result = self._gc_future.result()
+        self._gc_future = None
+
+        self.gc_label.setText("Removed %i caches, reclaimed %.1f MB (%.1f MB kept)" % (
+            len(result.removed), result.reclaimed_bytes / 1024.0 ** 2, result.kept_bytes / 1024.0 ** 2))
+
+    def _auto_lod_toggled(self, checked):
+
+        if checked:
+            self.lod_timer.start(self.LOD_UPDATE_INTERVAL)
+            self._update_lods(force=True)
+        else:
+            self.lod_timer.stop()
+
+    def _update_lods(self, force=False):
+        """Points the caches with LODs at the LOD of their screen size, unless pinned"""
+        self.lod_switcher.update(list(self._cache_items), force=force)
+
+    def _lod_pinned(self, index):
+
+        cache_node = self.sender().property("cache_node")
+        level = index - 1 if index > 0 else smc_lod.AUTO
+        smc_lod.pin(cache_node, level)
+
+        # Off caches stay off, they get their LOD when switched on
+        if not self._query_cache_status(cache_node):
+            return
+
+        if level != smc_lod.AUTO:
+            smc_lod.set_level(cache_node, level)
+        elif self.auto_lod_checkbox.isChecked():
+            self._update_lods(force=True)
+
+    def _budget_kind_changed(self, kind):
+
+        if kind == smc_budget.FPS:
+            self.budget_spin.setSuffix(" fps")
+            self.budget_spin.setValue(24)
+        else:
+            self.budget_spin.setSuffix(" MB")
+            self.budget_spin.setValue(8192)
+
+    def _propose_budget(self):
+        """
+        Plans the caches to fit the budget, shows the savings of caching each reference
+        and selects the planned references
+        """
+
+        self._budget_planner = smc_budget.BudgetPlanner(self._cache_refs, list(self._ref_items),
+                                                        quality=self._quality_profile())
+        current_fps = self._measure_fps()
+        self._budget_plan = self._budget_planner.plan(self.budget_spin.value(), self.budget_kind_combo.currentText(),
+                                                      current_fps=current_fps)
+
+        for rfn, cost in self._budget_planner.costs.items():
+            if rfn not in self._ref_items:
+                continue
+
+            item = QtWidgets.QTableWidgetItem(smc_budget.format_savings(cost))
+            item.setFlags(QtCore.Qt.ItemIsEnabled)
+            item.setTextAlignment(QtCore.Qt.AlignCenter | QtCore.Qt.AlignVCenter)
+            item.setToolTip("Rig: %i nodes, %i deformers, %i faces. Cache: %.1f MB%s" % (
+                cost.nodes, cost.deformers, cost.polygons, cost.cache_bytes / 1024.0 ** 2,
+                ", frame time measured" if cost.measured else ""))
+            self.asset_table.setItem(self.asset_table.row(self._ref_items[rfn]), 2, item)
+
+        planned = [self._ref_items[rfn] for action in self._budget_plan.actions for rfn in action.rfns
+                   if rfn in self._ref_items]
+        self._sync_selection(self.asset_table, planned)
+        self._selection_changed()
+
+        self.budget_label.setText(self._budget_plan.summary())
+
+    def _apply_budget(self):
+
+        if self._budget_plan is None:
+            self._propose_budget()
+
+        self._budget_planner.apply(self._budget_plan, dir=self.local_path_led.text(), store=self.shared_store,
+                                   quality=self._quality_profile())
+        self._budget_plan = None
+
+        self._refresh_tables()
+
+    def _visibility_toggled(self, checked):
+
+        if checked:
+            self._update_visibility(refresh=True)
+        else:
+            self.visibility_label.setText("")
+
+    def _visibility_stride_changed(self, stride):
+
+        self.visibility_enabler.stride = stride
+        if self.visibility_checkbox.isChecked():
+            self._update_visibility()
+
+    def _update_visibility(self, refresh=False):
+        """
+        Switches the caches by render camera visibility over the playback range, loading the selected
+        references that are on screen, and updates their state buttons
+        """
+
+        changes = self.visibility_enabler.update(self._cache_refs, self._selected_refs(), refresh=refresh)
+
+        for caches, checked in ((changes.caches_on, False), (changes.caches_off, True)):
+            for cache in caches:
+                if cache in self._cache_switches:
+                    self._cache_switches[cache].setChecked(checked)
+
+        visible = self.visibility_enabler.visibility(self._cache_refs)
+        self.visibility_label.setText("On screen: %i/%i caches. Last change: %i unloaded, %i loaded" % (
+            sum(visible.values()), len(self._cache_refs), len(changes.unloaded), len(changes.loaded)))
+
+    def _measure_fps(self):
+        return smc_gpu_cache.measure_fps() if self.measure_fps_checkbox.isChecked() else None
+
     def _switched(self, *args):
 
         cache_name = self.sender().property("cache_node")
+        fps_before = self._measure_fps()
+        toggle_start_time = time.perf_counter()
+
         if not self._query_cache_status(cache_name):
-            cmds.setAttr(cache_name + ".cacheFileName", cmds.getAttr(cache_name + ".storedPath"), type="string")
+            cmds.setAttr(cache_name + ".cacheFileName",
+                         smc_transfer.get_queue().resolve(cmds.getAttr(cache_name + ".storedPath")), type="string")
+            smc_cache_gc.touch(cmds.getAttr(cache_name + ".storedPath"))
+
+            if self.auto_lod_checkbox.isChecked() or smc_lod.pinned(cache_name) is not None:
+                self.lod_switcher.update([cache_name], force=True)
         else:
             cmds.setAttr(cache_name + ".cacheFileName", "", type="string")
+            self._prefetch_caches()
+
+        smc_export_history.get_history().record(
+            smc_export_history.TOGGLE,
+            smc_gpu_cache.cache_asset_name(cmds.getAttr(cache_name + ".refNodes")),
+            scene=cmds.file(q=True, sn=True),
+            path=cmds.getAttr(cache_name + ".cacheFileName"),
+            duration=time.perf_counter() - toggle_start_time,
+            fps_before=fps_before,
+            fps_after=self._measure_fps())
+
+    def _quality_preset_changed(self, name):
+
+        preset = smc_quality.PRESETS.get(name)
+        if not preset:
+            return
+
+        self.frame_step_spin.setValue(preset.frame_step)
+        self.decimation_spin.setValue(int(round(preset.decimation * 100)))
+        self.materials_checkbox.setChecked(preset.materials)
+        self.threshold_spin.setValue(preset.optimization_threshold)
+
+    def _quality_profile(self):
+        """QualityProfile of the quality controls, for new caches"""
+
+        return smc_quality.QualityProfile(frame_step=self.frame_step_spin.value(),
+                                          decimation=self.decimation_spin.value() / 100.0,
+                                          materials=self.materials_checkbox.isChecked(),
+                                          optimization_threshold=self.threshold_spin.value())
+
+    def _cache_quality(self, cache):
+
+        try:
+            return smc_quality.QualityProfile.from_json(cmds.getAttr(cache + ".qualityProfile"))
+        except ValueError:
+            return smc_quality.FINAL
+
+    def _upgrade_to_final(self):
+
+        cache_node = self.sender().property("cache_node")
+        rfns = cmds.getAttr(cache_node + ".refNodes")
+
+        cache = smc_gpu_cache.GpuCacheWrapper(rfns, cmds.playbackOptions(q=True, ast=True), cmds.playbackOptions(q=True, aet=True),
+                                dir=self.local_path_led.text(), store=self.shared_store)
+        cache.upgrade_to_final()
+
+        self._refresh_tables()
 
     def _re_export(self):
         """
@@ -543,11 +964,12 @@ class GpuCacherTool(QtWidgets.QWidget):
 
         cache_node = self.sender().property("cache_node")
         rfns = cmds.getAttr(cache_node + ".refNodes")
-        re_cache = GpuCacheWrapper(rfns, cmds.playbackOptions(q=True, ast=True),
+        re_cache = smc_gpu_cache.GpuCacheWrapper(rfns, cmds.playbackOptions(q=True, ast=True),
                                    cmds.playbackOptions(q=True, aet=True),
-                                   dir=self.local_path_led.text())
+                                   dir=self.local_path_led.text(),
+                                   store=self.shared_store)
 
-        re_cache.export_abc()
+        re_cache.export_abc(force=True)
         re_cache.turn_on_cache()
 
     def _delete_all(self):
@@ -555,7 +977,8 @@ class GpuCacherTool(QtWidgets.QWidget):
         for cache in cmds.listRelatives("GPU_CACHES", type="gpuCache"):
 
             for ref in cmds.getAttr(cache + ".refNodes"):
-                cmds.file(lr=ref)
+                with smc_trace.span("load_reference", rfn=ref):
+                    cmds.file(lr=ref)
 
             cmds.delete(cache)
 
@@ -573,10 +996,15 @@ class GpuCacherTool(QtWidgets.QWidget):
 
         for cache in [cache_node]:
 
-            os.remove(cmds.getAttr("%s.storedPath" % cache))
+            for path in [cmds.getAttr("%s.storedPath" % cache)] + smc_lod.lod_paths(cache)[1:]:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    log.warning("Could not remove %s: %s", path, e)
 
             for ref in cmds.getAttr(cache + ".refNodes"):
-                cmds.file(lr=ref)
+                with smc_trace.span("load_reference", rfn=ref):
+                    cmds.file(lr=ref)
 
             cmds.delete(cache)
 
@@ -588,15 +1016,95 @@ class GpuCacherTool(QtWidgets.QWidget):
 
         self._refresh_tables()
 
+    @smc_trace.traced()
     def _repair(self):
 
-        for file in os.listdir(self.local_path_led.text()):
-            print("FILE %s" % file)
+        for _ in self._iter_repair():
+            pass
+
+        self._refresh_tables()
+
+    def _reference_namespaces(self):
+        """
+        {unique namespace: [reference nodes]} of the scene references, in cmds.ls order
+        """
+
+        namespaces = {}
 
-            if os.path.basename(cmds.file(q=True, sn=True)).split(".")[0] not in file:
+        for ref in cmds.ls(type="reference"):
+            if "LAYOUTCACHE" in ref:
                 continue
 
-            file_no_scene_name = re.sub(os.path.basename(cmds.file(q=True, sn=True)).split(".")[0] + "_", "", file)
+            try:
+                unique_ns = cmds.referenceQuery(ref, ns=True, shn=True)
+
+            except Exception as e:
+                unique_ns = re.sub("RN$", "", ref)
+                unique_ns = re.sub("^[^:]*:", "", unique_ns)
+                log.debug("%s: %s, using %s", ref, e, unique_ns)
+
+            namespaces.setdefault(unique_ns, []).append(ref)
+
+        return namespaces
+
+    def _iter_repair(self):
+        """
+        Recreates the cache nodes of this scene from the cache folder, yielding after each file
+        """
+
+        scene_name = os.path.basename(cmds.file(q=True, sn=True)).split(".")[0]
+        # Scanned once, on the first file of this scene
+        namespaces = None
+
+        # Files written by journaled exports, their references and quality don't need guessing
+        journal = smc_journal.get_journal()
+        journal_jobs = journal.by_path(cmds.file(q=True, sn=True))
+
+        # Final caches last, so a node with an upgraded preview file next to its final one ends up final
+        for file in sorted(os.listdir(self.local_path_led.text()), key=lambda file: self._file_quality(file).is_final):
+            log.debug("FILE %s", file)
+
+            if scene_name not in file:
+                continue
+
+            # Attached with their LOD 0 file
+            if re.search(r"\.lod\d+\.abc$", file):
+                continue
+
+            job = journal_jobs.get(os.path.join(self.local_path_led.text(), file))
+            if job and job.state != smc_journal.DONE:
+                log.warning("SKIPPING %s EXPORT %s", job.state.upper(), file)
+                continue
+
+            if job and not journal.validate(job, full=False):
+                log.warning("SKIPPING CACHE CHANGED SINCE ITS EXPORT %s", file)
+                continue
+
+            if job and job.kind == smc_export_history.GPU_CACHE and job.name:
+                refs = cmds.ls(job.rfns, type="reference")
+                if len(refs) != len(job.rfns):
+                    log.warning("ABC FILE %s REFS NOT IN SCENE!", file)
+                    continue
+
+                repaired_cache = smc_gpu_cache.GpuCacheWrapper(refs, cmds.playbackOptions(q=True, ast=True),
+                                                 cmds.playbackOptions(q=True, aet=True),
+                                                 self.local_path_led.text(),
+                                                 name=job.name,
+                                                 quality=smc_quality.QualityProfile.from_json(job.quality),
+                                                 lods=job.lods)
+                repaired_cache._exported = True
+                log.info("FILEPATH %s (journaled)", repaired_cache.filepath)
+
+                yield
+                continue
+
+            if file.endswith(".abc"):
+                info = smc_alembic.read_info(os.path.join(self.local_path_led.text(), file))
+                if not info.valid:
+                    log.warning("SKIPPING BAD CACHE %s: %s", file, info.error)
+                    continue
+
+            file_no_scene_name = re.sub(scene_name + "_", "", file)
             # print(file_no_scene_name)
 
             name_match = re.match("gpuCache_([^_]*)", file_no_scene_name)
@@ -611,58 +1119,134 @@ class GpuCacherTool(QtWidgets.QWidget):
             results = re.findall("(?:chr|spr|prp|set)_[^_]*", ext, flags=re.IGNORECASE)
             # ""
 
+            if namespaces is None:
+                namespaces = self._reference_namespaces()
+
             refs = []
 
             for result in results:
-                print(result)
-
-                for ref in cmds.ls(type="reference"):
-                    if "LAYOUTCACHE" in ref:
-                        continue
-
-                    try:
-                        unique_ns = cmds.referenceQuery(ref, ns=True, shn=True)
-
-                    except Exception as e:
-                        print(e)
-                        print(ref)
-                        unique_ns = re.sub("RN$", "", ref)
-                        unique_ns = re.sub("^[^:]*:", "", unique_ns)
-                        print(unique_ns)
-
-                    if unique_ns == result:
-                        refs.append(ref)
-                        continue
+                log.debug(result)
+                refs += namespaces.get(result, [])
 
             # print(refs)
             if not refs:
-                print("|".join(valid_prefixes) + "_[^_]*")
-                print("ABC FILE %s REFS NOT IN SCENE!" % file)
+                log.debug("|".join(valid_prefixes) + "_[^_]*")
+                log.warning("ABC FILE %s REFS NOT IN SCENE!", file)
                 # cmds.error()
-                return
+                continue
 
-            repaired_cache = GpuCacheWrapper(refs, cmds.playbackOptions(q=True, ast=True),
+            repaired_cache = smc_gpu_cache.GpuCacheWrapper(refs, cmds.playbackOptions(q=True, ast=True),
                                              cmds.playbackOptions(q=True, aet=True),
                                              self.local_path_led.text(),
-                                             name=name)
+                                             name=name,
+                                             quality=self._file_quality(file))
 
             repaired_cache._exported = True
-            print("FILEPATH %s" % repaired_cache.filepath)
+            repaired_cache.find_lods()
+            log.info("FILEPATH %s", repaired_cache.filepath)
             # repaired_cache.turn_on_cache()
 
+            yield
+
+        self._update_resume_button()
+
+    def _update_resume_button(self):
+
+        unfinished = smc_journal.get_journal().unfinished(cmds.file(q=True, sn=True))
+
+        self.resume_button.setText("Resume %i unfinished exports" % len(unfinished) if unfinished else
+                                   "Resume unfinished exports")
+        self.resume_button.setToolTip("\n".join("%s: %s" % (job.state, ", ".join(job.rfns)) for job in unfinished))
+        self.resume_button.setEnabled(bool(unfinished))
+
+    def _resume_exports(self):
+        """
+        Runs the journaled exports of this scene a crash interrupted: transfers of exported files
+        are resubmitted from their scratch copies, the rest are exported again to the same files
+        """
+
+        journal = smc_journal.get_journal()
+
+        for job in journal.unfinished(cmds.file(q=True, sn=True)):
+
+            if journal.recover(job, callback=smc_gpu_cache.repoint_callback()):
+                continue
+
+            if len(cmds.ls(job.rfns, type="reference")) != len(job.rfns):
+                log.warning("References of %s are not in the scene anymore", job)
+                journal.fail(job, "references not in the scene")
+                continue
+
+            quality = smc_quality.QualityProfile.from_json(job.quality)
+
+            try:
+                if job.kind == smc_export_history.GPU_CACHE:
+                    cache = smc_gpu_cache.GpuCacheWrapper(job.rfns, job.start, job.end, dir=job.dir or self.local_path_led.text(),
+                                            name=job.name or "", store=self.shared_store, quality=quality,
+                                            lods=job.lods)
+                    cache.export_abc(force=True, job=job)
+                    cache.turn_on_cache()
+                else:
+                    smc_ref_wrapper.RefWrapper(job.rfns[0]).export_cache(quality, job=job)
+
+            except Exception as e:
+                log.error("Could not resume %s: %s", job, e)
+
+        self._update_resume_button()
         self._refresh_tables()
 
+    @staticmethod
+    def _file_quality(file):
+        """QualityProfile from the suffix of a cache file name, FINAL for unknown suffixes"""
+
+        tag_match = re.search(r"_-?\d+_-?\d+_([^_]*)\.abc$", file)
+        return (tag_match and smc_quality.from_tag(tag_match.group(1))) or smc_quality.FINAL
+
+    @staticmethod
+    def _cache_files_in_use():
+        """Cache files the collector must keep: read by gpuCache nodes, pending transfer or export recovery"""
+
+        in_use = []
+
+        for cache in cmds.ls(type="gpuCache"):
+            for attr in ["storedPath", "cacheFileName"]:
+                try:
+                    in_use.append(cmds.getAttr("%s.%s" % (cache, attr)))
+                except ValueError:
+                    continue
+
+            in_use += smc_lod.lod_paths(cache)
+
+        # Scratch files still waiting to be transferred
+        in_use += [transfer.src for transfer in smc_transfer.get_queue().pending]
+
+        # Scratch copies of interrupted exports, of any scene, ExportJournal.recover transfers them
+        for job in smc_journal.get_journal().unfinished():
+            in_use += [output["scratch"] for output in job.outputs.values() if output["scratch"]]
+
+        return in_use
+
+    def _cache_collector(self, **kwargs):
+
+        folders = [smc_transfer.SCRATCH_DIR]
+
+        # Never collect shared folders, other scenes may be using them
+        if smc_transfer.is_local(self.local_path_led.text()):
+            folders.append(self.local_path_led.text())
+
+        return smc_cache_gc.CacheCollector(folders, **kwargs)
+
     def _clear_temp(self):
+        """
+        Removes every cache in the temp folders not used by a gpuCache node of this scene
+        """
 
-        import os
-        for file in os.listdir(tempfile.gettempdir()):
-            if os.path.basename(file).endswith(".abc"):
-                if file.startswith("gpuCahe_"):
-                    try:
-                        os.remove(file)
-                        print("REMOVED %s" % file)
-                    except Exception as e:
-                        print(e)
+        if self._gc_future:
+            return
+
+        self.gc_label.setText("Removing caches...")
+        self._gc_future = self._cache_collector(max_bytes=0, max_age=None).collect_async(
+            self._cache_files_in_use())
 
     def _do_cache(self):
 
@@ -670,16 +1254,17 @@ class GpuCacherTool(QtWidgets.QWidget):
             cmds.select(clear=True)
             return
 
-        selected_unique_names = [selected.text() for selected in self.asset_table.selectedItems()]
-
         start = cmds.playbackOptions(q=True, ast=True)
         end = cmds.playbackOptions(q=True, aet=True)
-        selected_refs = ([self.info_dict[str(selected)]["ref"] for selected in selected_unique_names])
+        selected_refs = self._selected_refs()
+        if not selected_refs:
+            return
 
         if self._ref_lock:
             for ref in selected_refs:
                 cache = self._is_ref_in_cache(ref)
                 if cache:
+                    import alert_dialog
                     alert_dialog.AlertDialog(
                         "Ref %s is already used in cache: %s \n Delete the gpuCache containing it" % (
                             ref, cache + ": %s" % ", ".join(
@@ -687,13 +1272,20 @@ class GpuCacherTool(QtWidgets.QWidget):
                     return
 
         dir = self.local_path_led.text()
-        new_cache = GpuCacheWrapper(selected_refs, start, end, dir=dir)
+        new_cache = smc_gpu_cache.GpuCacheWrapper(selected_refs, start, end, dir=dir, store=self.shared_store,
+                                    quality=self._quality_profile(), lods=self.export_lods_checkbox.isChecked())
+
+        fps_before = self._measure_fps()
 
         if not new_cache.exported:
             new_cache.export_abc()
 
         new_cache.turn_on_cache()
 
+        if fps_before is not None:
+            smc_export_history.get_history().update(new_cache.history_id, fps_before=fps_before,
+                                                    fps_after=self._measure_fps())
+
         self._refresh_tables()
 
     def _is_ref_in_cache(self, ref):
@@ -711,16 +1303,17 @@ class GpuCacherTool(QtWidgets.QWidget):
         else:
             return False
 
+    @smc_trace.traced("scene_scan_gpuCaches")
     def _ls_gpuCaches(self, asset=""):
 
         caches = []
 
         for cache in cmds.ls(type="gpuCache"):
-            print(cache)
+            log.debug(cache)
 
             try:
                 for ref in cmds.getAttr("%s.refNodes" % cache):
-                    print("Asset %s" % asset)
+                    log.debug("Asset %s", asset)
                     if not asset:
                         if cache not in caches:
                             caches.append(cache)
@@ -738,7 +1331,7 @@ class GpuCacherTool(QtWidgets.QWidget):
                 # print(e)
                 pass
 
-        print(caches)
+        log.debug(caches)
 
         return caches
 
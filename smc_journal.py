@@ -0,0 +1,428 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+import smc_transfer
+import smc_alembic
+
+__all__ = ["Job", "ExportJournal", "get_journal"]
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL = os.environ.get("SMC_JOURNAL",
+                                 os.path.join(os.path.expanduser("~"), ".smc_maya_utils", "export_journal.jsonl"))
+
+# Finished jobs older than this are dropped by compact()
+KEEP_DAYS = 30
+
+QUEUED = "queued"
+RUNNING = "running"
+# Written to scratch, transfers to the final folder still going
+EXPORTED = "exported"
+DONE = "done"
+FAILED = "failed"
+
+UNFINISHED = (QUEUED, RUNNING, EXPORTED)
+
+
+class Job():
+    """
+    One export call (GpuCacheWrapper.export_abc, RefWrapper.export_cache) and its output files.
+    outputs: {final path: {"scratch": path or None, "checksum": sha1 or None, "size": bytes or None}}
+    """
+
+    FIELDS = ["id", "kind", "scene", "rfns", "start", "end", "quality", "lods", "name", "dir", "state", "outputs",
+              "error", "time", "pid"]
+
+    def __init__(self, **fields):
+
+        self.id = None
+        self.kind = None
+        self.scene = None
+        self.rfns = []
+        self.start = None
+        self.end = None
+        # smc_quality.QualityProfile json
+        self.quality = None
+        self.lods = False
+        # Cache node name without gpuCache_, so a resumed export writes the same files
+        self.name = None
+        self.dir = None
+        self.state = QUEUED
+        self.outputs = {}
+        self.error = None
+        self.time = None
+        self.pid = None
+
+        for field, value in fields.items():
+            if field in self.FIELDS:
+                setattr(self, field, value)
+
+    @property
+    def key(self):
+        """Jobs with the same key produce the same caches, the last one supersedes the others"""
+        return (self.kind, self.scene, tuple(sorted(self.rfns)), self.start, self.end, self.quality, bool(self.lods))
+
+    @property
+    def finished(self):
+        return self.state not in UNFINISHED
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return "<Job %s %s %s %s>" % (self.id, self.kind, self.state, ", ".join(self.rfns))
+
+
+def _scratch_complete(path):
+    """If a scratch file can be transferred as is: alembics down to their archive index, others not empty"""
+
+    if path.endswith(".abc"):
+        return smc_alembic.is_valid(path)
+
+    try:
+        return os.path.getsize(path) > 0
+    except OSError:
+        return False
+
+
+class ExportJournal():
+    """
+    Append-only journal of export jobs, one json line per job state change, fsynced so it survives
+    a Maya crash. The last line of a job is its state. After a crash, unfinished() lists the jobs to run
+    again and validate() checks the output checksums of finished ones.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL):
+
+        self.path = path
+        self._lock = threading.RLock()
+        self._jobs = {}
+        self._offset = 0
+        # Of the file read up to _offset, it changes when a session compacts the journal
+        self._inode = None
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        except OSError as e:
+            log.warning("Could not create the export journal folder of %s: %s", path, e)
+
+    # STORAGE
+
+    def _read(self):
+        """Replays the lines appended since the last read, by this or other Maya sessions"""
+
+        try:
+            with open(self.path, "rb") as infile:
+                stat = os.fstat(infile.fileno())
+                # Compacted by another session, replayed from the start
+                if stat.st_ino != self._inode or stat.st_size < self._offset:
+                    self._inode = stat.st_ino
+                    self._offset = 0
+                    self._jobs = {}
+
+                infile.seek(self._offset)
+                data = infile.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            log.warning("Could not read the export journal %s: %s", self.path, e)
+            return
+
+        # A line cut by a crash has no newline yet, it is read again once completed or skipped for good
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                fields = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                log.warning("Skipping corrupt export journal line: %s", e)
+                continue
+
+            self._jobs[fields["id"]] = Job(**fields)
+
+    def _append(self, job):
+
+        job.time = time.time()
+        job.pid = os.getpid()
+        line = (json.dumps(job.to_dict(), sort_keys=True) + "\n").encode("utf-8")
+
+        with self._lock:
+            self._read()
+            self._jobs[job.id] = job
+
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+                self._offset += len(line)
+
+            except OSError as e:
+                log.warning("Could not write the export journal %s: %s", self.path, e)
+
+    def compact(self, keep_days=KEEP_DAYS):
+        """
+        Rewrites the journal with the last line of each job, without old finished jobs.
+        get_journal() runs it once per session, every new session replays the whole file
+        """
+
+        with self._lock:
+            self._read()
+            if not os.path.exists(self.path):
+                return
+
+            cutoff = time.time() - keep_days * 24 * 60 * 60
+            self._jobs = {job_id: job for job_id, job in self._jobs.items()
+                          if not job.finished or (job.time or 0) >= cutoff}
+
+            tmp_path = "%s.%i.tmp" % (self.path, os.getpid())
+            try:
+                with open(tmp_path, "wb") as outfile:
+                    for job in sorted(self._jobs.values(), key=lambda job: job.time or 0):
+                        outfile.write((json.dumps(job.to_dict(), sort_keys=True) + "\n").encode("utf-8"))
+
+                    # Lines other sessions appended since the read are kept as they are, and read next
+                    compacted = outfile.tell()
+                    with open(self.path, "rb") as infile:
+                        infile.seek(self._offset)
+                        outfile.write(infile.read())
+
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+
+                os.replace(tmp_path, self.path)
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+            self._inode = os.stat(self.path).st_ino
+            self._offset = compacted
+
+    # QUERIES
+
+    def jobs(self, scene=None, states=None):
+        """Last state of every job, oldest first"""
+
+        with self._lock:
+            self._read()
+            jobs = sorted(self._jobs.values(), key=lambda job: job.time or 0)
+
+        return [job for job in jobs
+                if (scene is None or job.scene == scene) and (states is None or job.state in states)]
+
+    def latest(self, scene=None):
+        """The newest job of every key"""
+
+        latest = {}
+        for job in self.jobs(scene):
+            latest[job.key] = job
+
+        return list(latest.values())
+
+    def find(self, kind, scene, rfns, start, end, quality, lods=False):
+        """Newest job that produced (or was producing) these caches, None if there is none"""
+
+        key = Job(kind=kind, scene=scene, rfns=rfns, start=start, end=end, quality=quality, lods=lods).key
+
+        for job in reversed(self.jobs(scene)):
+            if job.key == key:
+                return job
+
+        return None
+
+    def unfinished(self, scene=None):
+        """Jobs interrupted before their outputs were verified, not superseded by a later job"""
+        return [job for job in self.latest(scene) if not job.finished]
+
+    def by_path(self, scene=None):
+        """{output path: newest job writing it}"""
+
+        jobs = {}
+        for job in self.jobs(scene):
+            for path in job.outputs:
+                jobs[path] = job
+
+        return jobs
+
+    # STATES
+
+    def queue(self, kind, scene, rfns, start, end, quality, lods=False, name=None, dir=None):
+
+        job = Job(id=uuid.uuid4().hex, kind=kind, scene=scene, rfns=list(rfns), start=start, end=end,
+                  quality=quality, lods=bool(lods), name=name, dir=dir, state=QUEUED)
+        self._append(job)
+
+        return job
+
+    def start(self, job, name=None, outputs=()):
+
+        job.state = RUNNING
+        job.error = None
+        if name is not None:
+            job.name = name
+        job.outputs = {path: {"scratch": None, "checksum": None, "size": None} for path in outputs}
+
+        self._append(job)
+
+    def adopt(self, job, paths, name=None):
+        """Records paths, exported before, as the outputs of job"""
+
+        self.start(job, name=name, outputs=paths)
+        self.exported(job, dict.fromkeys(paths))
+
+    def fail(self, job, error):
+
+        job.state = FAILED
+        job.error = str(error)
+        self._append(job)
+
+    def exported(self, job, transfers):
+        """
+        Outputs written, transfers {final path: smc_transfer.Transfer, None when written in place}.
+        Outputs written in place are checksummed now, the others once their transfer calls transfer_callback.
+        """
+
+        with self._lock:
+            # A transfer already failed
+            if job.state == FAILED:
+                return
+
+            for path, transfer in transfers.items():
+                output = job.outputs.setdefault(path, {"scratch": None, "checksum": None, "size": None})
+
+                if transfer is None:
+                    try:
+                        output["checksum"] = smc_transfer.checksum(path)
+                        output["size"] = os.path.getsize(path)
+                    except OSError as e:
+                        self.fail(job, e)
+                        return
+                elif not output["checksum"]:
+                    output["scratch"] = transfer.src
+
+            job.state = EXPORTED
+            self._finish(job)
+
+    def transfer_callback(self, job, drop_scratch=False):
+        """
+        TransferQueue.submit callback recording the checksum of one output of job.
+        drop_scratch removes the scratch copy of a transfer submitted with keep_source once recorded, a crash
+        in between leaves it for recover()
+        """
+
+        def callback(transfer):
+
+            with self._lock:
+                if transfer.state != smc_transfer.Transfer.DONE:
+                    self.fail(job, "transfer of %s failed: %s" % (transfer.dst, transfer.error))
+                    return
+
+                output = job.outputs.setdefault(transfer.dst, {"scratch": None, "checksum": None, "size": None})
+                output["scratch"] = transfer.src
+                output["checksum"] = transfer.checksum
+                output["size"] = os.path.getsize(transfer.dst)
+
+                if job.state == EXPORTED:
+                    self._finish(job)
+
+            if drop_scratch:
+                try:
+                    os.remove(transfer.src)
+                except OSError as e:
+                    log.debug(e)
+
+        return callback
+
+    def _finish(self, job):
+        """Done once every output has its checksum, else records the progress"""
+
+        if job.outputs and all(output["checksum"] for output in job.outputs.values()):
+            job.state = DONE
+
+        self._append(job)
+
+    # RECOVERY
+
+    def validate(self, job, full=True):
+        """If every output of a done job is in place, with its recorded checksum (full) or size"""
+
+        if job.state != DONE:
+            return False
+
+        for path, output in job.outputs.items():
+            try:
+                if os.path.getsize(path) != output["size"]:
+                    log.warning("%s changed size since %s", path, job)
+                    return False
+
+                if full and smc_transfer.checksum(path) != output["checksum"]:
+                    log.warning("%s checksum does not match %s", path, job)
+                    return False
+
+            except OSError as e:
+                log.info("%s of %s: %s", path, job, e)
+                return False
+
+        return True
+
+    def recover(self, job, callback=None):
+        """
+        Resubmits the transfers of an exported job whose scratch files survived, instead of exporting again.
+        callback(transfer) is called once the journal has recorded each of them.
+        Returns False if the job has to be exported again.
+        """
+
+        if job.state != EXPORTED:
+            return False
+
+        pending = {path: output for path, output in job.outputs.items() if not output["checksum"]}
+        if not all(output["scratch"] and _scratch_complete(output["scratch"]) for output in pending.values()):
+            return False
+
+        record = self.transfer_callback(job)
+
+        def recovered(transfer):
+            record(transfer)
+            if callback:
+                callback(transfer)
+
+        transfer_queue = smc_transfer.get_queue()
+        for path, output in pending.items():
+            transfer_queue.submit(output["scratch"], path, keep_source=True, callback=recovered)
+
+        log.info("Recovered %s, transferring %i files", job, len(pending))
+        return True
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """Shared ExportJournal for the maya session"""
+
+    global _journal
+
+    with _journal_lock:
+        if _journal is None:
+            _journal = ExportJournal()
+
+            try:
+                _journal.compact()
+            except OSError as e:
+                log.warning("Could not compact the export journal %s: %s", _journal.path, e)
+
+    return _journal
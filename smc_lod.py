@@ -0,0 +1,232 @@
+import os
+import math
+import logging
+
+import maya.cmds as cmds
+
+import smc_quality
+import smc_transfer
+import smc_trace
+
+__all__ = ["lod_profiles", "lod_path", "lod_paths", "choose_level", "active_camera", "screen_size", "pin",
+           "pinned", "current_level", "set_level", "LodSwitcher"]
+
+log = logging.getLogger(__name__)
+
+# Screen height fraction under which each LOD switches to the next coarser one
+LOD_THRESHOLDS = [0.25, 0.08]
+# Relative band around a threshold without switching, so caches at the limit don't flicker
+HYSTERESIS = 0.2
+
+# Faces kept and optimization threshold of LOD 1, 2... relative to LOD 0
+LOD_DECIMATION = [0.25, 0.05]
+LOD_OPTIMIZATION_THRESHOLD = [10000, 2000]
+
+AUTO = -1
+
+
+def lod_profiles(base):
+    """QualityProfiles of LOD 0 (base), 1, 2. Coarser LODs keep the frame step and drop materials"""
+
+    profiles = [base]
+
+    for decimation, threshold in zip(LOD_DECIMATION, LOD_OPTIMIZATION_THRESHOLD):
+        profiles.append(smc_quality.QualityProfile(frame_step=base.frame_step,
+                                                   decimation=base.decimation * decimation,
+                                                   materials=False,
+                                                   optimization_threshold=min(threshold,
+                                                                              base.optimization_threshold)))
+
+    return profiles
+
+
+def lod_path(filepath, level):
+    """Cache file of a LOD, LOD 0 is filepath itself"""
+
+    if not level:
+        return filepath
+
+    return "%s.lod%i.abc" % (os.path.splitext(filepath)[0], level)
+
+
+def lod_paths(cache):
+    """Cache files of the LODs of a gpuCache node, [] for caches without LODs"""
+
+    try:
+        return cmds.getAttr(cache + ".lodPaths") or []
+    except ValueError:
+        return []
+
+
+def choose_level(size, current, levels, thresholds=LOD_THRESHOLDS, hysteresis=HYSTERESIS):
+    """
+    LOD for a screen size, starting from the current one: finer only once size is hysteresis above
+    the threshold, coarser once it is hysteresis below.
+    """
+
+    level = min(max(current, 0), levels - 1)
+
+    while level > 0 and size > thresholds[level - 1] * (1 + hysteresis):
+        level -= 1
+
+    while level < levels - 1 and size < thresholds[level] * (1 - hysteresis):
+        level += 1
+
+    return level
+
+
+def active_camera():
+    """Camera of the focused model panel, or of the first visible one, persp without a UI"""
+
+    panels = [cmds.getPanel(withFocus=True)] + (cmds.getPanel(visiblePanels=True) or [])
+
+    for panel in panels:
+        if panel and cmds.getPanel(typeOf=panel) == "modelPanel":
+            return cmds.modelPanel(panel, q=True, camera=True)
+
+    return "persp"
+
+
+class _CameraView():
+    """Position and projection of a camera, queried once per update"""
+
+    def __init__(self, camera):
+
+        self.camera = camera
+        self.position = cmds.xform(camera, q=True, ws=True, t=True)
+        self.orthographic = cmds.camera(camera, q=True, orthographic=True)
+
+        if self.orthographic:
+            self.ortho_width = cmds.camera(camera, q=True, orthoWidth=True)
+        else:
+            self.tan_half_fov = math.tan(math.radians(cmds.camera(camera, q=True, verticalFieldOfView=True)) / 2)
+
+    def key(self):
+        return (self.camera, tuple(self.position), cmds.xform(self.camera, q=True, ws=True, ro=True))
+
+    def screen_size(self, bounding_box):
+        """Bounding sphere diameter of a world bounding box as a fraction of the view height"""
+
+        x_min, y_min, z_min, x_max, y_max, z_max = bounding_box
+        center = [(x_min + x_max) / 2, (y_min + y_max) / 2, (z_min + z_max) / 2]
+        radius = math.sqrt((x_max - x_min) ** 2 + (y_max - y_min) ** 2 + (z_max - z_min) ** 2) / 2
+
+        if self.orthographic:
+            return 2 * radius / self.ortho_width if self.ortho_width else 1.0
+
+        distance = math.sqrt(sum((c - p) ** 2 for c, p in zip(center, self.position)))
+        if distance <= radius:
+            return 1.0
+
+        return radius / (distance * self.tan_half_fov)
+
+
+def screen_size(cache, camera=None):
+    """Screen height fraction covered by a gpuCache node from camera (the active one by default)"""
+    return _CameraView(camera or active_camera()).screen_size(cmds.exactWorldBoundingBox(cache))
+
+
+def pin(cache, level):
+    """Keeps a cache at level, AUTO or None to switch it automatically again"""
+
+    if not cmds.attributeQuery("lodPinned", node=cache, exists=True):
+        cmds.addAttr(cache, longName="lodPinned", attributeType="long", defaultValue=AUTO)
+
+    cmds.setAttr(cache + ".lodPinned", AUTO if level is None else level)
+
+
+def pinned(cache):
+    """Pinned level of a cache, None when switched automatically"""
+
+    try:
+        level = cmds.getAttr(cache + ".lodPinned")
+    except ValueError:
+        return None
+
+    return None if level is None or level < 0 else level
+
+
+def current_level(cache, paths):
+    """LOD the node reads, None when it is off or reads a file that is not one of its LODs"""
+
+    cache_file = cmds.getAttr(cache + ".cacheFileName")
+    if not cache_file:
+        return None
+
+    transfer_queue = smc_transfer.get_queue()
+
+    for level, path in enumerate(paths):
+        if cache_file in (path, transfer_queue.resolve(path)):
+            return level
+
+    return None
+
+
+def set_level(cache, level, paths=None):
+
+    paths = paths or lod_paths(cache)
+    path = smc_transfer.get_queue().resolve(paths[level])
+
+    if not os.path.exists(path):
+        log.warning("Missing LOD %i of %s: %s", level, cache, path)
+        return False
+
+    cmds.setAttr(cache + ".cacheFileName", path, type="string")
+    return True
+
+
+class LodSwitcher():
+    """
+    Points active gpuCache nodes with LODs at the LOD fitting their screen size from the active camera.
+    update() does nothing while the camera and the current frame don't move.
+    """
+
+    def __init__(self, thresholds=LOD_THRESHOLDS, hysteresis=HYSTERESIS):
+
+        self.thresholds = thresholds
+        self.hysteresis = hysteresis
+        self._last_key = None
+
+    @smc_trace.traced("lod_update")
+    def update(self, caches, force=False):
+        """Switches caches, returns {cache: level} of the switched ones"""
+
+        view = _CameraView(active_camera())
+        key = (view.key(), cmds.currentTime(q=True), tuple(caches))
+
+        if not force and key == self._last_key:
+            return {}
+
+        self._last_key = key
+        switched = {}
+
+        for cache in caches:
+
+            paths = lod_paths(cache)
+            if len(paths) < 2:
+                continue
+
+            current = current_level(cache, paths)
+            if current is None:
+                # Turned off, or pointed at something else by hand
+                continue
+
+            level = pinned(cache)
+            if level is None:
+                try:
+                    size = view.screen_size(cmds.exactWorldBoundingBox(cache))
+                except (RuntimeError, ValueError) as e:
+                    log.debug("No bounding box for %s: %s", cache, e)
+                    continue
+
+                level = choose_level(size, current, len(paths), self.thresholds, self.hysteresis)
+
+            level = min(level, len(paths) - 1)
+
+            if level != current and set_level(cache, level, paths):
+                switched[cache] = level
+
+        if switched:
+            log.debug("Switched LODs %s", switched)
+
+        return switched
@@ -0,0 +1,238 @@
+import os
+import logging
+
+import maya.cmds as cmds
+
+import smc_trace
+
+__all__ = ["default_namespace", "Rename", "NamespacePlan", "plan_namespaces", "apply_namespaces",
+           "normalize_namespaces"]
+
+log = logging.getLogger(__name__)
+
+
+def default_namespace(ref):
+    """Namespace a RefWrapper is normalized to: its file name without extension, like new_namespace"""
+    return os.path.basename(ref.file).split(".")[0]
+
+
+def _reference_namespace(rfn):
+    """Absolute namespace of a reference without the leading colon, queried without loading it"""
+    return cmds.referenceQuery(rfn, namespace=True).lstrip(":")
+
+
+def _scene_namespaces():
+    """Every namespace of the scene, with the ones of unloaded references"""
+
+    namespaces = set(namespace.lstrip(":") for namespace in
+                     cmds.namespaceInfo(":", listOnlyNamespaces=True, recurse=True) or [])
+
+    for rfn in cmds.ls(type="reference") or []:
+        try:
+            namespaces.add(_reference_namespace(rfn))
+        except RuntimeError as e:
+            log.debug("%s: %s", rfn, e)
+
+    return namespaces
+
+
+def _join(parent, name):
+    return "%s:%s" % (parent, name) if parent else name
+
+
+class Rename():
+    """Namespace change of one RefWrapper, old and new are absolute without the leading colon"""
+
+    def __init__(self, ref, old, new, wanted):
+
+        self.ref = ref
+        self.old = old
+        self.new = new
+        # Name asked for, new differs when it collided
+        self.wanted = wanted
+
+    @property
+    def parent(self):
+        return ":".join(self.old.split(":")[:-1])
+
+    @property
+    def name(self):
+        """New namespace relative to its parent, as file -edit -namespace takes it"""
+        return self.new.split(":")[-1]
+
+    def __repr__(self):
+        return "Rename(%s, %s -> %s)" % (self.ref.reference_node, self.old, self.new)
+
+
+class NamespacePlan():
+    """Renames bringing references to unique namespaces, and the references already there"""
+
+    def __init__(self, renames, unchanged):
+
+        self.renames = renames
+        self.unchanged = unchanged
+
+        # Filled by apply_namespaces
+        self.renamed = []
+        self.failed = []
+        self.reloads = 0
+        self.reloads_avoided = 0
+
+    @property
+    def collisions(self):
+        return [rename for rename in self.renames if rename.new.split(":")[-1] != rename.wanted]
+
+    def __bool__(self):
+        return bool(self.renames)
+
+    def __repr__(self):
+        return "NamespacePlan(%i renames, %i collisions, %i unchanged, %i reloads, %i reloads avoided)" % (
+            len(self.renames), len(self.collisions), len(self.unchanged), self.reloads, self.reloads_avoided)
+
+
+def plan_namespaces(refs, names=None):
+    """
+    NamespacePlan for RefWrappers refs, to names {reference node: namespace} or default_namespace.
+    Namespaces stay under their parent. A name taken by another namespace of the scene or asked for by
+    several references gets a number, like Maya does: chr_bob, chr_bob1... References already at their
+    name keep it. Nothing is loaded.
+    """
+
+    names = names or {}
+    current = {}
+    wanted = {}
+
+    for ref in refs:
+        current[ref] = _reference_namespace(ref.reference_node)
+        wanted[ref] = names.get(ref.reference_node) or default_namespace(ref)
+
+    # The namespaces of the planned references are freed as they move
+    taken = _scene_namespaces() - set(current.values())
+
+    unchanged = [ref for ref in refs if current[ref].split(":")[-1] == wanted[ref]]
+    taken.update(current[ref] for ref in unchanged)
+
+    renames = []
+    for ref in refs:
+        if ref in unchanged:
+            continue
+
+        parent = ":".join(current[ref].split(":")[:-1])
+        new = _join(parent, wanted[ref])
+        index = 1
+        while new in taken:
+            new = _join(parent, "%s%i" % (wanted[ref], index))
+            index += 1
+
+        taken.add(new)
+        if new != current[ref]:
+            renames.append(Rename(ref, current[ref], new, wanted[ref]))
+        else:
+            unchanged.append(ref)
+
+    return NamespacePlan(renames, unchanged)
+
+
+def _rename(rename, name):
+    """Renames the namespace of a reference, loaded or not. Returns the reference loads it took"""
+
+    rfn = rename.ref.reference_node
+    ref_file = cmds.referenceQuery(rfn, filename=True)
+
+    try:
+        cmds.file(ref_file, edit=True, namespace=name)
+        return 0
+    except RuntimeError as e:
+        if cmds.referenceQuery(rfn, isLoaded=True):
+            raise
+        log.info("%s can't be renamed unloaded, TEMPORARY LOADING REF: %s", rfn, e)
+
+    with smc_trace.span("load_reference", rfn=rfn):
+        cmds.file(loadReference=rfn)
+    try:
+        cmds.file(ref_file, edit=True, namespace=name)
+    finally:
+        with smc_trace.span("unload_reference", rfn=rfn):
+            cmds.file(unloadReference=rfn)
+
+    return 1
+
+
+@smc_trace.traced("apply_namespaces")
+def apply_namespaces(plan):
+    """
+    Renames the namespaces of a NamespacePlan in one pass, with the viewport suspended and as a single
+    undo step, and stores them on the references (cached_namespace). References are renamed in place,
+    unloaded ones stay unloaded. A rename onto a namespace another planned reference still holds waits
+    for it to move, cycles go through a temporary name.
+    Counts plan.reloads_avoided against RefWrapper.new_namespace, which loads an unloaded reference,
+    renames it and reloads it.
+    """
+
+    held = dict((rename.old, rename) for rename in plan.renames)
+    pending = list(plan.renames)
+    loaded = {}
+
+    cmds.undoInfo(openChunk=True, chunkName="smc_namespaces")
+    cmds.refresh(suspend=True)
+    try:
+        while pending:
+            # Waiting on a namespace that failed to move, it stays taken
+            for rename in [rename for rename in pending if held.get(rename.new) in plan.failed]:
+                log.warning("Could not rename %s to %s: namespace still taken", rename.old, rename.new)
+                pending.remove(rename)
+                plan.failed.append(rename)
+
+            ready = [rename for rename in pending if held.get(rename.new, rename) is rename]
+
+            if not ready:
+                # Every pending reference waits on another one: the first moves aside
+                rename = pending[0]
+                temp = _join(rename.parent, "%s_smcTmp" % rename.name)
+                while temp in held or cmds.namespace(exists=":" + temp):
+                    temp += "_"
+
+                try:
+                    plan.reloads += _rename(rename, temp.split(":")[-1])
+                except RuntimeError as e:
+                    log.warning("Could not rename %s to %s: %s", rename.old, temp, e)
+                    pending.remove(rename)
+                    plan.failed.append(rename)
+                    continue
+
+                del held[rename.old]
+                held[temp] = rename
+                continue
+
+            for rename in ready:
+                pending.remove(rename)
+                rfn = rename.ref.reference_node
+                loaded[rfn] = cmds.referenceQuery(rfn, isLoaded=True)
+
+                try:
+                    plan.reloads += _rename(rename, rename.name)
+                except RuntimeError as e:
+                    log.warning("Could not rename %s to %s: %s", rename.old, rename.new, e)
+                    plan.failed.append(rename)
+                    continue
+
+                for old, holder in list(held.items()):
+                    if holder is rename:
+                        del held[old]
+
+                rename.ref.set_cached_namespace(rename.new)
+                plan.renamed.append(rename)
+    finally:
+        cmds.refresh(suspend=False)
+        cmds.undoInfo(closeChunk=True)
+
+    plan.reloads_avoided = sum(1 if loaded[rename.ref.reference_node] else 2
+                               for rename in plan.renamed) - plan.reloads
+
+    log.info("Applied %r", plan)
+    return plan
+
+
+def normalize_namespaces(refs, names=None):
+    """Plans and applies the namespaces of RefWrappers refs, returns the NamespacePlan"""
+    return apply_namespaces(plan_namespaces(refs, names))
@@ -0,0 +1,109 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["Prefetcher"]
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = int(float(os.environ.get("SMC_PREFETCH_BUDGET_GB", 4)) * 1024 ** 3)
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def warm(path):
+    """Pulls path into the OS page cache. Returns the number of bytes warmed"""
+
+    size = os.path.getsize(path)
+
+    if hasattr(os, "posix_fadvise"):
+        # The kernel reads ahead asynchronously
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+        return size
+
+    buffer = bytearray(CHUNK_SIZE)
+    with open(path, "rb", buffering=0) as f:
+        while f.readinto(buffer):
+            pass
+
+    return size
+
+
+class Prefetcher():
+    """
+    Warms the page cache for cache files likely to be enabled soon, within a memory budget.
+
+    prefetch() takes paths in priority order, files past the budget are skipped
+    and files already warmed are not read again.
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET, max_workers=2):
+
+        self.budget_bytes = budget_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="smc_prefetch")
+
+        self._lock = threading.Lock()
+        self._warmed = OrderedDict()
+
+    @property
+    def warmed_bytes(self):
+        with self._lock:
+            return sum(size for size, mtime in self._warmed.values())
+
+    def prefetch(self, paths):
+        """Queues warming of paths in order until the budget is used. Returns the paths queued"""
+
+        selected = OrderedDict()
+        total = 0
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            if path in selected:
+                continue
+
+            if total + stat.st_size > self.budget_bytes:
+                continue
+
+            selected[path] = (stat.st_size, stat.st_mtime)
+            total += stat.st_size
+
+        queued = []
+
+        with self._lock:
+            # Anything not selected anymore no longer counts against the budget
+            for path in list(self._warmed):
+                if path not in selected:
+                    del self._warmed[path]
+
+            for path, (size, mtime) in selected.items():
+                if self._warmed.get(path) == (size, mtime):
+                    continue
+
+                self._warmed[path] = (size, mtime)
+                queued.append(path)
+
+        for path in queued:
+            self._executor.submit(self._warm, path)
+
+        return queued
+
+    def _warm(self, path):
+
+        try:
+            warm(path)
+            log.debug("Prefetched %s", path)
+        except OSError as e:
+            log.warning("Could not prefetch %s: %s", path, e)
+
+            with self._lock:
+                self._warmed.pop(path, None)
@@ -0,0 +1,148 @@
+import re
+import json
+import logging
+import contextlib
+
+__all__ = ["QualityProfile", "FINAL", "PREVIEW", "BLOCKING", "PRESETS", "from_tag", "decimated"]
+
+log = logging.getLogger(__name__)
+
+
+class QualityProfile():
+    """
+    How a cache is exported: every frame_step frames, keeping decimation of the faces, with or without
+    materials and with the gpuCache optimization threshold.
+    """
+
+    def __init__(self, frame_step=1, decimation=1.0, materials=True, optimization_threshold=40000):
+
+        self.frame_step = max(int(frame_step), 1)
+        self.decimation = min(max(float(decimation), 0.01), 1.0)
+        self.materials = bool(materials)
+        self.optimization_threshold = int(optimization_threshold)
+
+    def _values(self):
+        return (self.frame_step, round(self.decimation, 2), self.materials, self.optimization_threshold)
+
+    def __eq__(self, other):
+        return isinstance(other, QualityProfile) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return "QualityProfile(%s)" % self.tag
+
+    @property
+    def is_final(self):
+        return self == FINAL
+
+    @property
+    def tag(self):
+        """
+        Preset name, or the encoded values of a custom profile (s2d50m0t10000: step 2, 50% faces,
+        no materials, threshold 10000). Used in file names, so without underscores.
+        """
+
+        for name, preset in PRESETS.items():
+            if preset == self:
+                return name
+
+        return "s%id%im%it%i" % (self.frame_step, round(self.decimation * 100), self.materials,
+                                 self.optimization_threshold)
+
+    @property
+    def file_suffix(self):
+        """Added to cache file names, empty for final caches so their names don't change"""
+        return "" if self.is_final else self.tag
+
+    def gpu_flags(self):
+
+        flags = "-optimize -optimizationThreshold %i" % self.optimization_threshold
+        if self.materials:
+            flags += " -writeMaterials"
+        flags += " -dataFormat ogawa"
+        if self.frame_step > 1:
+            flags += " -simulationRate 1 -sampleMultiplier %i" % self.frame_step
+
+        return flags
+
+    def abc_flags(self):
+        return "-step %i" % self.frame_step if self.frame_step > 1 else ""
+
+    def sample_count(self, start, end):
+        """Samples exported over start, end"""
+        return int((end - start) / self.frame_step) + 1
+
+    def to_dict(self):
+        return {"frame_step": self.frame_step,
+                "decimation": self.decimation,
+                "materials": self.materials,
+                "optimization_threshold": self.optimization_threshold}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, data):
+        """Profile stored on a node, FINAL for nodes made before profiles existed"""
+
+        if not data:
+            return FINAL
+
+        try:
+            return cls(**json.loads(data))
+        except (ValueError, TypeError) as e:
+            log.warning("Bad quality profile %r, using final: %s", data, e)
+            return FINAL
+
+
+FINAL = QualityProfile()
+PREVIEW = QualityProfile(frame_step=2, decimation=0.5, materials=False, optimization_threshold=20000)
+BLOCKING = QualityProfile(frame_step=4, decimation=0.25, materials=False, optimization_threshold=10000)
+
+PRESETS = {"final": FINAL, "preview": PREVIEW, "blocking": BLOCKING}
+
+
+def from_tag(tag):
+    """Profile of a tag or file suffix, None if it is not one"""
+
+    if not tag:
+        return FINAL
+
+    if tag in PRESETS:
+        return PRESETS[tag]
+
+    match = re.match(r"^s(\d+)d(\d+)m([01])t(\d+)$", tag)
+    if not match:
+        return None
+
+    step, decimation, materials, threshold = match.groups()
+    return QualityProfile(int(step), int(decimation) / 100.0, materials == "1", int(threshold))
+
+
+@contextlib.contextmanager
+def decimated(meshes, decimation):
+    """
+    Reduces meshes to decimation of their faces with temporary polyReduce nodes, removed on exit
+    so the reference edits are left as they were.
+    """
+
+    import maya.cmds as cmds
+
+    nodes = []
+
+    try:
+        if decimation < 1.0:
+            for mesh in meshes:
+                try:
+                    nodes += cmds.polyReduce(mesh, percentage=(1.0 - decimation) * 100, keepQuadsWeight=1.0,
+                                             replaceOriginal=True, constructionHistory=True) or []
+                except RuntimeError as e:
+                    log.warning("Could not reduce %s: %s", mesh, e)
+
+        yield nodes
+
+    finally:
+        if nodes:
+            cmds.delete(nodes)
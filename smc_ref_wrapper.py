@@ -5,12 +5,27 @@
 import os
 import re
 import json
+import time
 import logging
 
 import maya.cmds
 
+import smc_transfer
+import smc_trace
+import smc_export_history
+import smc_cost
+import smc_quality
+import smc_journal
+import smc_namespaces
+
+log = logging.getLogger(__name__)
+
+
 class RefWrapper():
 
+    PREROLL_BUFFER_AMOUNT = 5
+    CACHE_START_FRAME = 101
+
     def __init__(self, reference_node):
 
         self._reference_node = reference_node
@@ -29,6 +44,8 @@ class RefWrapper():
 
         self._mats_file = ""
         self._mats_json = ""
+        # {final path: smc_transfer.Transfer or None} of the last export_mats
+        self._mats_transfers = {}
         self._mat_data_list = ""
 
         self._cached_ns = namespace
@@ -50,7 +67,7 @@ class RefWrapper():
         try:
             self._file = maya.cmds.referenceQuery(self.reference_node, filename=True, un=True)
         except RuntimeError:
-            print("BE CAREFUL THIS REF HAS NO FILE ASSOCIATED %s" % self.reference_node)
+            log.warning("BE CAREFUL THIS REF HAS NO FILE ASSOCIATED %s", self.reference_node)
 
             try:
                 maya.cmds.lockNode(self.reference_node, l=False)
@@ -74,6 +91,57 @@ class RefWrapper():
 
         return version
 
+    @property
+    def polygon_count(self):
+        """Faces of the reference meshes, 0 while it is unloaded"""
+
+        if not maya.cmds.referenceQuery(self.reference_node, il=True):
+            return 0
+
+        meshes = maya.cmds.ls(maya.cmds.referenceQuery(self.reference_node, nodes=True, dp=True),
+                              type="mesh", noIntermediate=True)
+        if not meshes:
+            return 0
+
+        count = maya.cmds.polyEvaluate(meshes, face=True)
+        return count if isinstance(count, int) else 0
+
+    @property
+    def deformer_count(self):
+        """Deformers (skinClusters, blendShapes...) of the reference, None while it is unloaded"""
+
+        if not maya.cmds.referenceQuery(self.reference_node, il=True):
+            return None
+
+        return len(maya.cmds.ls(maya.cmds.referenceQuery(self.reference_node, nodes=True, dp=True),
+                                type="geometryFilter") or [])
+
+    @property
+    def node_count(self):
+        """Nodes of the reference, 0 while it is unloaded"""
+
+        if not maya.cmds.referenceQuery(self.reference_node, il=True):
+            return 0
+
+        return len(maya.cmds.referenceQuery(self.reference_node, nodes=True) or [])
+
+    @property
+    def cacheable(self):
+        """If export_cache can cache the reference: it has a file, not an alembic or a set"""
+
+        ref_file = self.file
+        return bool(ref_file) and not ref_file.endswith(".abc") and "/sets/" not in ref_file.replace("\\", "/")
+
+    def estimate_cache(self, quality=smc_quality.FINAL):
+        """smc_cost.Estimate of export_cache with the current playback range"""
+
+        start = self.CACHE_START_FRAME - self.PREROLL_BUFFER_AMOUNT
+        end = maya.cmds.playbackOptions(q=True, aet=True) + self.PREROLL_BUFFER_AMOUNT
+
+        return smc_cost.get_model(smc_export_history.ABC_CACHE).predict(
+            int(self.polygon_count * quality.decimation), self.deformer_count, quality.sample_count(start, end),
+            asset=self.namespace)
+
     def update_ns(self):
 
         maya.cmds.lockNode(self._reference_node, l=False)
@@ -81,29 +149,36 @@ class RefWrapper():
         if maya.cmds.referenceQuery(self.reference_node, il=True):
             namespace = ":".join(maya.cmds.referenceQuery(self._reference_node, nodes=True)[0].split(":")[:-1])
         else:
-            logging.info("TEMPORARY LOADING REF %s" % self.reference_node)
-            maya.cmds.file(lr=self.reference_node)
+            log.info("TEMPORARY LOADING REF %s", self.reference_node)
+            with smc_trace.span("load_reference", rfn=self.reference_node):
+                maya.cmds.file(lr=self.reference_node)
             namespace = ":".join(maya.cmds.referenceQuery(self._reference_node, nodes=True)[0].split(":")[:-1])
-            maya.cmds.file(unloadReference=self.reference_node)
+            with smc_trace.span("unload_reference", rfn=self.reference_node):
+                maya.cmds.file(unloadReference=self.reference_node)
 
         maya.cmds.lockNode(self._reference_node, l=True)
         self._cached_ns = namespace
         self._dirty_ns = False
         return namespace
 
-    def new_namespace(self, new_namespace=""):
+    def set_cached_namespace(self, namespace):
+        """Stores a namespace known to be current, so it is not queried (or the reference loaded) again"""
 
-        if not new_namespace:
-            new_namespace = os.path.basename(self.file).split(".")[0]
+        maya.cmds.lockNode(self._reference_node, l=False)
+        maya.cmds.setAttr(self._reference_node + ".cached_namespace", namespace, type="string")
+        maya.cmds.lockNode(self._reference_node, l=True)
 
-        if new_namespace == self.namespace:
-            return
+        self._cached_ns = namespace
+        self._dirty_ns = False
 
-        if not maya.cmds.referenceQuery(self.reference_node, il=True):
-            maya.cmds.file(self.file, lr=True)
+    def new_namespace(self, new_namespace=""):
+        """
+        Renames the reference namespace, to its file name by default, without loading it.
+        Use smc_namespaces.normalize_namespaces to rename many references at once.
+        """
 
-        maya.cmds.file(self.file, r=True, sns=(self.namespace, new_namespace))
-        maya.cmds.file(self.file, lr=True)
+        plan = smc_namespaces.normalize_namespaces([self], {self.reference_node: new_namespace})
+        return plan.renamed[0].new if plan.renamed else None
 
     @property
     def cache_folder(self):
@@ -115,58 +190,151 @@ class RefWrapper():
 
         return os.path.join(shot_folder, "cache")
 
-    def export_cache(self):
+    def cache_path(self, quality=smc_quality.FINAL):
 
-        PREROLL_BUFFER_AMOUNT = 5
+        if quality.is_final:
+            return os.path.join(self.cache_folder, "%s.geo.abc" % self.namespace)
 
-        if self.file.endswith(".abc"):
-            return
+        return os.path.join(self.cache_folder, "%s.%s.geo.abc" % (self.namespace, quality.tag))
 
-        if not self.file:
-            return
+    @property
+    def cache_quality(self):
+        """QualityProfile of the last export_cache"""
+
+        try:
+            return smc_quality.QualityProfile.from_json(
+                maya.cmds.getAttr("%s.cache_quality" % self._reference_node))
+        except ValueError:
+            return smc_quality.FINAL
 
-        if "/sets/" in self.file.replace("\\", "/"):
+    @cache_quality.setter
+    def cache_quality(self, quality):
+
+        maya.cmds.lockNode(self._reference_node, l=False)
+
+        try:
+            maya.cmds.getAttr("%s.cache_quality" % self._reference_node)
+        except ValueError:
+            maya.cmds.addAttr(self._reference_node, longName="cache_quality", dataType="string")
+
+        maya.cmds.setAttr(self._reference_node + ".cache_quality", quality.to_json(), type="string")
+        maya.cmds.lockNode(self._reference_node, l=True)
+
+    @smc_trace.traced()
+    def export_cache(self, quality=None, job=None):
+        """
+        Exports the reference as an alembic to the shot cache folder at quality (smc_quality.QualityProfile,
+        FINAL by default) and its materials if the profile keeps them.
+        Runs as job of the export journal (a new one by default), so a crash does not lose track of it.
+        """
+
+        quality = quality or smc_quality.FINAL
+
+        if not self.cacheable:
+            # Queued by the caller, it would stay unfinished
+            if job is not None:
+                smc_journal.get_journal().fail(job, "%s can't be cached" % self.reference_node)
             return
 
         self.update_ns()
 
-        export_path = os.path.join(self.cache_folder, "%s.geo.abc" % self.namespace)
+        export_path = self.cache_path(quality)
         try:
             rfn = maya.cmds.referenceQuery(export_path, rfn=True)
-            maya.cmds.file(unloadReference=rfn)
+            with smc_trace.span("unload_reference", rfn=rfn):
+                maya.cmds.file(unloadReference=rfn)
         except Exception as e:
-            print(e)
+            log.debug(e)
 
-        start_frame = 101
+        start_frame = self.CACHE_START_FRAME
         end_frame = maya.cmds.playbackOptions(q=True, aet=True)
 
-        start = start_frame - PREROLL_BUFFER_AMOUNT
-        end = end_frame + PREROLL_BUFFER_AMOUNT
+        start = start_frame - self.PREROLL_BUFFER_AMOUNT
+        end = end_frame + self.PREROLL_BUFFER_AMOUNT
 
-        rfn = maya.cmds.file(lr=self.reference_node)
-        root = maya.cmds.referenceQuery(self.reference_node, nodes=True)[0]
+        journal = smc_journal.get_journal()
+        if job is None:
+            job = journal.queue(smc_export_history.ABC_CACHE, maya.cmds.file(q=True, sn=True), [self.reference_node],
+                                start_frame, end_frame, quality.to_json(), dir=self.cache_folder)
+        # The materials are outputs of the job too, it is only done once they are transferred
+        journal.start(job, outputs=[export_path] + (list(self.mats_paths()) if quality.materials else []))
+        # Scratch copies are kept until journaled, so a crash mid transfer recovers from them
+        callback = journal.transfer_callback(job, drop_scratch=True)
 
-        command = "-frameRange " + str(start) + " " + str(
-            end) + " -uvWrite -writeVisibility -worldSpace -root " + root + " -file " + export_path
+        try:
+            local_path = self._export_abc(quality, export_path, start, end)
+            transfers = {export_path: smc_transfer.get_queue().submit(local_path, export_path, keep_source=True,
+                                                                          callback=callback)}
+            self.cache_quality = quality
 
-        maya.cmds.loadPlugin("AbcExport.mll")
-        print(command)
-        maya.cmds.AbcExport(j=command)
+            if quality.materials:
+                self.export_mats(callback=callback, keep_source=True)
+                transfers.update(self._mats_transfers)
 
-        self.export_mats()
+        except Exception as e:
+            journal.fail(job, e)
+            raise
+
+        journal.exported(job, transfers)
 
         maya.cmds.namespace(set=":")
 
         return export_path
 
-    def cache_reference(self):
+    def _export_abc(self, quality, export_path, start, end):
+        """AbcExport of the reference to the scratch path of export_path, returns the scratch path"""
+
+        export_start_time = time.perf_counter()
+
+        with smc_trace.span("load_reference", rfn=self.reference_node):
+            rfn = maya.cmds.file(lr=self.reference_node)
+        root = maya.cmds.referenceQuery(self.reference_node, nodes=True)[0]
+
+        # Export to local scratch, the transfer queue moves it to the cache folder
+        transfer_queue = smc_transfer.get_queue()
+        local_path = transfer_queue.scratch_path(export_path)
+
+        command = "-frameRange " + str(start) + " " + str(
+            end) + " " + (quality.abc_flags() + " " if quality.abc_flags() else "") + \
+            "-uvWrite -writeVisibility -worldSpace -root " + root + " -file " + local_path
+
+        meshes = []
+        if quality.decimation < 1.0:
+            meshes = maya.cmds.ls(maya.cmds.referenceQuery(self.reference_node, nodes=True, dp=True),
+                                  type="mesh", noIntermediate=True)
+
+        maya.cmds.loadPlugin("AbcExport.mll")
+        log.info("ABC EXPORT %s", command)
+        with smc_quality.decimated(meshes, quality.decimation):
+            maya.cmds.AbcExport(j=command)
+
+        smc_export_history.get_history().record(
+            smc_export_history.ABC_CACHE, self.namespace,
+            scene=maya.cmds.file(q=True, sn=True),
+            path=export_path,
+            frames=quality.sample_count(start, end),
+            polygons=int(self.polygon_count * quality.decimation),
+            deformers=self.deformer_count,
+            flags=re.sub(" -root .*$", "", command),
+            duration=time.perf_counter() - export_start_time,
+            output_bytes=os.path.getsize(local_path) if os.path.exists(local_path) else None)
+
+        return local_path
+
+    @smc_trace.traced()
+    def cache_reference(self, quality=None):
+
+        export_path = self.export_cache(quality)
+        if not export_path:
+            return
 
-        export_path = self.export_cache()
+        smc_transfer.get_queue().wait(export_path)
 
         try:
             cache_ref = maya.cmds.referenceQuery(export_path, rfn=True)
         except Exception:
-            cache_ref = maya.cmds.file(export_path, r=True, ns=self.namespace + "_cache")
+            with smc_trace.span("create_reference", file=export_path):
+                cache_ref = maya.cmds.file(export_path, r=True, ns=self.namespace + "_cache")
 
         # SMOOTH ABC
         nodes = maya.cmds.referenceQuery(cache_ref, nodes=True, dp=True)
@@ -180,7 +348,47 @@ class RefWrapper():
         if nodes:
             maya.cmds.parent(nodes[0], "|__CACHES__")
 
-    def export_mats(self):
+    def upgrade_cache(self):
+        """
+        Exports a preview cache again at final quality and points its cache reference at the final file
+        """
+
+        quality = self.cache_quality
+        if quality.is_final:
+            return
+
+        try:
+            cache_ref = maya.cmds.referenceQuery(self.cache_path(quality), rfn=True)
+        except RuntimeError:
+            cache_ref = None
+
+        export_path = self.export_cache(smc_quality.FINAL)
+        if not export_path:
+            return
+
+        smc_transfer.get_queue().wait(export_path)
+
+        if cache_ref:
+            with smc_trace.span("load_reference", rfn=cache_ref):
+                maya.cmds.file(export_path, loadReference=cache_ref)
+
+        return export_path
+
+    def mats_paths(self):
+        """Final paths of the materials export_mats writes: maya binary, maya ascii and serialized json"""
+
+        mats_file_path = os.path.join(self.cache_folder, self.namespace.replace("_cache", "") + "_mats.mb")
+
+        return (mats_file_path,
+                mats_file_path.replace(".mb", ".ma"),
+                os.path.join(self.cache_folder, self.namespace.replace("_cache", "") + "_matsSerialized.json"))
+
+    @smc_trace.traced()
+    def export_mats(self, callback=None, keep_source=False):
+        """
+        Exports the materials of the reference next to its cache. callback and keep_source are passed to
+        their transfers
+        """
 
         if self.file.endswith(".abc"):
             return
@@ -263,18 +471,19 @@ class RefWrapper():
                     mats_to_export.append(attr_mat)
                     mat_data_list.append(mat_data(attr_mat, se, '.%s' % attr))
 
-                    print("%s USED IN " % attr.upper() + se)
+                    log.debug("%s USED IN %s", attr.upper(), se)
                 except Exception as e:
                     # print("NO %s USED IN " % attr.upper() + se)
                     pass
 
         # PATH CREATION
 
-        mats_file_exportPath = os.path.join(self.cache_folder,
-                                            self.namespace.replace("_cache", "") + "_mats.mb")
+        mats_file_exportPath, mats_ma_exportPath, mats_json_exportPath = self.mats_paths()
 
-        mats_json_exportPath = os.path.join(self.cache_folder,
-                                            self.namespace.replace("_cache", "") + "_matsSerialized.json")
+        transfer_queue = smc_transfer.get_queue()
+        local_mb_path = transfer_queue.scratch_path(mats_file_exportPath)
+        local_ma_path = transfer_queue.scratch_path(mats_ma_exportPath)
+        local_json_path = transfer_queue.scratch_path(mats_json_exportPath)
 
         ##EXPORT MAYA FILE
 
@@ -284,19 +493,25 @@ class RefWrapper():
         for x in maya.cmds.ls(type="unknown"):
             maya.cmds.delete(x)
 
-        maya.cmds.file(mats_file_exportPath, es=True, f=True, type='mayaBinary')
-        maya.cmds.file(mats_file_exportPath.replace(".mb", ".ma"), es=True, f=True, type='mayaAscii')
+        maya.cmds.file(local_mb_path, es=True, f=True, type='mayaBinary')
+        maya.cmds.file(local_ma_path, es=True, f=True, type='mayaAscii')
 
         # EXPORT JSON
-        with open(mats_json_exportPath, 'w') as outfile:
+        with open(local_json_path, 'w') as outfile:
             json.dump({"materials": [mat.toJSON() for mat in mat_data_list]}, outfile, sort_keys=True, indent=4)
 
+        self._mats_transfers = {
+            path: transfer_queue.submit(local_path, path, keep_source=keep_source, callback=callback)
+            for local_path, path in ((local_mb_path, mats_file_exportPath), (local_ma_path, mats_ma_exportPath),
+                                     (local_json_path, mats_json_exportPath))}
+
         self._mats_file = mats_file_exportPath
         self._mats_json = mats_json_exportPath
         self._mat_data_list = mat_data_list
 
         return mats_file_exportPath, mat_data_list
 
+    @smc_trace.traced()
     def apply_mats(self):
 
         if not self.file.endswith(".abc"):
@@ -305,15 +520,21 @@ class RefWrapper():
         if not self.namespace:
             return
 
-        maya.cmds.file(lr=self.reference_node)
+        with smc_trace.span("load_reference", rfn=self.reference_node):
+            maya.cmds.file(lr=self.reference_node)
         maya_file_import_path = os.path.join(self.cache_folder,
                                              self.namespace.replace("_cache", "") + "_mats.mb")
 
         json_se_file_import_path = os.path.join(self.cache_folder,
                                                 self.namespace.replace("_cache", "") + "_matsSerialized.json")
 
-        print(maya_file_import_path)
-        print(json_se_file_import_path)
+        log.debug(maya_file_import_path)
+        log.debug(json_se_file_import_path)
+
+        # Materials may still be on their way from scratch
+        transfer_queue = smc_transfer.get_queue()
+        transfer_queue.wait(maya_file_import_path)
+        transfer_queue.wait(json_se_file_import_path)
 
         if not os.path.exists(maya_file_import_path):
             return
@@ -328,8 +549,7 @@ class RefWrapper():
                 for selectable in material["SE_faceSets"]:
                     selectable_no_ns = re.sub("^[^:]*", "", selectable)
 
-                    print(self.namespace)
-                    print(selectable_no_ns)
+                    log.debug("%s%s", self.namespace, selectable_no_ns)
 
                     try:
                         maya.cmds.select("%s%s" % (self.namespace, selectable_no_ns))
@@ -339,7 +559,6 @@ class RefWrapper():
                         maya.cmds.sets(fe=ns + ":" + material["SE_name"], e=True)
                     except Exception as e:
                         failures.append(e)
-                        print(e)
 
         for x in failures:
-            print("FAILED :::::: %s" % str(x))
+            log.warning("FAILED :::::: %s", x)
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import shutil
+import socket
+import hashlib
+import logging
+
+__all__ = ["SharedStore", "StoreLockTimeout"]
+
+log = logging.getLogger(__name__)
+
+
+class StoreLockTimeout(RuntimeError):
+    pass
+
+
+class SharedStore():
+    """
+    Content addressed cache store on a shared directory.
+
+    Caches are stored under the hash of their inputs and linked into each user's work directory,
+    so identical requests from different artists are exported once. Writers take a lock file per key
+    and publish with an atomic rename, readers never see partial files.
+    """
+
+    STALE_LOCK_SECONDS = 60 * 60
+    LOCK_TIMEOUT_SECONDS = 15 * 60
+    POLL_SECONDS = 2
+
+    def __init__(self, root):
+        self.root = root
+
+    def __repr__(self):
+        return "<SharedStore %s>" % self.root
+
+    @staticmethod
+    def key(inputs):
+        """Hash of a json serializable dict of everything the cache content depends on"""
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key, ext=".abc"):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def _lock_path(self, key):
+        return self.path(key, ext=".lock")
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def fetch(self, key, dest):
+        """Links the stored cache for key to dest. False if the store does not have it"""
+
+        if not self.has(key):
+            return False
+
+        self.link(self.path(key), dest)
+        log.info("Served %s from shared store %s", dest, key)
+        return True
+
+    @staticmethod
+    def link(src, dest):
+        """Hard links src to dest, falls back to a symlink and then to a copy"""
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_dest = os.path.join(os.path.dirname(dest), ".%s.%i.link" % (os.path.basename(dest), os.getpid()))
+
+        try:
+            os.link(src, tmp_dest)
+        except OSError:
+            try:
+                os.symlink(src, tmp_dest)
+            except OSError:
+                shutil.copyfile(src, tmp_dest)
+
+        os.replace(tmp_dest, dest)
+
+    def acquire(self, key, timeout=LOCK_TIMEOUT_SECONDS):
+        """
+        Takes the write lock for key, waiting up to timeout seconds for other writers (0 does not wait).
+        True if the caller owns the lock and must publish, False if key was published while waiting.
+        """
+
+        lock_path = self._lock_path(key)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+        start = time.time()
+
+        while True:
+
+            if self.has(key):
+                return False
+
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, "w") as lock_file:
+                    json.dump({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, lock_file)
+                return True
+
+            try:
+                if time.time() - os.path.getmtime(lock_path) > self.STALE_LOCK_SECONDS:
+                    log.warning("Breaking stale lock %s", lock_path)
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                # Released meanwhile
+                continue
+
+            if timeout is not None and time.time() - start >= timeout:
+                raise StoreLockTimeout("Timed out waiting for %s" % lock_path)
+
+            time.sleep(self.POLL_SECONDS)
+
+    def release(self, key):
+
+        try:
+            os.remove(self._lock_path(key))
+        except OSError:
+            pass
+
+    def publish(self, key, src, transfer_queue=None):
+        """
+        Publishes src under key and releases its lock, which the caller must own.
+        Goes through transfer_queue (in the background) if given. A failed copy publishes nothing,
+        the lock is released so a waiting writer exports it instead.
+        """
+
+        if transfer_queue:
+            transfer_queue.submit(src, self.path(key), keep_source=True, callback=lambda transfer: self._published(
+                key, transfer.src, transfer.state == transfer.DONE, transfer.error))
+            return
+
+        dest = self.path(key)
+        tmp_dest = os.path.join(os.path.dirname(dest), ".%s.%i.part" % (os.path.basename(dest), os.getpid()))
+
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(src, tmp_dest)
+            os.replace(tmp_dest, dest)
+        except OSError as e:
+            try:
+                os.remove(tmp_dest)
+            except OSError:
+                pass
+            self._published(key, src, False, e)
+            raise
+
+        self._published(key, src, True)
+
+    def _published(self, key, src, done, error=None):
+
+        if done:
+            log.info("Published %s to shared store %s", src, key)
+        else:
+            log.warning("Could not publish %s to shared store %s: %s", src, key, error)
+
+        self.release(key)
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+
+__all__ = ["enable", "disable", "is_enabled", "span", "traced", "events", "clear", "summary",
+           "export_chrome_trace"]
+
+log = logging.getLogger(__name__)
+
+_enabled = False
+_events = []
+_events_lock = threading.Lock()
+
+_maya_calls = 0
+_patched = {}
+
+
+class _NullSpan():
+    """Returned by span() while tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span():
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._start_calls = _maya_calls
+        return self
+
+    def __exit__(self, *args):
+
+        end = time.perf_counter()
+        event = {"name": self.name,
+                 "ph": "X",
+                 "ts": self._start * 1e6,
+                 "dur": (end - self._start) * 1e6,
+                 "pid": os.getpid(),
+                 "tid": threading.get_ident(),
+                 "args": dict(self.args, maya_calls=_maya_calls - self._start_calls)}
+
+        with _events_lock:
+            _events.append(event)
+
+        log.debug("%s took %.3fs, %i maya calls", self.name, end - self._start, event["args"]["maya_calls"])
+        return False
+
+
+def _counting(func):
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _maya_calls
+        _maya_calls += 1
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _patch_maya():
+
+    try:
+        import maya.cmds
+        import maya.mel
+    except ImportError:
+        return
+
+    for module in (maya.cmds, maya.mel):
+        for name in dir(module):
+            if name.startswith("_"):
+                continue
+
+            func = getattr(module, name)
+            if not callable(func) or isinstance(func, type):
+                continue
+
+            _patched[(module, name)] = func
+            setattr(module, name, _counting(func))
+
+
+def _unpatch_maya():
+
+    for (module, name), func in _patched.items():
+        setattr(module, name, func)
+
+    _patched.clear()
+
+
+def enable():
+    """Starts recording spans and counting maya.cmds / maya.mel calls"""
+
+    global _enabled
+
+    if _enabled:
+        return
+
+    _patch_maya()
+    _enabled = True
+
+
+def disable():
+
+    global _enabled
+
+    _unpatch_maya()
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(name, **args):
+    """
+    Context manager timing a block. Near free while tracing is disabled.
+
+    with smc_trace.span("fill_table", rows=10):
+        ...
+    """
+
+    if not _enabled:
+        return _NULL_SPAN
+
+    return _Span(name, args)
+
+
+def traced(name=None):
+    """Decorator wrapping each call of the function in a span"""
+
+    def decorator(func):
+
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            with _Span(label, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def events():
+    with _events_lock:
+        return list(_events)
+
+
+def clear():
+
+    global _maya_calls
+
+    with _events_lock:
+        del _events[:]
+
+    _maya_calls = 0
+
+
+def summary():
+    """{span name: {"count", "total", "max", "maya_calls"}} with times in seconds"""
+
+    result = {}
+
+    for event in events():
+        entry = result.setdefault(event["name"], {"count": 0, "total": 0.0, "max": 0.0, "maya_calls": 0})
+        entry["count"] += 1
+        entry["total"] += event["dur"] / 1e6
+        entry["max"] = max(entry["max"], event["dur"] / 1e6)
+        entry["maya_calls"] += event["args"]["maya_calls"]
+
+    return result
+
+
+def export_chrome_trace(path):
+    """Writes the recorded spans as a Chrome trace (chrome://tracing, Perfetto) json file"""
+
+    with open(path, "w") as outfile:
+        json.dump({"traceEvents": events(), "displayTimeUnit": "ms"}, outfile)
+
+    return path
+
+
+if os.environ.get("SMC_TRACE", "0") == "1":
+    enable()
@@ -0,0 +1,240 @@
+import os
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["TransferQueue", "get_queue", "is_local"]
+
+log = logging.getLogger(__name__)
+
+SCRATCH_DIR = os.environ.get("SMC_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "a_smcScratch"))
+MAX_WORKERS = 2
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def checksum(path):
+    """Returns the sha1 hex digest of path"""
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def is_local(path):
+    """True if path lives under the local temp dir (or the scratch dir)"""
+
+    path = os.path.abspath(path)
+
+    for local_root in (tempfile.gettempdir(), SCRATCH_DIR):
+        local_root = os.path.abspath(local_root)
+        try:
+            if os.path.commonpath([path, local_root]) == local_root:
+                return True
+        except ValueError:
+            # Different drives on windows
+            continue
+
+    return False
+
+
+class Transfer():
+    """
+    One scratch -> final file move
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, src, dst, keep_source=False, callback=None):
+        self.src = src
+        self.dst = dst
+        self.keep_source = keep_source
+        self.callback = callback
+        self.state = self.PENDING
+        self.error = None
+        self.checksum = ""
+        self.future = None
+
+    def __repr__(self):
+        return "<Transfer %s %s -> %s>" % (self.state, self.src, self.dst)
+
+
+class TransferQueue():
+    """
+    Moves files written to local scratch to their final folder in background threads.
+
+    Files are copied next to the destination under a temporary name, verified against the
+    source checksum and then renamed into place, so readers never see a half-written file.
+    """
+
+    def __init__(self, scratch_dir=SCRATCH_DIR, max_workers=MAX_WORKERS):
+
+        self.scratch_dir = scratch_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="smc_transfer")
+
+        self._lock = threading.Lock()
+        self._dst_locks = {}
+        self._transfers = {}
+
+    def scratch_path(self, final_path):
+        """Local path to write final_path to before transferring it. final_path itself if it is already local"""
+
+        if is_local(final_path):
+            return final_path
+
+        folder_hash = hashlib.sha1(os.path.dirname(os.path.abspath(final_path)).encode("utf-8")).hexdigest()[:8]
+        scratch_folder = os.path.join(self.scratch_dir, folder_hash)
+        os.makedirs(scratch_folder, exist_ok=True)
+
+        return os.path.join(scratch_folder, os.path.basename(final_path))
+
+    def submit(self, src, dst, keep_source=False, callback=None):
+        """
+        Queues src to be moved to dst. Returns the Transfer, or None if there is nothing to move.
+        callback(transfer) is called from the worker thread once the transfer is done or failed.
+        """
+
+        if os.path.abspath(src) == os.path.abspath(dst):
+            return None
+
+        transfer = Transfer(src, dst, keep_source=keep_source, callback=callback)
+
+        with self._lock:
+            dst_lock = self._dst_locks.setdefault(os.path.abspath(dst), threading.Lock())
+            # Listed with its future, wait() can rely on it
+            transfer.future = self._executor.submit(self._run, transfer, dst_lock)
+            self._transfers[os.path.abspath(dst)] = transfer
+        log.info("Queued transfer %s -> %s", src, dst)
+
+        return transfer
+
+    def _run(self, transfer, dst_lock):
+
+        with dst_lock:
+            transfer.state = Transfer.RUNNING
+            tmp_path = os.path.join(os.path.dirname(transfer.dst),
+                                    ".%s.%i.part" % (os.path.basename(transfer.dst), os.getpid()))
+            try:
+                os.makedirs(os.path.dirname(transfer.dst), exist_ok=True)
+
+                src_checksum = checksum(transfer.src)
+                shutil.copyfile(transfer.src, tmp_path)
+
+                if checksum(tmp_path) != src_checksum:
+                    raise IOError("Checksum mismatch transferring %s" % transfer.src)
+
+                os.replace(tmp_path, transfer.dst)
+
+                if not transfer.keep_source:
+                    os.remove(transfer.src)
+
+                transfer.checksum = src_checksum
+                transfer.state = Transfer.DONE
+                log.info("Transferred %s", transfer.dst)
+
+            except Exception as e:
+                transfer.error = e
+                transfer.state = Transfer.FAILED
+                log.error("Transfer of %s failed: %s", transfer.dst, e)
+
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+        if transfer.callback:
+            try:
+                transfer.callback(transfer)
+            except Exception as e:
+                log.error("Transfer callback for %s failed: %s", transfer.dst, e)
+
+        return transfer
+
+    @property
+    def transfers(self):
+        with self._lock:
+            return list(self._transfers.values())
+
+    @property
+    def pending(self):
+        """Transfers not finished yet"""
+        return [t for t in self.transfers if t.state in (Transfer.PENDING, Transfer.RUNNING)]
+
+    @property
+    def failed(self):
+        return [t for t in self.transfers if t.state == Transfer.FAILED]
+
+    def get(self, dst):
+        with self._lock:
+            return self._transfers.get(os.path.abspath(dst))
+
+    def is_pending(self, dst):
+        transfer = self.get(dst)
+        return bool(transfer) and transfer.state in (Transfer.PENDING, Transfer.RUNNING)
+
+    def resolve(self, dst):
+        """Path that currently holds the data of dst: the scratch file while its transfer is pending"""
+
+        transfer = self.get(dst)
+        if transfer and transfer.state != Transfer.DONE and os.path.exists(transfer.src):
+            return transfer.src
+
+        return dst
+
+    def wait(self, dst=None, timeout=None):
+        """
+        Blocks until dst (or every queued transfer, with the ones queued by their callbacks) has finished.
+        Returns the finished transfers
+        """
+
+        if dst:
+            transfer = self.get(dst)
+            transfers = [transfer] if transfer else []
+            for transfer in transfers:
+                transfer.future.result(timeout=timeout)
+
+            return transfers
+
+        # Transfers are done before their callbacks return, the futures once they have
+        running = [transfer for transfer in self.transfers if not transfer.future.done()]
+        while running:
+            for transfer in running:
+                transfer.future.result(timeout=timeout)
+            running = [transfer for transfer in self.transfers if not transfer.future.done()]
+
+        return self.transfers
+
+    def clear_finished(self, transfers=None):
+        """Forgets finished transfers (only the given ones if transfers is passed)"""
+
+        with self._lock:
+            for dst, transfer in list(self._transfers.items()):
+                if transfer.state != Transfer.DONE:
+                    continue
+                if transfers is not None and transfer not in transfers:
+                    continue
+                del self._transfers[dst]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Shared TransferQueue for the maya session"""
+
+    global _queue
+
+    with _queue_lock:
+        if _queue is None:
+            _queue = TransferQueue()
+
+    return _queue
@@ -0,0 +1,284 @@
+import math
+import logging
+import contextlib
+
+import maya.cmds as cmds
+
+import smc_transfer
+import smc_cache_gc
+import smc_trace
+import smc_lod
+
+__all__ = ["render_camera", "Frustum", "visible_caches", "plan_states", "StateChanges", "apply_states",
+           "AutoEnabler"]
+
+log = logging.getLogger(__name__)
+
+# Frames between bounding box samples over the playback range
+DEFAULT_STRIDE = 5
+# Field of view grown by this fraction, so references entering at the frame edge between samples count
+FRUSTUM_MARGIN = 0.1
+
+
+def render_camera():
+    """Transform of the first renderable non startup camera, the active view camera if there is none"""
+
+    for camera in cmds.ls(type="camera") or []:
+        try:
+            if cmds.getAttr(camera + ".renderable") and not cmds.camera(camera, q=True, startupCamera=True):
+                return (cmds.listRelatives(camera, parent=True) or [camera])[0]
+        except (RuntimeError, ValueError) as e:
+            log.debug("%s: %s", camera, e)
+
+    return smc_lod.active_camera()
+
+
+def _normalized(vector):
+    length = math.sqrt(sum(c * c for c in vector)) or 1.0
+    return [c / length for c in vector]
+
+
+class Frustum():
+    """View volume of a camera at the current frame, as inward facing world space planes"""
+
+    def __init__(self, camera, margin=FRUSTUM_MARGIN):
+
+        matrix = cmds.xform(camera, q=True, ws=True, matrix=True)
+        axes = [_normalized(matrix[0:3]), _normalized(matrix[4:7]), _normalized(matrix[8:11])]
+        self.position = matrix[12:15]
+
+        near = cmds.camera(camera, q=True, nearClipPlane=True)
+        far = cmds.camera(camera, q=True, farClipPlane=True)
+
+        # Camera space (normal, offset), inside when normal . (point - position) + offset >= 0. Cameras look down -Z
+        planes = [((0, 0, -1), -near), ((0, 0, 1), far)]
+
+        if cmds.camera(camera, q=True, orthographic=True):
+            half_width = cmds.camera(camera, q=True, orthoWidth=True) / 2 * (1 + margin)
+            half_height = half_width * self._tan_half_fov(camera, "verticalFieldOfView") / \
+                          self._tan_half_fov(camera, "horizontalFieldOfView")
+            planes += [((1, 0, 0), half_width), ((-1, 0, 0), half_width),
+                       ((0, 1, 0), half_height), ((0, -1, 0), half_height)]
+        else:
+            tan_h = self._tan_half_fov(camera, "horizontalFieldOfView") * (1 + margin)
+            tan_v = self._tan_half_fov(camera, "verticalFieldOfView") * (1 + margin)
+            planes += [((1, 0, -tan_h), 0.0), ((-1, 0, -tan_h), 0.0),
+                       ((0, 1, -tan_v), 0.0), ((0, -1, -tan_v), 0.0)]
+
+        self.planes = []
+        for normal, offset in planes:
+            world_normal = [sum(normal[k] * axes[k][i] for k in range(3)) for i in range(3)]
+            self.planes.append((world_normal, offset))
+
+    @staticmethod
+    def _tan_half_fov(camera, flag):
+        return math.tan(math.radians(cmds.camera(camera, q=True, **{flag: True})) / 2)
+
+    def intersects(self, bounding_box):
+        """If a world bounding box (xmin, ymin, zmin, xmax, ymax, zmax) is at least partly inside"""
+
+        box_min, box_max = bounding_box[:3], bounding_box[3:]
+
+        for normal, offset in self.planes:
+            # Box corner furthest along the normal
+            corner = [box_max[i] if normal[i] >= 0 else box_min[i] for i in range(3)]
+            if sum(n * (c - p) for n, c, p in zip(normal, corner, self.position)) + offset < 0:
+                return False
+
+        return True
+
+
+def _targets(cache, rfns):
+    """Nodes whose bounding box stands for a cache: its node when on, else the loaded references"""
+
+    if cmds.getAttr(cache + ".cacheFileName"):
+        return [cache]
+
+    targets = []
+    for rfn in rfns:
+        try:
+            if cmds.referenceQuery(rfn, isLoaded=True):
+                targets += cmds.ls(cmds.referenceQuery(rfn, nodes=True, dagPath=True) or [], assemblies=True)
+        except RuntimeError as e:
+            log.debug("%s: %s", rfn, e)
+
+    return targets
+
+
+@contextlib.contextmanager
+def _suspended_refresh():
+
+    cmds.refresh(suspend=True)
+    try:
+        yield
+    finally:
+        cmds.refresh(suspend=False)
+
+
+@smc_trace.traced("visibility_sample")
+def visible_caches(cache_refs, camera=None, start=None, end=None, stride=DEFAULT_STRIDE, margin=FRUSTUM_MARGIN):
+    """
+    {cache: visible} for cache_refs {cache: reference nodes}, visible when its bounding box is inside
+    the camera (the render camera by default) on any frame sampled every stride frames over start, end
+    (the playback range by default). Caches with nothing to measure are left out.
+    """
+
+    camera = camera or render_camera()
+    start = cmds.playbackOptions(q=True, min=True) if start is None else start
+    end = cmds.playbackOptions(q=True, max=True) if end is None else end
+
+    frames = list(range(int(start), int(end) + 1, max(int(stride), 1)))
+    if frames[-1:] != [int(end)]:
+        frames.append(int(end))
+
+    targets = {cache: _targets(cache, rfns) for cache, rfns in cache_refs.items()}
+    unknown = set(cache for cache, nodes in targets.items() if not nodes)
+    visible = dict.fromkeys(set(cache_refs) - unknown, False)
+
+    current = cmds.currentTime(q=True)
+
+    with _suspended_refresh():
+        try:
+            for frame in frames:
+                # Caches seen once are done, the rest are sampled again
+                remaining = [cache for cache, seen in visible.items() if not seen]
+                if not remaining:
+                    break
+
+                cmds.currentTime(frame, update=True)
+                frustum = Frustum(camera, margin)
+
+                for cache in remaining:
+                    try:
+                        visible[cache] = frustum.intersects(cmds.exactWorldBoundingBox(*targets[cache]))
+                    except (RuntimeError, ValueError) as e:
+                        log.debug("No bounding box for %s: %s", cache, e)
+                        visible.pop(cache)
+        finally:
+            cmds.currentTime(current, update=True)
+
+    return visible
+
+
+def plan_states(visible, cache_refs, animated_rfns=()):
+    """
+    {cache: on} for visible {cache: visible}: caches with a reference selected for animation
+    and on screen show the full rigs, every other cache is on with its references unloaded.
+    """
+
+    animated_rfns = set(animated_rfns)
+
+    return {cache: not (is_visible and animated_rfns.intersection(cache_refs[cache]))
+            for cache, is_visible in visible.items()}
+
+
+class StateChanges():
+    """Caches and references apply_states switched, and the number of caches already in their state"""
+
+    def __init__(self):
+        self.caches_on = []
+        self.caches_off = []
+        self.unloaded = []
+        self.loaded = []
+        self.skipped = 0
+
+    def __bool__(self):
+        return bool(self.caches_on or self.caches_off)
+
+    def __repr__(self):
+        return "StateChanges(%i caches on, %i off, %i unloaded, %i loaded, %i skipped)" % (
+            len(self.caches_on), len(self.caches_off), len(self.unloaded), len(self.loaded), self.skipped)
+
+
+@smc_trace.traced("apply_reference_states")
+def apply_states(states, cache_refs):
+    """
+    Turns caches on or off per states {cache: on} in one batch: every reference going behind a cache is
+    unloaded first, then the caches are switched, then the references coming back are loaded, with
+    the viewport suspended and as a single undo step. References already in their state are not touched.
+    """
+
+    changes = StateChanges()
+    transfer_queue = smc_transfer.get_queue()
+
+    for cache, on in states.items():
+        if bool(cmds.getAttr(cache + ".cacheFileName")) == on:
+            changes.skipped += 1
+            continue
+
+        (changes.caches_on if on else changes.caches_off).append(cache)
+
+    if not changes:
+        return changes
+
+    def loaded(rfn):
+        try:
+            return cmds.referenceQuery(rfn, isLoaded=True)
+        except RuntimeError:
+            return None
+
+    to_unload = [rfn for cache in changes.caches_on for rfn in cache_refs[cache] if loaded(rfn)]
+    to_load = [rfn for cache in changes.caches_off for rfn in cache_refs[cache] if loaded(rfn) is False]
+
+    cmds.undoInfo(openChunk=True, chunkName="smc_visibility")
+    try:
+        with _suspended_refresh():
+            # Unloads before loads, so the memory of the hidden rigs is free for the ones coming back
+            for rfn in to_unload:
+                with smc_trace.span("unload_reference", rfn=rfn):
+                    cmds.file(unloadReference=rfn)
+                changes.unloaded.append(rfn)
+
+            for cache in changes.caches_on:
+                stored_path = cmds.getAttr(cache + ".storedPath")
+                cmds.setAttr(cache + ".cacheFileName", transfer_queue.resolve(stored_path), type="string")
+                smc_cache_gc.touch(stored_path)
+
+            for cache in changes.caches_off:
+                cmds.setAttr(cache + ".cacheFileName", "", type="string")
+
+            for rfn in to_load:
+                with smc_trace.span("load_reference", rfn=rfn):
+                    cmds.file(loadReference=rfn)
+                changes.loaded.append(rfn)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+    log.info("Applied %r", changes)
+    return changes
+
+
+class AutoEnabler():
+    """
+    Keeps off screen caches on and their references unloaded, and loads the full rigs of on screen
+    references selected for animation. Visibility is sampled once per camera, range and caches,
+    so changing the animated references only re-plans.
+    """
+
+    def __init__(self, stride=DEFAULT_STRIDE, margin=FRUSTUM_MARGIN):
+
+        self.stride = stride
+        self.margin = margin
+        self._visible = {}
+        self._key = None
+
+    def invalidate(self):
+        self._key = None
+
+    def visibility(self, cache_refs, camera=None, refresh=False):
+
+        camera = camera or render_camera()
+        key = (camera, cmds.playbackOptions(q=True, min=True), cmds.playbackOptions(q=True, max=True),
+               self.stride, tuple(sorted(cache_refs)))
+
+        if refresh or key != self._key:
+            self._visible = visible_caches(cache_refs, camera, stride=self.stride, margin=self.margin)
+            self._key = key
+
+        return self._visible
+
+    def update(self, cache_refs, animated_rfns=(), camera=None, refresh=False):
+        """Applies the states of cache_refs {cache: reference nodes}, returns the StateChanges"""
+
+        visible = self.visibility(cache_refs, camera, refresh)
+        return apply_states(plan_states(visible, cache_refs, animated_rfns), cache_refs)
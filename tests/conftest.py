@@ -0,0 +1,50 @@
+"""
+Runs the smc modules on the in-memory maya.cmds and PySide2 stand-ins of benchmarks/, no Maya needed.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, ROOT)
+
+# Keep the session journal, history and scratch files out of the home folder
+TMP_DIR = tempfile.mkdtemp(prefix="smc_tests_")
+os.environ.setdefault("SMC_JOURNAL", os.path.join(TMP_DIR, "export_journal.jsonl"))
+os.environ.setdefault("SMC_HISTORY_DB", os.path.join(TMP_DIR, "export_history.db"))
+os.environ.setdefault("SMC_SCRATCH_DIR", os.path.join(TMP_DIR, "scratch"))
+
+import fake_maya
+import fake_qt
+
+fake_qt.install()
+fake_maya.Scene().install()
+
+
+@pytest.fixture
+def scene(tmp_path):
+    """Empty fake_maya.Scene installed as maya.cmds"""
+
+    scene = fake_maya.Scene(scene_name=str(tmp_path / "shots" / "sh010" / "anim" / "sh010_anim_v001.ma"))
+    scene.install()
+    return scene
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """
+    Makes tmp_path a network folder for smc_transfer.is_local, so exports under it go through scratch.
+    The temp dir moves to tmp_path/local
+    """
+
+    local = tmp_path / "local"
+    local.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(local))
+
+    return tmp_path
@@ -0,0 +1,61 @@
+import struct
+
+import fake_maya
+import smc_alembic
+
+
+def test_read_info(tmp_path):
+
+    path = str(tmp_path / "cache.abc")
+    fake_maya.write_alembic(path, 101, 200)
+
+    info = smc_alembic.read_info(path)
+
+    assert info.valid, info.error
+    assert info.archive_version == 1
+    assert info.library_version == 10709
+    assert info.metadata == {"_ai_Application": "fake_maya"}
+    assert len(info.time_samplings) == 2
+    assert info.frame_range() == (101.0, 200.0)
+
+
+def test_unfinished_archive(tmp_path):
+
+    path = str(tmp_path / "cache.abc")
+    fake_maya.write_alembic(path, 1, 10)
+
+    # Alembic writes the frozen byte last, when the archive is closed
+    with open(path, "r+b") as f:
+        f.seek(5)
+        f.write(b"\x00")
+
+    info = smc_alembic.read_info(path)
+
+    assert not info.valid
+    assert "never closed" in info.error
+
+
+def test_truncated_archive(tmp_path):
+
+    path = str(tmp_path / "cache.abc")
+    fake_maya.write_alembic(path, 1, 10)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+
+    assert not smc_alembic.is_valid(path)
+
+
+def test_not_ogawa(tmp_path):
+
+    path = str(tmp_path / "cache.abc")
+    with open(path, "wb") as f:
+        f.write(b"HDF5" + struct.pack("<Q", 0) * 4)
+
+    info = smc_alembic.read_info(path)
+
+    assert not info.valid
+    assert info.error == "Not an ogawa archive"
+    assert not smc_alembic.is_valid(str(tmp_path / "missing.abc"))
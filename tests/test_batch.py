@@ -0,0 +1,71 @@
+import os
+
+import smc_batch
+import smc_journal
+import smc_export_history
+
+
+def test_select_refs():
+
+    refs = [("chr_bob", 1, "chr_bobRN"), ("prp_cup", 2, "prp_cupRN"), ("set_room", 1, "set_roomRN")]
+
+    assert smc_batch.select_refs(refs) == refs
+    assert smc_batch.select_refs(refs, namespaces=["chr_*", "*cup"]) == refs[:2]
+    assert smc_batch.select_refs(refs, ref_types=["set"]) == refs[2:]
+    assert smc_batch.select_refs(refs, namespaces=["chr_*"], ref_types=["prp"]) == []
+
+
+def test_order_scenes(tmp_path):
+
+    history = smc_export_history.ExportHistory(str(tmp_path / "history.db"))
+    history.record(smc_export_history.GPU_CACHE, "chr_bob", scene="/a.ma", duration=50.0)
+    history.record(smc_export_history.GPU_CACHE, "chr_bob", scene="/b.ma", duration=10.0)
+    history.record(smc_export_history.GPU_CACHE, "chr_bob", scene="/c.ma", duration=30.0)
+    history.record(smc_export_history.TOGGLE, "chr_bob", scene="/c.ma", duration=1000.0)
+
+    assert smc_batch.order_scenes(["/a.ma", "/new.ma", "/b.ma", "/c.ma"], history) == \
+        ["/b.ma", "/new.ma", "/c.ma", "/a.ma"]
+
+
+def add_refs(scene):
+    scene.batch = True
+    return [scene.add_reference("/proj/assets/chr/chr_bob/rig/chr_bob_rig_v001.ma", "chr_bob"),
+            scene.add_reference("/proj/assets/sets/set_room/set_room_v001.ma", "set_room"),
+            scene.add_reference("/proj/assets/prp/prp_cup/prp_cup_v001.abc", "prp_cup")]
+
+
+def test_cache_scene_gpu(scene, remote):
+
+    rfns = add_refs(scene)
+    net = str(remote / "net")
+    code, results = smc_batch.cache_scene(scene.scene_name, smc_batch.BatchOptions(dir=net, save=True))
+
+    assert code == smc_batch.EXIT_OK
+    assert sorted(result["rfn"] for result in results) == sorted(rfns)
+
+    # Turned on once transferred, on the final files, and the scratch copies are gone
+    caches = [node for node in scene.nodes.values() if node.type == "gpuCache"]
+    assert len(caches) == 3
+    for node in caches:
+        assert os.path.dirname(node.attrs["cacheFileName"]) == net
+        assert os.path.exists(node.attrs["cacheFileName"])
+
+    assert not [job for job in smc_journal.get_journal().jobs(scene.scene_name) if job.state != smc_journal.DONE]
+
+
+def test_cache_scene_abc_skips_uncacheable(scene, remote):
+
+    rfns = add_refs(scene)
+    code, results = smc_batch.cache_scene(scene.scene_name, smc_batch.BatchOptions(modes=[smc_batch.ABC]))
+
+    assert code == smc_batch.EXIT_OK
+    assert [result["rfn"] for result in results] == rfns[:1]
+
+    journal = smc_journal.get_journal()
+    (job,) = journal.jobs(scene.scene_name)
+    assert job.state == smc_journal.DONE
+    assert len(job.outputs) == 4
+
+    # Nothing is left queued for the next run
+    code, results = smc_batch.cache_scene(scene.scene_name, smc_batch.BatchOptions(modes=[smc_batch.ABC]))
+    assert [result["resumed"] for result in results] == ["validated"]
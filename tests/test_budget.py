@@ -0,0 +1,102 @@
+import pytest
+
+import smc_budget
+
+MB = 1024.0 ** 2
+
+
+def cost(rfn, rig_mb, cache_mb, rig_ms=0.0, cache_ms=0.0, export_seconds=10.0):
+    return smc_budget.RefCost(rfn, 0, 0, 0, rig_bytes=rig_mb * MB, rig_ms=rig_ms, cache_bytes=cache_mb * MB,
+                              cache_ms=cache_ms, export_seconds=export_seconds)
+
+
+def planner(scene, costs, cache_refs=None, active=()):
+    """BudgetPlanner on given RefCosts, with gpuCache nodes {node: reference nodes} of which active are on"""
+
+    budget_planner = smc_budget.BudgetPlanner({}, [])
+    budget_planner.rfns = [ref_cost.rfn for ref_cost in costs]
+    budget_planner.costs = {ref_cost.rfn: ref_cost for ref_cost in costs}
+    budget_planner.cache_refs = cache_refs or {}
+    budget_planner.active = set(active)
+
+    for cache, rfns in budget_planner.cache_refs.items():
+        for rfn in rfns:
+            budget_planner.ref_caches.setdefault(rfn, []).append(cache)
+
+    return budget_planner
+
+
+def test_largest_savings_first(scene):
+
+    budget_planner = planner(scene, [cost("aRN", 100, 10), cost("bRN", 500, 50), cost("cRN", 300, 30)])
+    plan = budget_planner.plan(500)
+
+    assert budget_planner.usage() == 900 * MB
+    assert [action.rfns for action in plan.actions] == [["bRN"]]
+    assert plan.met
+    assert plan.projected == 450 * MB
+
+
+def test_enable_preferred_on_ties(scene):
+
+    budget_planner = planner(scene, [cost("aRN", 200, 100), cost("bRN", 200, 100)],
+                             cache_refs={"gpuCache_a": ["aRN"]})
+    plan = budget_planner.plan(300)
+
+    assert [(action.kind, action.rfns) for action in plan.actions] == [(smc_budget.ENABLE, ["aRN"])]
+    assert plan.actions[0].cache == "gpuCache_a"
+
+
+def test_budget_not_reachable(scene):
+
+    budget_planner = planner(scene, [cost("aRN", 200, 100)], cache_refs={"gpuCache_a": ["aRN"]},
+                             active=["gpuCache_a"])
+    plan = budget_planner.plan(50)
+
+    assert plan.actions == []
+    assert not plan.met
+    assert "budget not reachable" in plan.summary()
+
+
+def test_shared_references_saved_once(scene):
+
+    budget_planner = planner(scene, [cost("aRN", 0, 0, rig_ms=40.0), cost("bRN", 0, 0, rig_ms=10.0)],
+                             cache_refs={"gpuCache_a": ["aRN"], "gpuCache_ab": ["aRN", "bRN"]})
+    plan = budget_planner.plan(500, smc_budget.FPS)
+
+    # gpuCache_a only adds aRN, already saved by gpuCache_ab
+    assert [action.cache for action in plan.actions] == ["gpuCache_ab"]
+    assert plan.current == pytest.approx(58.0)
+    assert plan.projected == pytest.approx(smc_budget.BASE_FRAME_MS)
+
+
+def test_overlap_saving_recomputed(scene):
+
+    budget_planner = planner(scene, [cost("aRN", 400, 0), cost("bRN", 100, 0), cost("cRN", 300, 0)],
+                             cache_refs={"gpuCache_ab": ["aRN", "bRN"], "gpuCache_ac": ["aRN", "cRN"]})
+    plan = budget_planner.plan(50)
+
+    # gpuCache_ac saves 700 MB, then gpuCache_ab only bRN
+    assert [(action.cache, action.saved_bytes / MB) for action in plan.actions] == [("gpuCache_ac", 700),
+                                                                                   ("gpuCache_ab", 100)]
+    assert plan.projected == 0
+
+
+def test_fps_floor(scene):
+
+    # Measured faster than the frame time outside the references
+    budget_planner = planner(scene, [cost("aRN", 0, 0, rig_ms=40.0)])
+    plan = budget_planner.plan(24, smc_budget.FPS, current_fps=200.0)
+
+    assert plan.current == smc_budget.BASE_FRAME_MS
+    assert plan.summary().startswith("125.0 fps -> 125.0 fps")
+
+
+def test_measured_saving_skips_bad_fps():
+
+    history = smc_budget.smc_export_history.get_history()
+    for fps_before, fps_after in [(0.0, 30.0), (-5.0, 30.0), (20.0, 25.0), (20.0, 0.0)]:
+        history.record(smc_budget.smc_export_history.TOGGLE, "chr_measured", path="/net/gpuCache_a.abc",
+                       fps_before=fps_before, fps_after=fps_after)
+
+    assert smc_budget._measured_saved_ms("chr_measured") == pytest.approx(10.0)
@@ -0,0 +1,63 @@
+import os
+import time
+
+import fake_maya
+import smc_cache_gc
+import smc_journal
+import smc_gpu_cacher
+
+
+def cache(folder, name, size, age):
+    """Cache file of size bytes last used age seconds ago"""
+
+    path = os.path.join(str(folder), name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return path
+
+
+def test_quota_removes_least_recently_used(tmp_path):
+
+    old = cache(tmp_path, "old.abc", 100, 300)
+    middle = cache(tmp_path, "middle.abc", 100, 200)
+    new = cache(tmp_path, "new.abc", 100, 100)
+    cache(tmp_path, "notes.txt", 1000, 1000)
+
+    result = smc_cache_gc.CacheCollector(str(tmp_path), max_bytes=150, max_age=None).collect()
+
+    assert sorted(result.removed) == sorted([old, middle])
+    assert result.reclaimed_bytes == 200
+    assert result.kept_bytes == 100
+    assert os.path.exists(new)
+
+
+def test_age_and_in_use(tmp_path):
+
+    expired = cache(tmp_path, "expired.abc", 10, 3600)
+    in_use = cache(tmp_path, "in_use.abc", 10, 3600)
+    cache(tmp_path, "recent.abc", 10, 10)
+
+    collector = smc_cache_gc.CacheCollector(str(tmp_path), max_bytes=None, max_age=60)
+
+    assert [entry.path for entry in collector.plan([in_use])] == [expired]
+    assert collector.collect_async([in_use]).result().removed == [expired]
+
+
+def test_journal_scratch_in_use(scene, tmp_path):
+
+    scratch = str(tmp_path / "scratch" / "gpuCache_a.abc")
+    fake_maya.write_alembic(scratch, 96, 205)
+
+    journal = smc_journal.get_journal()
+    job = journal.queue("gpu", scene.scene_name, ["chr_bobRN"], 101, 200, "{}")
+    journal.start(job, outputs=[str(tmp_path / "net" / "gpuCache_a.abc")])
+    journal.exported(job, {str(tmp_path / "net" / "gpuCache_a.abc"): smc_journal.smc_transfer.Transfer(
+        scratch, str(tmp_path / "net" / "gpuCache_a.abc"))})
+
+    # Clear temp: nothing is kept but the files in use
+    collector = smc_cache_gc.CacheCollector(str(tmp_path / "scratch"), max_bytes=0, max_age=None)
+    assert collector.collect(smc_gpu_cacher.GpuCacherTool._cache_files_in_use()).removed == []
+    assert os.path.exists(scratch)
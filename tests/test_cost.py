@@ -0,0 +1,59 @@
+import pytest
+
+import smc_cost
+
+
+def record(asset, polygons, deformers, frames, duration, output_bytes=None):
+    return {"asset": asset, "polygons": polygons, "deformers": deformers, "frames": frames, "duration": duration,
+            "output_bytes": output_bytes}
+
+
+def exports(base=3.0, per_mpoly_frame=0.5, per_kdeformer_frame=0.1, bytes_per_poly_frame=20.0):
+    """Exports following the model exactly"""
+
+    records = []
+    for i, (polygons, deformers, frames) in enumerate([(50000, 100, 100), (200000, 40, 120), (10000, 300, 50),
+                                                       (800000, 10, 200), (120000, 150, 80), (400000, 0, 30)]):
+        records.append(record("asset%i" % i, polygons, deformers, frames,
+                              base + per_mpoly_frame * polygons * frames / 1e6 +
+                              per_kdeformer_frame * deformers * frames / 1e3,
+                              bytes_per_poly_frame * polygons * frames))
+
+    return records
+
+
+def test_fit():
+
+    model = smc_cost.CostModel(exports())
+
+    assert model.samples == 6
+    assert model.duration_coefficients == pytest.approx([3.0, 0.5, 0.1], rel=1e-3)
+    assert model.bytes_per_poly_frame == pytest.approx(20.0)
+
+    estimate = model.predict(100000, 50, 100)
+    assert estimate.calibrated
+    assert estimate.duration == pytest.approx(3.0 + 0.5 * 10 + 0.1 * 5, rel=1e-3)
+    assert estimate.output_bytes == 20 * 100000 * 100
+
+
+def test_defaults_below_min_samples():
+
+    model = smc_cost.CostModel(exports()[:smc_cost.MIN_SAMPLES - 1])
+
+    assert model.duration_coefficients == [smc_cost.DEFAULT_BASE_SECONDS, smc_cost.DEFAULT_SECONDS_PER_MPOLY_FRAME,
+                                           smc_cost.DEFAULT_SECONDS_PER_KDEFORMER_FRAME]
+    assert not model.predict(100000, 50, 100).calibrated
+
+
+def test_asset_ratio_and_unloaded_counts():
+
+    records = exports()
+    # The last exports of asset0 took twice the model time
+    records.append(record("asset0", 50000, 100, 100, 2 * records[0]["duration"]))
+    records.append(record("asset0", 50000, 100, 100, 2 * records[0]["duration"]))
+
+    model = smc_cost.CostModel(records)
+    estimate = model.predict(None, None, 100, asset="asset0")
+
+    assert estimate.asset_samples == 3
+    assert estimate.duration == pytest.approx(2 * records[0]["duration"])
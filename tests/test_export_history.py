@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+import smc_export_history
+
+
+def test_record_and_update(tmp_path):
+
+    history = smc_export_history.ExportHistory(str(tmp_path / "history.db"))
+
+    record_id = history.record(smc_export_history.GPU_CACHE, "asset", time=10.0, duration=2.0, fps_before=12.0)
+    history.record(smc_export_history.GPU_CACHE, "asset", time=20.0, duration=4.0)
+    history.record(smc_export_history.TOGGLE, "other", time=30.0)
+    history.update(record_id, fps_after=48.0)
+
+    records = history.records("asset")
+    assert [record["duration"] for record in records] == [2.0, 4.0]
+    assert records[0]["fps_after"] == 48.0
+    assert history.assets(smc_export_history.GPU_CACHE) == ["asset"]
+    assert history.percentiles("asset", pcts=(50,)) == {50: 3.0}
+
+    with pytest.raises(TypeError):
+        history.record(smc_export_history.GPU_CACHE, "asset", fps=1.0)
+    with pytest.raises(TypeError):
+        history.update(record_id, fps=1.0)
+
+
+def test_migrates_old_database(tmp_path):
+
+    path = str(tmp_path / "history.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE exports (id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL NOT NULL, "
+                       "kind TEXT NOT NULL, asset TEXT NOT NULL, scene TEXT, path TEXT, frames INTEGER, "
+                       "polygons INTEGER, flags TEXT, duration REAL, output_bytes INTEGER, fps_before REAL, "
+                       "fps_after REAL)")
+    connection.commit()
+    connection.close()
+
+    history = smc_export_history.ExportHistory(path)
+    history.record(smc_export_history.ABC_CACHE, "asset", deformers=12)
+
+    assert history.records()[0]["deformers"] == 12
+
+
+@pytest.mark.parametrize("kind", ["corrupt", "directory"])
+def test_falls_back_to_memory(tmp_path, kind):
+
+    path = tmp_path / "history.db"
+    if kind == "corrupt":
+        path.write_bytes(b"not a database" * 100)
+    else:
+        path.mkdir()
+
+    history = smc_export_history.ExportHistory(str(path))
+
+    assert history.record(smc_export_history.GPU_CACHE, "asset", duration=1.0) is not None
+    assert len(history.records("asset")) == 1
@@ -0,0 +1,156 @@
+import os
+import json
+
+import fake_maya
+import smc_journal
+
+
+def queue(journal, rfns=("chr_bobRN",)):
+    return journal.queue("gpu", "/proj/shots/sh010/anim/sh010_anim_v001.ma", list(rfns), 96, 205, "{}")
+
+
+def test_replay_after_partial_write(tmp_path):
+
+    path = str(tmp_path / "export_journal.jsonl")
+    journal = smc_journal.ExportJournal(path)
+    job = queue(journal)
+    journal.start(job, name="abcdef", outputs=[str(tmp_path / "abcdef.abc")])
+
+    # Maya crashed while writing the next state
+    job.state = smc_journal.DONE
+    line = json.dumps(job.to_dict(), sort_keys=True)
+    with open(path, "a") as f:
+        f.write(line[:len(line) // 2])
+
+    recovered = smc_journal.ExportJournal(path)
+    assert [(found.id, found.state) for found in recovered.unfinished()] == [(job.id, smc_journal.RUNNING)]
+
+    # The cut line is read again once completed
+    with open(path, "a") as f:
+        f.write(line[len(line) // 2:] + "\n")
+
+    assert recovered.unfinished() == []
+    assert recovered.jobs()[0].state == smc_journal.DONE
+
+
+def test_corrupt_line_skipped(tmp_path):
+
+    path = str(tmp_path / "export_journal.jsonl")
+    journal = smc_journal.ExportJournal(path)
+    job = queue(journal)
+
+    with open(path, "a") as f:
+        f.write("{not json\n")
+
+    other = queue(journal, ["prp_cupRN"])
+
+    assert [found.id for found in smc_journal.ExportJournal(path).jobs()] == [job.id, other.id]
+
+
+def test_recover_exported_job(tmp_path):
+
+    path = str(tmp_path / "export_journal.jsonl")
+    scratch = str(tmp_path / "scratch" / "abcdef.abc")
+    final = str(tmp_path / "net" / "abcdef.abc")
+    fake_maya.write_alembic(scratch, 96, 205)
+
+    journal = smc_journal.ExportJournal(path)
+    job = queue(journal)
+    journal.start(job, name="abcdef", outputs=[final])
+    job.outputs[final]["scratch"] = scratch
+    job.state = smc_journal.EXPORTED
+    journal._append(job)
+
+    recovered = smc_journal.ExportJournal(path)
+    (job,) = recovered.unfinished()
+    assert recovered.recover(job)
+
+    smc_journal.smc_transfer.get_queue().wait()
+
+    assert recovered.jobs()[0].state == smc_journal.DONE
+    assert recovered.validate(recovered.jobs()[0])
+
+
+def test_recover_materials_job(tmp_path):
+
+    path = str(tmp_path / "export_journal.jsonl")
+    journal = smc_journal.ExportJournal(path)
+    job = journal.queue("abc", "/proj/shots/sh010/anim/sh010_anim_v001.ma", ["chr_bobRN"], 101, 200, "{}")
+
+    outputs = {}
+    for name in ("chr_bob.abc", "chr_bob_mats.mb", "chr_bob_mats.ma", "chr_bob_matsSerialized.json"):
+        scratch = str(tmp_path / "scratch" / name)
+        if name.endswith(".abc"):
+            fake_maya.write_alembic(scratch, 96, 205)
+        else:
+            with open(scratch, "w") as f:
+                f.write("{}")
+        outputs[str(tmp_path / "net" / name)] = scratch
+
+    journal.start(job, outputs=list(outputs))
+    for final, scratch in outputs.items():
+        job.outputs[final]["scratch"] = scratch
+    job.state = smc_journal.EXPORTED
+    journal._append(job)
+
+    # An empty material file was cut by the crash
+    mats_json = str(tmp_path / "scratch" / "chr_bob_matsSerialized.json")
+    open(mats_json, "w").close()
+    assert not smc_journal.ExportJournal(path).recover(job)
+
+    with open(mats_json, "w") as f:
+        f.write("{}")
+
+    recovered = smc_journal.ExportJournal(path)
+    assert recovered.recover(job)
+    smc_journal.smc_transfer.get_queue().wait()
+
+    (job,) = recovered.jobs()
+    assert job.state == smc_journal.DONE
+    assert sorted(job.outputs) == sorted(outputs)
+    assert recovered.validate(job)
+
+
+def test_drop_scratch_once_journaled(tmp_path):
+
+    journal = smc_journal.ExportJournal(str(tmp_path / "export_journal.jsonl"))
+    job = queue(journal)
+    scratch = str(tmp_path / "scratch" / "abcdef.abc")
+    final = str(tmp_path / "net" / "abcdef.abc")
+    fake_maya.write_alembic(scratch, 96, 205)
+
+    journal.start(job, outputs=[final])
+    transfer = smc_journal.smc_transfer.get_queue().submit(
+        scratch, final, keep_source=True, callback=journal.transfer_callback(job, drop_scratch=True))
+    journal.exported(job, {final: transfer})
+    smc_journal.smc_transfer.get_queue().wait()
+
+    assert journal.jobs()[0].state == smc_journal.DONE
+    assert not os.path.exists(scratch)
+
+
+def test_compact(tmp_path):
+
+    path = str(tmp_path / "export_journal.jsonl")
+    journal = smc_journal.ExportJournal(path)
+
+    old = queue(journal)
+    journal.fail(old, "interrupted")
+    running = queue(journal, ["prp_cupRN"])
+    journal.start(running, outputs=[str(tmp_path / "prp_cup.abc")])
+
+    # Written by another session, which keeps appending after the compaction
+    other = smc_journal.ExportJournal(path)
+    other_job = queue(other, ["set_roomRN"])
+
+    journal.compact(keep_days=-1)
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [running.id, other_job.id]
+
+    other.fail(other_job, "crashed")
+    assert {job.id: job.state for job in journal.jobs()} == {running.id: smc_journal.RUNNING,
+                                                             other_job.id: smc_journal.FAILED}
+    assert {job.id: job.state for job in other.jobs()} == {running.id: smc_journal.RUNNING,
+                                                           other_job.id: smc_journal.FAILED}
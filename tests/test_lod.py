@@ -0,0 +1,52 @@
+import os
+
+import smc_lod
+import smc_transfer
+import smc_gpu_cache
+import smc_ref_wrapper
+import smc_export_history
+
+
+def test_choose_level_thresholds():
+
+    assert smc_lod.choose_level(0.5, 0, 3) == 0
+    assert smc_lod.choose_level(0.1, 0, 3) == 1
+    assert smc_lod.choose_level(0.01, 0, 3) == 2
+    assert smc_lod.choose_level(0.5, 2, 3) == 0
+
+
+def test_choose_level_hysteresis():
+
+    threshold = smc_lod.LOD_THRESHOLDS[0]
+    inside = threshold * (1 + smc_lod.HYSTERESIS / 2)
+    below = threshold * (1 - smc_lod.HYSTERESIS / 2)
+
+    # Around the threshold the current level holds, both ways
+    assert smc_lod.choose_level(inside, 1, 3) == 1
+    assert smc_lod.choose_level(below, 0, 3) == 0
+
+    assert smc_lod.choose_level(threshold * (1 + 2 * smc_lod.HYSTERESIS), 1, 3) == 0
+    assert smc_lod.choose_level(threshold * (1 - 2 * smc_lod.HYSTERESIS), 0, 3) == 1
+
+
+def test_choose_level_bounds():
+
+    assert smc_lod.choose_level(0.0, 5, 3) == 2
+    assert smc_lod.choose_level(1.0, -1, 3) == 0
+    assert smc_lod.choose_level(0.0, 0, 1) == 0
+
+
+def test_lod_exports_recorded_at_level_0(scene, tmp_path):
+
+    rfn = scene.add_reference("/proj/assets/chr/chr_bob/rig/chr_bob_rig_v001.ma", "chr_bob", faces=4000)
+    cache = smc_gpu_cache.GpuCacheWrapper([rfn], 101, 200, dir=str(tmp_path / "caches"), lods=True)
+    cache.export_abc()
+    smc_transfer.get_queue().wait()
+
+    assert all(os.path.exists(path) for path in cache.lod_paths())
+
+    # Decimated levels would cost the asset at a fraction of its size
+    records = smc_export_history.get_history().records(asset=cache.asset_name, scene=scene.scene_name)
+    assert [(record["path"], record["polygons"]) for record in records] == [
+        (cache.filepath, smc_ref_wrapper.RefWrapper(rfn).polygon_count)]
+    assert cache.history_id == records[0]["id"]
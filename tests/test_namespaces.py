@@ -0,0 +1,51 @@
+import maya.cmds as cmds
+
+import smc_ref_wrapper
+import smc_namespaces
+
+
+def names(plan):
+    return sorted((rename.ref.reference_node, rename.new) for rename in plan.renames)
+
+
+def test_plan_collisions(scene):
+
+    bob = scene.add_reference("/proj/assets/chr_bob.ma", "bob")
+    bob_copy = scene.add_reference("/proj/assets/chr_bob.ma{1}", "chr_bob1")
+    cup = scene.add_reference("/proj/assets/prp_cup.ma", "prp_cup")
+    scene.add_reference("/proj/assets/set_room.ma", "chr_bob")
+
+    refs = [smc_ref_wrapper.RefWrapper(rfn) for rfn in (bob, bob_copy, cup)]
+    plan = smc_namespaces.plan_namespaces(refs)
+
+    # chr_bob is held by a reference outside the plan, chr_bob1 by bob_copy, which frees it as it moves
+    assert names(plan) == [(bob, "chr_bob1"), (bob_copy, "chr_bob2")]
+    assert [ref.reference_node for ref in plan.unchanged] == [cup]
+    assert len(plan.collisions) == 2
+    assert not cmds.namespace(exists=":chr_bob2")
+
+
+def test_plan_names(scene):
+
+    bob = scene.add_reference("/proj/assets/chr_bob.ma", "bob")
+    cup = scene.add_reference("/proj/assets/prp_cup.ma", "cup", loaded=False)
+
+    refs = [smc_ref_wrapper.RefWrapper(rfn) for rfn in (bob, cup)]
+    plan = smc_namespaces.plan_namespaces(refs, {bob: "hero", cup: "hero"})
+
+    assert names(plan) == [(bob, "hero"), (cup, "hero1")]
+
+
+def test_apply_swap(scene):
+
+    a = scene.add_reference("/proj/assets/chr_a.ma", "chr_b")
+    b = scene.add_reference("/proj/assets/chr_b.ma", "chr_a", loaded=False)
+
+    refs = [smc_ref_wrapper.RefWrapper(rfn) for rfn in (a, b)]
+    plan = smc_namespaces.normalize_namespaces(refs)
+
+    assert not plan.failed
+    assert cmds.referenceQuery(a, namespace=True) == ":chr_a"
+    assert cmds.referenceQuery(b, namespace=True) == ":chr_b"
+    assert not cmds.referenceQuery(b, isLoaded=True)
+    assert [ref.namespace for ref in refs] == ["chr_a", "chr_b"]
@@ -0,0 +1,46 @@
+import os
+
+import smc_prefetch
+
+
+def cache(folder, name, size):
+    path = str(folder / name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def test_warm(tmp_path):
+    assert smc_prefetch.warm(cache(tmp_path, "a.abc", 1000)) == 1000
+
+
+def test_prefetch_within_budget(tmp_path):
+
+    a = cache(tmp_path, "a.abc", 600)
+    b = cache(tmp_path, "b.abc", 600)
+    c = cache(tmp_path, "c.abc", 300)
+
+    prefetcher = smc_prefetch.Prefetcher(budget_bytes=1000)
+
+    # b is past the budget, c still fits after it, missing files and duplicates are skipped
+    assert prefetcher.prefetch([a, str(tmp_path / "missing.abc"), b, c, a]) == [a, c]
+    assert prefetcher.warmed_bytes == 900
+
+
+def test_prefetch_warms_once(tmp_path):
+
+    a = cache(tmp_path, "a.abc", 100)
+    b = cache(tmp_path, "b.abc", 100)
+    prefetcher = smc_prefetch.Prefetcher(budget_bytes=1000)
+
+    assert prefetcher.prefetch([a, b]) == [a, b]
+    assert prefetcher.prefetch([a, b]) == []
+
+    # Exported again
+    cache(tmp_path, "a.abc", 200)
+    os.utime(a, (0, 0))
+    assert prefetcher.prefetch([b, a]) == [a]
+
+    # Dropped from the list, it no longer counts
+    assert prefetcher.prefetch([a]) == []
+    assert prefetcher.warmed_bytes == 200
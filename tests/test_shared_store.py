@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+
+import smc_transfer
+import smc_shared_store
+import smc_gpu_cache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return smc_shared_store.SharedStore(str(tmp_path / "store"))
+
+
+def write(path, data=b"ogawa"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_key():
+
+    key = smc_shared_store.SharedStore.key({"rfns": ["chr_bobRN"], "start": 96, "flags": "-simplifyMethod none"})
+
+    assert key == smc_shared_store.SharedStore.key({"flags": "-simplifyMethod none", "start": 96,
+                                                    "rfns": ["chr_bobRN"]})
+    assert key != smc_shared_store.SharedStore.key({"rfns": ["chr_bobRN"], "start": 97,
+                                                    "flags": "-simplifyMethod none"})
+
+
+def test_publish_and_fetch(store, tmp_path):
+
+    key = store.key({"asset": "chr_bob"})
+    src = write(str(tmp_path / "work" / "a.abc"))
+
+    assert store.acquire(key, timeout=0)
+    with pytest.raises(smc_shared_store.StoreLockTimeout):
+        store.acquire(key, timeout=0)
+
+    store.publish(key, src)
+
+    assert store.has(key)
+    assert not os.path.exists(store._lock_path(key))
+    # Published meanwhile, nothing to write
+    assert not store.acquire(key, timeout=0)
+
+    dest = str(tmp_path / "other" / "a.abc")
+    assert store.fetch(key, dest)
+    with open(dest, "rb") as f:
+        assert f.read() == b"ogawa"
+    assert not store.fetch(store.key({"asset": "prp_cup"}), dest)
+
+
+def test_stale_lock(store):
+
+    key = store.key({"asset": "chr_bob"})
+    lock_path = write(store._lock_path(key), b"{}")
+    stale = time.time() - store.STALE_LOCK_SECONDS - 1
+    os.utime(lock_path, (stale, stale))
+
+    assert store.acquire(key, timeout=0)
+
+
+def test_failed_publish_releases(store, tmp_path):
+
+    key = store.key({"asset": "chr_bob"})
+    transfer_queue = smc_transfer.TransferQueue(str(tmp_path / "scratch"))
+
+    assert store.acquire(key, timeout=0)
+    store.publish(key, str(tmp_path / "missing.abc"), transfer_queue=transfer_queue)
+    transfer_queue.wait()
+
+    assert not store.has(key)
+    assert not os.path.exists(store._lock_path(key))
+
+    assert store.acquire(key, timeout=0)
+    with pytest.raises(OSError):
+        store.publish(key, str(tmp_path / "missing.abc"))
+    assert not os.path.exists(store._lock_path(key))
+
+
+def test_export_publishes_only_with_the_lock(scene, store, remote):
+
+    rfn = scene.add_reference("/proj/assets/chr/chr_bob/rig/chr_bob_rig_v001.ma", "chr_bob")
+    cache = smc_gpu_cache.GpuCacheWrapper([rfn], 101, 200, dir=str(remote / "net"), store=store, name="a")
+    key = cache.store_key(96.0, 205.0, cache.quality.gpu_flags())
+
+    # Another artist is exporting it: the forced export neither publishes nor releases their lock
+    lock_path = write(store._lock_path(key), b"{}")
+    cache.export_abc(force=True)
+    smc_transfer.get_queue().wait()
+
+    assert os.path.exists(lock_path) and not store.has(key)
+
+    os.remove(lock_path)
+    cache.export_abc(force=True)
+    smc_transfer.get_queue().wait()
+
+    assert store.has(key) and not os.path.exists(lock_path)
@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+
+import smc_gpu_cacher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEADLESS = """
+import sys
+sys.path[:0] = [%r, %r]
+import fake_maya
+fake_maya.Scene().install()
+import smc_batch, smc_budget, smc_gpu_cache
+print(",".join(sorted(name for name in sys.modules if name.startswith(("PySide2", "smc_gpu_cacher")))))
+""" % (ROOT, os.path.join(ROOT, "benchmarks"))
+
+
+def test_headless_modules_without_qt():
+
+    output = subprocess.check_output([sys.executable, "-c", HEADLESS], cwd=ROOT, universal_newlines=True)
+    assert output.strip() == ""
+
+
+def test_widgets_disabled_while_loading(scene):
+
+    scene.add_reference("/proj/assets/chr/chr_bob/rig/chr_bob_rig_v001.ma", "chr_bob")
+    tool = smc_gpu_cacher.GpuCacherTool()
+
+    toggles = [tool.prefetch_checkbox, tool.auto_lod_checkbox, tool.visibility_checkbox, tool.visibility_stride_spin]
+    assert not any(widget.isEnabled() for widget in toggles + tool._action_widgets)
+
+    tool.finish_loading()
+
+    assert all(widget.isEnabled() for widget in toggles + tool._action_widgets)
+    assert list(tool._ref_items) == ["chr_bobRN"]
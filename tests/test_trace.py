@@ -0,0 +1,63 @@
+import json
+
+import pytest
+import maya.cmds as cmds
+
+import smc_trace
+
+
+@pytest.fixture
+def tracing(scene):
+
+    smc_trace.clear()
+    smc_trace.enable()
+    yield scene
+    smc_trace.disable()
+    smc_trace.clear()
+
+
+@smc_trace.traced("scan")
+def scan():
+    return cmds.ls(type="reference")
+
+
+def test_disabled_records_nothing(scene):
+
+    smc_trace.clear()
+    with smc_trace.span("idle"):
+        scan()
+
+    assert not smc_trace.is_enabled()
+    assert smc_trace.events() == []
+
+
+def test_spans_count_maya_calls(tracing, tmp_path):
+
+    with smc_trace.span("refresh", rows=2):
+        scan()
+        scan()
+        cmds.ls(type="gpuCache")
+
+    summary = smc_trace.summary()
+    assert summary["scan"]["count"] == 2
+    assert summary["scan"]["maya_calls"] == 2
+    assert summary["refresh"]["count"] == 1
+    assert summary["refresh"]["maya_calls"] == 3
+
+    (refresh,) = [event for event in smc_trace.events() if event["name"] == "refresh"]
+    assert refresh["args"]["rows"] == 2
+
+    path = smc_trace.export_chrome_trace(str(tmp_path / "trace.json"))
+    with open(path) as f:
+        assert len(json.load(f)["traceEvents"]) == 3
+
+
+def test_disable_restores_maya(tracing):
+
+    patched = cmds.ls
+    smc_trace.disable()
+
+    assert cmds.ls is not patched
+    assert tracing.calls["ls"] == 0
+    cmds.ls(type="reference")
+    assert tracing.calls["ls"] == 1
@@ -0,0 +1,83 @@
+import os
+
+import smc_transfer
+import smc_gpu_cache
+
+
+def write(path, data=b"ogawa"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_transfer(tmp_path):
+
+    transfer_queue = smc_transfer.TransferQueue(str(tmp_path / "scratch"))
+    src = write(str(tmp_path / "scratch" / "a.abc"))
+    dst = str(tmp_path / "net" / "a.abc")
+
+    transfer = transfer_queue.submit(src, dst)
+    transfer_queue.wait(dst)
+
+    assert transfer.state == smc_transfer.Transfer.DONE
+    assert transfer.checksum == smc_transfer.checksum(dst)
+    assert not os.path.exists(src)
+    assert os.listdir(str(tmp_path / "net")) == ["a.abc"]
+    assert transfer_queue.submit(dst, dst) is None
+
+
+def test_failed_transfer(tmp_path):
+
+    transfer_queue = smc_transfer.TransferQueue(str(tmp_path / "scratch"))
+    dst = str(tmp_path / "net" / "a.abc")
+    states = []
+
+    transfer = transfer_queue.submit(str(tmp_path / "scratch" / "missing.abc"), dst,
+                                     callback=lambda transfer: states.append(transfer.state))
+    transfer_queue.wait()
+
+    assert states == [smc_transfer.Transfer.FAILED]
+    assert transfer_queue.failed == [transfer]
+    assert transfer_queue.resolve(dst) == dst
+    assert not os.path.exists(dst)
+
+
+def test_wait_for_callback_transfers(tmp_path):
+
+    transfer_queue = smc_transfer.TransferQueue(str(tmp_path / "scratch"))
+    src = write(str(tmp_path / "scratch" / "a.abc"))
+    dst = str(tmp_path / "net" / "a.abc")
+    copy = str(tmp_path / "store" / "a.abc")
+
+    transfer_queue.submit(src, dst, keep_source=True,
+                          callback=lambda transfer: transfer_queue.submit(transfer.src, copy))
+    transfer_queue.wait()
+
+    assert os.path.exists(dst) and os.path.exists(copy)
+    assert not transfer_queue.pending
+
+
+def test_repoint_in_main_thread(scene, tmp_path):
+
+    scratch = write(str(tmp_path / "scratch" / "gpuCache_a.abc"))
+    final = str(tmp_path / "net" / "gpuCache_a.abc")
+    cache = scene.add_gpu_cache("gpuCache_a", [], final)
+    scene.nodes[cache].attrs["cacheFileName"] = scratch
+
+    # Exports of earlier tests
+    transfer_queue = smc_transfer.get_queue()
+    transfer_queue.wait()
+    smc_gpu_cache.repoint_transferred()
+
+    transfer = transfer_queue.submit(scratch, final, keep_source=True, callback=smc_gpu_cache.repoint_callback())
+    transfer_queue.wait()
+
+    # The fake maya.cmds raises outside the main thread, the transfer thread only records the transfer
+    assert scene.nodes[cache].attrs["cacheFileName"] == scratch
+    assert os.path.exists(scratch)
+
+    assert smc_gpu_cache.repoint_transferred() == [transfer]
+    assert scene.nodes[cache].attrs["cacheFileName"] == final
+    assert not os.path.exists(scratch)
+    assert smc_gpu_cache.repoint_transferred() == []
@@ -0,0 +1,74 @@
+import smc_visibility
+
+
+def build(scene, tmp_path):
+    """Cache of a reference at the origin, in front of persp, and one behind the camera"""
+
+    cache_refs = {}
+    for name, box in (("front", [-1.0, -1.0, -1.0, 1.0, 1.0, 1.0]),
+                      ("behind", [200.0, 150.0, 200.0, 202.0, 152.0, 202.0])):
+        rfn = scene.add_reference(str(tmp_path / (name + ".ma")), name)
+        scene.nodes[name + ":root"].attrs["boundingBox"] = box
+        cache = scene.add_gpu_cache(name + "_cache", [rfn], str(tmp_path / (name + ".abc")))
+        cache_refs[cache] = [rfn]
+
+    return cache_refs
+
+
+def test_frustum(scene):
+
+    frustum = smc_visibility.Frustum("persp")
+
+    assert frustum.intersects([-1.0, -1.0, -1.0, 1.0, 1.0, 1.0])
+    assert not frustum.intersects([200.0, 150.0, 200.0, 202.0, 152.0, 202.0])
+    # Beyond the far clip plane
+    assert not frustum.intersects([-20000.0, -15000.0, -20000.0, -19990.0, -14990.0, -19990.0])
+
+
+def test_visible_caches(scene, tmp_path):
+
+    cache_refs = build(scene, tmp_path)
+    scene.current_time = 150
+
+    visible = smc_visibility.visible_caches(cache_refs, camera="persp")
+
+    assert visible == {"front_cache": True, "behind_cache": False}
+    assert scene.current_time == 150
+
+
+def test_apply_states(scene, tmp_path):
+
+    cache_refs = build(scene, tmp_path)
+    visible = {"front_cache": True, "behind_cache": False}
+
+    # The animated reference on screen keeps its rig, the rest go behind their caches
+    states = smc_visibility.plan_states(visible, cache_refs, animated_rfns=["frontRN"])
+    assert states == {"front_cache": False, "behind_cache": True}
+
+    changes = smc_visibility.apply_states(states, cache_refs)
+
+    assert changes.caches_on == ["behind_cache"]
+    assert changes.unloaded == ["behindRN"]
+    assert changes.skipped == 1
+    assert scene.nodes["behind_cache"].attrs["cacheFileName"] == str(tmp_path / "behind.abc")
+    assert not scene.references["behindRN"].loaded
+
+    # Already applied, nothing to do
+    assert not smc_visibility.apply_states(states, cache_refs)
+
+    changes = smc_visibility.apply_states({"behind_cache": False}, cache_refs)
+    assert changes.loaded == ["behindRN"]
+    assert scene.references["behindRN"].loaded
+
+
+def test_auto_enabler_samples_once(scene, tmp_path):
+
+    cache_refs = build(scene, tmp_path)
+    enabler = smc_visibility.AutoEnabler()
+
+    enabler.update(cache_refs, camera="persp")
+    samples = scene.calls["exactWorldBoundingBox"]
+    changes = enabler.update(cache_refs, animated_rfns=["frontRN"], camera="persp")
+
+    assert scene.calls["exactWorldBoundingBox"] == samples
+    assert changes.caches_off == ["front_cache"]